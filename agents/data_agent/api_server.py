@@ -1,7 +1,9 @@
 # Updated Flask API (api_server.py)
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from data_agent import DataAgent
+import atexit
+import json
 import logging
 import os
 
@@ -11,9 +13,33 @@ CORS(app)
 # Initialize with your database connection
 data_agent = DataAgent()
 
+# Schema changes and index builds happen here, never on a user request
+if data_agent.db:
+    data_agent.db.migrate()
+
+# Close the shared async HTTP client and background pools on shutdown
+atexit.register(data_agent.stop_background_tasks)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def stream_events(events, stream_format: str = 'sse'):
+    """Send DataAgent events as server-sent events (default) or newline-delimited JSON"""
+    def generate():
+        for event in events:
+            if stream_format == 'ndjson':
+                yield json.dumps(event, default=str) + '\n'
+            else:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+    
+    mimetype = 'application/x-ndjson' if stream_format == 'ndjson' else 'text/event-stream'
+    # Tell proxies not to buffer, so every event reaches the client as soon as it is produced
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+def get_stream_format(data=None) -> str:
+    return request.args.get('format') or (data or {}).get('format') or 'sse'
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -31,12 +57,26 @@ def search_compounds():
         query = data.get('query', '')
         limit = data.get('limit', 10)
         include_ai_analysis = data.get('include_ai_analysis', False)
+        use_async = data.get('async', False)
+        max_workers = data.get('max_workers')
+        force_refresh = data.get('force_refresh', False)
+        
+        # Keyset pagination over stored compounds: send paginate=true, then the returned next_cursor
+        if data.get('paginate') or data.get('cursor'):
+            try:
+                result = data_agent.search_stored_compounds(query, limit, cursor=data.get('cursor'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return jsonify(result), 200 if result.get('success') else 500
         
         if not query:
             return jsonify({'error': 'Query parameter is required'}), 400
         
         # Use the enhanced data agent with AI analysis option
-        result = data_agent.process_compound_query(query, limit, include_ai_analysis)
+        result = data_agent.process_compound_query(query, limit, include_ai_analysis,
+                                                   use_async=use_async, max_workers=max_workers,
+                                                   force_refresh=force_refresh,
+                                                   batched_analysis=data.get('batched_analysis', False))
         
         return jsonify(result)
     
@@ -52,11 +92,29 @@ def search_compounds():
             }
         }), 500
 
+@app.route('/api/v1/compounds/export', methods=['GET'])
+def export_compounds():
+    """Stream stored compounds (optionally filtered by ?query=) as newline-delimited JSON"""
+    query = request.args.get('query', '')
+    batch_size = request.args.get('batch_size', 1000, type=int)
+    
+    def generate():
+        try:
+            for compound in data_agent.iter_stored_compounds(query, batch_size=batch_size):
+                yield json.dumps(compound, default=str) + '\n'
+        except Exception as e:
+            logger.error(f"Export error: {e}")
+            # The 200 status is already sent: a final error line marks the export as incomplete
+            yield json.dumps({'error': str(e)}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/v1/compounds/<chembl_id>', methods=['GET'])
 def get_compound(chembl_id):
     """Get compound by ChEMBL ID"""
     try:
-        compound = data_agent.get_compound_by_chembl_id(chembl_id)
+        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
+        compound = data_agent.get_compound_by_chembl_id(chembl_id, force_refresh=force_refresh)
         
         if not compound:
             return jsonify({'error': 'Compound not found'}), 404
@@ -85,7 +143,8 @@ def analyze_compound(chembl_id):
                 'error': 'Compound not found'
             }), 404
         
-        analysis = data_agent.analyze_compound_with_ai(compound)
+        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
+        analysis = data_agent.analyze_compound_with_ai(compound, force_refresh=force_refresh)
         
         return jsonify({
             'success': True,
@@ -100,6 +159,52 @@ def analyze_compound(chembl_id):
             'error': str(e)
         }), 500
 
+@app.route('/api/v1/compounds/analyze/<chembl_id>/stream', methods=['POST'])
+def analyze_compound_stream(chembl_id):
+    """Analyze a specific compound using AI, streaming Ollama tokens as they are generated"""
+    try:
+        compound = data_agent.get_compound_by_chembl_id(chembl_id)
+        
+        if not compound:
+            return jsonify({
+                'success': False,
+                'error': 'Compound not found'
+            }), 404
+        
+        force_refresh = request.args.get('force_refresh', 'false').lower() == 'true'
+        
+        def events():
+            yield {'event': 'compound', 'data': {'chembl_id': chembl_id, 'compound': compound}}
+            yield from data_agent.stream_compound_analysis(compound, force_refresh=force_refresh)
+            yield {'event': 'done', 'data': {'chembl_id': chembl_id}}
+        
+        return stream_events(events(), get_stream_format())
+        
+    except Exception as e:
+        logger.error(f"Analyze compound stream error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/v1/compounds/<chembl_id>/bioactivities/ingest', methods=['POST'])
+def ingest_bioactivities(chembl_id):
+    """Stream all ChEMBL bioactivities of a compound into the database"""
+    try:
+        data = request.get_json(silent=True) or {}
+        chunk_size = data.get('chunk_size', 1000)
+        
+        result = data_agent.ingest_bioactivities(chembl_id, chunk_size=chunk_size)
+        
+        return jsonify(result), 200 if result.get('success') else 500
+        
+    except Exception as e:
+        logger.error(f"Ingest bioactivities error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/v1/model/info', methods=['GET'])
 def get_model_info():
     """Get current Ollama model information"""
@@ -145,33 +250,11 @@ def batch_analyze_compounds():
                 'error': 'chembl_ids parameter is required'
             }), 400
         
-        results = []
-        for chembl_id in chembl_ids:
-            try:
-                compound = data_agent.get_compound_by_chembl_id(chembl_id)
-                if compound:
-                    analysis = data_agent.analyze_compound_with_ai(compound)
-                    results.append({
-                        'chembl_id': chembl_id,
-                        'compound': compound,
-                        'analysis': analysis
-                    })
-                else:
-                    results.append({
-                        'chembl_id': chembl_id,
-                        'error': 'Compound not found'
-                    })
-            except Exception as e:
-                results.append({
-                    'chembl_id': chembl_id,
-                    'error': str(e)
-                })
+        result = data_agent.batch_analyze_compounds(chembl_ids, max_workers=data.get('max_workers'),
+                                                    force_refresh=data.get('force_refresh', False),
+                                                    batched=data.get('batched', False))
         
-        return jsonify({
-            'success': True,
-            'results': results,
-            'total_processed': len(results)
-        })
+        return jsonify(result)
         
     except Exception as e:
         logger.error(f"Batch analyze error: {e}")
@@ -180,6 +263,30 @@ def batch_analyze_compounds():
             'error': str(e)
         }), 500
 
+@app.route('/api/v1/compounds/batch-analyze/stream', methods=['POST'])
+def batch_analyze_compounds_stream():
+    """Analyze multiple compounds with AI, streaming each result as it is ready"""
+    try:
+        data = request.get_json()
+        chembl_ids = data.get('chembl_ids', [])
+        
+        if not chembl_ids:
+            return jsonify({
+                'success': False,
+                'error': 'chembl_ids parameter is required'
+            }), 400
+        
+        events = data_agent.stream_batch_analysis(chembl_ids, max_workers=data.get('max_workers'),
+                                                  force_refresh=data.get('force_refresh', False))
+        return stream_events(events, get_stream_format(data))
+        
+    except Exception as e:
+        logger.error(f"Batch analyze stream error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/v1/compounds/search-and-analyze', methods=['POST'])
 def search_and_analyze_compounds():
     """Search compounds and automatically analyze them with AI"""
@@ -187,12 +294,18 @@ def search_and_analyze_compounds():
         data = request.get_json()
         query = data.get('query', '')
         limit = data.get('limit', 5)  # Lower default for AI analysis
+        use_async = data.get('async', False)
+        max_workers = data.get('max_workers')
+        force_refresh = data.get('force_refresh', False)
         
         if not query:
             return jsonify({'error': 'Query parameter is required'}), 400
         
         # Always include AI analysis for this endpoint
-        result = data_agent.process_compound_query(query, limit, include_ai_analysis=True)
+        result = data_agent.process_compound_query(query, limit, include_ai_analysis=True,
+                                                   use_async=use_async, max_workers=max_workers,
+                                                   force_refresh=force_refresh,
+                                                   batched_analysis=data.get('batched_analysis', False))
         
         return jsonify(result)
     
@@ -208,6 +321,29 @@ def search_and_analyze_compounds():
             }
         }), 500
 
+@app.route('/api/v1/compounds/search-and-analyze/stream', methods=['POST'])
+def search_and_analyze_compounds_stream():
+    """Search compounds and analyze them with AI, streaming compounds and analyses as they are ready"""
+    try:
+        data = request.get_json()
+        query = data.get('query', '')
+        limit = data.get('limit', 5)  # Lower default for AI analysis
+        
+        if not query:
+            return jsonify({'error': 'Query parameter is required'}), 400
+        
+        events = data_agent.stream_compound_query(query, limit, include_ai_analysis=True,
+                                                  max_workers=data.get('max_workers'),
+                                                  force_refresh=data.get('force_refresh', False))
+        return stream_events(events, get_stream_format(data))
+    
+    except Exception as e:
+        logger.error(f"Search and analyze stream error: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
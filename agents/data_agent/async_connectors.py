@@ -0,0 +1,358 @@
+# async_connectors.py
+import asyncio
+import json
+import logging
+import os
+import time
+import weakref
+from typing import Dict, List, Optional
+from urllib.parse import quote, urlencode, urlsplit
+
+import aiohttp
+
+from chembl_connector import ChEMBLConnector
+from fetch_context import fetch_once_async
+from http_cache import get_response_cache
+from negative_cache import get_negative_cache
+from rate_limiter import THROTTLED_STATUS_CODES, get_rate_limiter
+
+
+class AsyncHTTPClient:
+    """
+    Shared aiohttp session for the async connectors.
+
+    One connection pool serves ChEMBL, PubChem and Ollama; a semaphore bounds
+    the number of requests in flight, every request waits on the host's
+    shared token bucket, and GET responses go through the same on-disk
+    response cache as the blocking connectors.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, max_connections: int = 50, timeout: float = 30):
+        self.max_concurrency = max_concurrency or int(os.getenv('ASYNC_MAX_CONCURRENCY', '10'))
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.throttle_retries = 3
+        self.session = None
+        self.cache = get_response_cache()
+        self._semaphore = None
+        self.logger = logging.getLogger(__name__)
+
+    async def __aenter__(self) -> 'AsyncHTTPClient':
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """Create the session and its connection pool on the running event loop"""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={'Accept': 'application/json'}
+        )
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+        self.session = None
+
+    async def get_json(self, url: str, params: Optional[Dict] = None) -> Dict:
+        """GET a JSON document, answering from the response cache when possible"""
+        if params:
+            url = f"{url}?{urlencode(params)}"
+
+        ttl = self.cache.ttl_for(url) if self.cache else 0
+        key = self.cache.make_key('GET', url) if ttl else None
+        if key:
+            entry = await asyncio.to_thread(self.cache.get, key)
+            if entry and entry['expires_at'] > time.time():
+                self.cache.record('hits')
+                return json.loads(entry['body'])
+
+        status, headers, body = await self.request('GET', url)
+        if key:
+            self.cache.record('misses')
+            if status == 200:
+                await asyncio.to_thread(self.cache.set_raw, key, url, status, headers, body, ttl)
+        return json.loads(body)
+
+    async def post_json(self, url: str, json_body: Optional[Dict] = None, data: Optional[Dict] = None,
+                        rate_limited: bool = True) -> Dict:
+        """POST and decode a JSON response"""
+        status, headers, body = await self.request('POST', url, json=json_body, data=data,
+                                                   rate_limited=rate_limited)
+        return json.loads(body)
+
+    async def request(self, method: str, url: str, rate_limited: bool = True, **kwargs):
+        """Send a request with bounded concurrency and rate limiting; returns (status, headers, body)"""
+        limiter = get_rate_limiter(url) if rate_limited else None
+
+        async with self._semaphore:
+            for attempt in range(self.throttle_retries + 1):
+                if limiter:
+                    await limiter.acquire_async()
+
+                async with self.session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+                    if limiter:
+                        limiter.update_from_response(response.status, response.headers)
+
+                    if response.status in THROTTLED_STATUS_CODES and attempt < self.throttle_retries:
+                        continue
+                    response.raise_for_status()
+                    return response.status, dict(response.headers), body
+
+
+# One open client per event loop, so every query on a loop reuses its warm connections
+_loop_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncHTTPClient]' = weakref.WeakKeyDictionary()
+
+
+async def get_async_client() -> AsyncHTTPClient:
+    """Get the AsyncHTTPClient of the running event loop, opening it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _loop_clients.get(loop)
+    if client is None or client.session is None:
+        client = AsyncHTTPClient()
+        await client.open()
+        _loop_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Close the AsyncHTTPClient of the running event loop, if it has one"""
+    client = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if client:
+        await client.close()
+
+
+class AsyncChEMBLConnector:
+    """
+    Non-blocking counterpart of ChEMBLConnector; returns the same processed records
+    """
+
+    def __init__(self, client: AsyncHTTPClient, base_url: str = "https://www.ebi.ac.uk/chembl/api/data"):
+        self.client = client
+        self.base_url = base_url
+        # Record parsing is shared with the blocking connector
+        self.parser = ChEMBLConnector(base_url)
+        self.batch_size = self.parser.batch_size
+        self.logger = logging.getLogger(__name__)
+
+    async def search_compound_ids(self, query: str, limit: int = 20) -> List[str]:
+        """Search compounds and return only the ChEMBL IDs of the hits, in rank order"""
+        try:
+            data = await self.client.get_json(f"{self.base_url}/molecule/search",
+                                              {'q': query, 'limit': limit, 'format': 'json'})
+            return [m['molecule_chembl_id'] for m in data.get('molecules', []) if m.get('molecule_chembl_id')]
+        except Exception as e:
+            self.logger.error(f"ChEMBL async search error: {e}")
+            return []
+
+    async def search_compounds(self, query: str, limit: int = 20) -> List[Dict]:
+        """Search compounds and resolve every hit with bulk molecule requests"""
+        try:
+            data = await self.client.get_json(f"{self.base_url}/molecule/search",
+                                              {'q': query, 'limit': limit, 'format': 'json'})
+            molecules = data.get('molecules', [])
+            self.logger.info(f"ChEMBL search returned {len(molecules)} compounds")
+
+            chembl_ids = [m.get('molecule_chembl_id') for m in molecules if m.get('molecule_chembl_id')]
+            detailed_compounds = await self.get_compounds_batch(chembl_ids)
+
+            return [
+                detailed_compounds.get(m['molecule_chembl_id']) or self.parser._process_compound_data(m)
+                for m in molecules if m.get('molecule_chembl_id')
+            ]
+        except Exception as e:
+            self.logger.error(f"ChEMBL async search error: {e}")
+            return []
+
+    async def get_compounds_batch(self, chembl_ids: List[str]) -> Dict[str, Dict]:
+        """Get detailed data for many compounds, fetching all chunks concurrently"""
+        unique_ids = list(dict.fromkeys(cid for cid in chembl_ids if cid))
+        chunks = [unique_ids[i:i + self.batch_size] for i in range(0, len(unique_ids), self.batch_size)]
+
+        raw_compounds = {}
+        for molecules in await asyncio.gather(*(self._fetch_molecule_chunk(chunk) for chunk in chunks)):
+            for compound_data in molecules:
+                raw_compounds[compound_data.get('molecule_chembl_id')] = compound_data
+
+        processed = {
+            chembl_id: self.parser._process_compound_data(raw_compounds[chembl_id])
+            for chembl_id in unique_ids if chembl_id in raw_compounds
+        }
+        await asyncio.gather(*(
+            self._fill_missing_molecule_data(chembl_id, compound)
+            for chembl_id, compound in processed.items()
+        ))
+        return processed
+
+    async def _fetch_molecule_chunk(self, chunk: List[str]) -> List[Dict]:
+        """Fetch one molecule_chembl_id__in chunk, following page_meta.next"""
+        molecules = []
+        url = f"{self.base_url}/molecule.json"
+        params = {'molecule_chembl_id__in': ','.join(chunk), 'limit': len(chunk), 'format': 'json'}
+        try:
+            while url:
+                data = await self.client.get_json(url, params)
+                molecules.extend(data.get('molecules', []))
+                url = self._next_page_url(data)
+                params = None
+        except Exception as e:
+            self.logger.error(f"ChEMBL async batch fetch error for {len(chunk)} compounds: {e}")
+        return molecules
+
+    def _next_page_url(self, data: Dict) -> Optional[str]:
+        next_path = (data.get('page_meta') or {}).get('next')
+        if not next_path:
+            return None
+        base = urlsplit(self.base_url)
+        return f"{base.scheme}://{base.netloc}{next_path}"
+
+    async def _fill_missing_molecule_data(self, chembl_id: str, processed: Dict):
+        """Fill missing formula/weight/structure fields from the dedicated endpoints"""
+        if processed.get('molecular_formula') and processed.get('molecular_weight'):
+            return
+
+        results = await asyncio.gather(
+            self.client.get_json(f"{self.base_url}/molecule/{chembl_id}/properties"),
+            self.client.get_json(f"{self.base_url}/molecule/{chembl_id}/structures"),
+            return_exceptions=True
+        )
+        props, structs = [r if isinstance(r, dict) else {} for r in results]
+
+        for prop in props.get('properties', [])[:1]:
+            for key in ('molecular_formula', 'molecular_weight', 'alogp', 'hbd', 'hba', 'psa', 'rtb',
+                        'num_ro5_violations'):
+                if prop.get(key) is not None and not processed.get(key):
+                    processed[key] = prop[key]
+        for struct in structs.get('structures', [])[:1]:
+            for key, source in (('smiles', 'canonical_smiles'), ('inchi', 'standard_inchi'),
+                                ('inchi_key', 'standard_inchi_key')):
+                if struct.get(source) is not None and not processed.get(key):
+                    processed[key] = struct[source]
+
+    async def get_bioactivity_count(self, chembl_id: str) -> Optional[int]:
+        """Get the total number of bioactivities for a compound from page_meta.total_count"""
+        return await fetch_once_async(('chembl', 'activity_count', chembl_id),
+                                      lambda: self._fetch_bioactivity_count(chembl_id))
+
+    async def _fetch_bioactivity_count(self, chembl_id: str) -> Optional[int]:
+        try:
+            data = await self.client.get_json(f"{self.base_url}/activity.json", {
+                'molecule_chembl_id': chembl_id,
+                'limit': 1,
+                'only': 'activity_id',
+                'format': 'json'
+            })
+            total_count = (data.get('page_meta') or {}).get('total_count')
+            return int(total_count) if total_count is not None else None
+        except Exception as e:
+            self.logger.error(f"Async bioactivity count error for {chembl_id}: {e}")
+            return None
+
+    async def get_bioactivity_counts(self, chembl_ids: List[str]) -> Dict[str, int]:
+        """Get bioactivity counts for many compounds concurrently"""
+        unique_ids = list(dict.fromkeys(cid for cid in chembl_ids if cid))
+        counts = await asyncio.gather(*(self.get_bioactivity_count(chembl_id) for chembl_id in unique_ids))
+        return {chembl_id: count for chembl_id, count in zip(unique_ids, counts) if count is not None}
+
+
+class AsyncPubChemConnector:
+    """
+    Non-blocking counterpart of PubChemConnector
+
+    Lookups share the negative cache and the query's fetch context with the
+    blocking connector (same strategies and keys), so neither path repeats a
+    known miss or a call the other already made.
+    """
+
+    PROPERTIES = ['MolecularFormula', 'MolecularWeight', 'CanonicalSMILES', 'IUPACName', 'InChI', 'InChIKey']
+
+    def __init__(self, client: AsyncHTTPClient, base_url: str = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"):
+        self.client = client
+        self.base_url = base_url
+        self.negative_cache = get_negative_cache()
+        self.logger = logging.getLogger(__name__)
+
+    async def search_by_name(self, compound_name: str) -> Optional[Dict]:
+        """Search compound by name and return properties"""
+        cid = await self._get_cid('name', compound_name,
+                                  f"{self.base_url}/compound/name/{quote(compound_name, safe='')}/cids/JSON")
+        return await self.get_compound_properties(cid) if cid else None
+
+    async def search_by_smiles(self, smiles: str) -> Optional[Dict]:
+        """Search compound by SMILES and return properties"""
+        # SMILES go in the body: '/', '#' and '+' are not safe in the URL path
+        cid = await self._get_cid('smiles', smiles, f"{self.base_url}/compound/smiles/cids/JSON", {'smiles': smiles})
+        return await self.get_compound_properties(cid) if cid else None
+
+    async def search_by_inchi(self, inchi: str) -> Optional[Dict]:
+        """Search compound by InChI and return properties"""
+        cid = await self._get_cid('inchi', inchi, f"{self.base_url}/compound/inchi/cids/JSON", {'inchi': inchi})
+        return await self.get_compound_properties(cid) if cid else None
+
+    async def _get_cid(self, kind: str, value: str, url: str, form: Optional[Dict] = None) -> Optional[str]:
+        """CID for a name/SMILES/InChI, skipping known misses; form values are POSTed"""
+        if self.negative_cache.is_miss(f'pubchem_{kind}', value):
+            return None
+        return await fetch_once_async(('pubchem', kind, value), lambda: self._fetch_cid(kind, value, url, form))
+
+    async def _fetch_cid(self, kind: str, value: str, url: str, form: Optional[Dict] = None) -> Optional[str]:
+        try:
+            if form:
+                data = await self.client.post_json(url, data=form)
+            else:
+                data = await self.client.get_json(url)
+        except aiohttp.ClientResponseError as e:
+            if e.status == 404:
+                self.negative_cache.add(f'pubchem_{kind}', value)
+            else:
+                self.logger.warning(f"PubChem CID lookup failed for {url}: {e}")
+            return None
+        except Exception as e:
+            self.logger.warning(f"PubChem CID lookup failed for {url}: {e}")
+            return None
+
+        # PubChem reports a valid but unknown structure as CID 0
+        cids = [cid for cid in data.get('IdentifierList', {}).get('CID', []) if cid]
+        if cids:
+            return str(cids[0])
+        self.negative_cache.add(f'pubchem_{kind}', value)
+        return None
+
+    async def get_compound_properties(self, cid: str) -> Optional[Dict]:
+        """Get compound properties by CID"""
+        return await fetch_once_async(('pubchem', 'properties', str(cid)),
+                                      lambda: self._fetch_compound_properties(str(cid)))
+
+    async def _fetch_compound_properties(self, cid: str) -> Optional[Dict]:
+        url = f"{self.base_url}/compound/cid/{cid}/property/{','.join(self.PROPERTIES)}/JSON"
+        try:
+            data = await self.client.get_json(url)
+            properties = data.get('PropertyTable', {}).get('Properties', [])
+            if properties:
+                compound_data = properties[0]
+                compound_data['CID'] = cid
+                return compound_data
+            return None
+        except Exception as e:
+            self.logger.error(f"Error getting properties for CID {cid}: {e}")
+            return None
+
+
+class AsyncOllamaClient:
+    """
+    Non-blocking Ollama client sharing the AsyncHTTPClient connection pool
+    """
+
+    def __init__(self, client: AsyncHTTPClient, host: str):
+        self.client = client
+        self.host = host
+        self.logger = logging.getLogger(__name__)
+
+    async def generate(self, payload: Dict) -> Dict:
+        """Run /api/generate; Ollama is local, so it is not rate limited"""
+        return await self.client.post_json(f"{self.host}/api/generate", json_body=payload, rate_limited=False)
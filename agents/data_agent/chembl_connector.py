@@ -2,8 +2,21 @@
 import requests
 import pandas as pd
 import logging
-from typing import Dict, List, Optional
-import time
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+from rate_limiter import get_rate_limiter
+from http_cache import make_adapter
+from fetch_context import current_fetch_context, fetch_once
+from negative_cache import get_negative_cache
+
+# Activity columns stored by DatabaseManager.insert_bioactivities
+BIOACTIVITY_FIELDS = [
+    'target_chembl_id',
+    'standard_type',
+    'standard_value',
+    'standard_units',
+    'pchembl_value'
+]
 
 class ChEMBLConnector:
     """
@@ -17,7 +30,15 @@ class ChEMBLConnector:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
-        self.delay = 0.1
+        # Repeat requests are answered from the on-disk response cache; the rest
+        # wait on a token bucket shared by every client of this host
+        self.rate_limiter = get_rate_limiter(base_url)
+        self.session.mount(base_url, make_adapter(self.rate_limiter))
+        self.batch_size = 50  # IDs per molecule_chembl_id__in request (keeps URLs short)
+        self.page_size = 100
+        self.max_page_size = 1000  # ChEMBL API hard limit per page
+        # ChEMBL IDs recently found not to exist
+        self.negative_cache = get_negative_cache()
         self.logger = logging.getLogger(__name__)
         
     def _safe_extract(self, data: any, default=None) -> any:
@@ -163,8 +184,8 @@ class ChEMBLConnector:
         
         return processed
     
-    def search_compounds(self, query: str, limit: int = 20) -> List[Dict]:
-        """Search compounds by query - ENHANCED VERSION"""
+    def _search_molecules(self, query: str, limit: int) -> List[Dict]:
+        """Run a ChEMBL molecule search and return the raw hits"""
         endpoint = f"{self.base_url}/molecule/search"
         params = {
             'q': query,
@@ -172,37 +193,47 @@ class ChEMBLConnector:
             'format': 'json'
         }
         
+        response = self.session.get(endpoint, params=params)
+        response.raise_for_status()
+        data = response.json()
+        
+        molecules = data.get('molecules', [])
+        self.logger.info(f"ChEMBL search returned {len(molecules)} compounds")
+        return molecules
+    
+    def search_compound_ids(self, query: str, limit: int = 20) -> List[str]:
+        """Search compounds by query and return only the ChEMBL IDs of the hits, in rank order"""
         try:
-            time.sleep(self.delay)
-            response = self.session.get(endpoint, params=params)
-            response.raise_for_status()
-            data = response.json()
+            molecules = fetch_once(('chembl', 'search', query, limit), lambda: self._search_molecules(query, limit))
+            return [m['molecule_chembl_id'] for m in molecules if m.get('molecule_chembl_id')]
+        except Exception as e:
+            self.logger.error(f"ChEMBL search error: {e}")
+            return []
+    
+    def search_compounds(self, query: str, limit: int = 20) -> List[Dict]:
+        """Search compounds by query - ENHANCED VERSION"""
+        try:
+            molecules = fetch_once(('chembl', 'search', query, limit), lambda: self._search_molecules(query, limit))
             
-            molecules = data.get('molecules', [])
-            self.logger.info(f"ChEMBL search returned {len(molecules)} compounds")
+            # Search results often don't include all properties, so resolve
+            # every hit in bulk instead of one detail request per hit
+            chembl_ids = [m.get('molecule_chembl_id') for m in molecules if m.get('molecule_chembl_id')]
+            detailed_compounds = self.get_compounds_batch(chembl_ids)
             
             compounds = []
             for i, compound in enumerate(molecules):
-                self.logger.info(f"Processing search result {i+1}/{len(molecules)}")
-                
-                # Get ChEMBL ID
                 chembl_id = compound.get('molecule_chembl_id')
                 if not chembl_id:
                     self.logger.warning(f"No ChEMBL ID in search result {i+1}")
                     continue
                 
-                # For search results, we need to get detailed info
-                # because search results often don't include all properties
-                detailed_compound = self.get_compound_with_enriched_data(chembl_id)
-                
+                detailed_compound = detailed_compounds.get(chembl_id)
                 if detailed_compound:
                     compounds.append(detailed_compound)
-                    self.logger.info(f"Successfully processed {chembl_id}")
                 else:
                     # Fallback to basic processing
                     self.logger.warning(f"Could not get detailed info for {chembl_id}, using basic data")
-                    processed = self._process_compound_data(compound)
-                    compounds.append(processed)
+                    compounds.append(self._process_compound_data(compound))
                 
             return compounds
             
@@ -210,16 +241,100 @@ class ChEMBLConnector:
             self.logger.error(f"ChEMBL search error: {e}")
             return []
     
+    def _get_pages(self, endpoint: str, params: Dict, key: str) -> Iterator[List[Dict]]:
+        """Yield result pages from a ChEMBL list endpoint, following page_meta.next"""
+        url = endpoint
+        while url:
+            response = self.session.get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            
+            yield data.get(key, [])
+            
+            # page_meta.next is a server-relative path that already carries the filters
+            next_path = (data.get('page_meta') or {}).get('next')
+            if not next_path:
+                break
+            base = urlsplit(self.base_url)
+            url = f"{base.scheme}://{base.netloc}{next_path}"
+            params = None
+    
+    def get_compounds_batch(self, chembl_ids: List[str]) -> Dict[str, Dict]:
+        """Get detailed data for many compounds with molecule_chembl_id__in, keyed by ChEMBL ID"""
+        unique_ids = list(dict.fromkeys(cid for cid in chembl_ids if cid))
+        if not unique_ids:
+            return {}
+        
+        # Serve IDs already resolved earlier in this query from the fetch context
+        compounds = {}
+        fetch_context = current_fetch_context()
+        if fetch_context:
+            for chembl_id in unique_ids:
+                found, compound = fetch_context.lookup(('chembl', 'molecule', chembl_id))
+                if found and compound:
+                    compounds[chembl_id] = compound
+        
+        ids_to_fetch = [chembl_id for chembl_id in unique_ids
+                        if chembl_id not in compounds and not self.negative_cache.is_miss('chembl_molecule', chembl_id)]
+        endpoint = f"{self.base_url}/molecule.json"
+        raw_compounds = {}
+        
+        for start in range(0, len(ids_to_fetch), self.batch_size):
+            chunk = ids_to_fetch[start:start + self.batch_size]
+            params = {
+                'molecule_chembl_id__in': ','.join(chunk),
+                'limit': min(len(chunk), self.page_size),
+                'format': 'json'
+            }
+            
+            try:
+                for page in self._get_pages(endpoint, params, 'molecules'):
+                    if fetch_context:
+                        fetch_context.record_call()
+                    for compound_data in page:
+                        chembl_id = compound_data.get('molecule_chembl_id')
+                        if chembl_id:
+                            raw_compounds[chembl_id] = compound_data
+                
+                for chembl_id in chunk:
+                    if chembl_id not in raw_compounds:
+                        self.negative_cache.add('chembl_molecule', chembl_id)
+            except Exception as e:
+                self.logger.error(f"ChEMBL batch fetch error for {len(chunk)} compounds: {e}")
+        
+        self.logger.info(f"ChEMBL batch fetch resolved {len(raw_compounds)}/{len(ids_to_fetch)} compounds "
+                         f"({len(compounds)} already fetched in this query)")
+        
+        for chembl_id in ids_to_fetch:
+            compound_data = raw_compounds.get(chembl_id)
+            if compound_data:
+                processed = self._process_compound_data(compound_data)
+                compounds[chembl_id] = self._fill_missing_molecule_data(chembl_id, processed)
+                if fetch_context:
+                    fetch_context.store(('chembl', 'molecule', chembl_id), compounds[chembl_id])
+        
+        return {chembl_id: compounds[chembl_id] for chembl_id in unique_ids if chembl_id in compounds}
+    
     def get_compound_with_enriched_data(self, chembl_id: str) -> Optional[Dict]:
         """Get compound with enriched data - ENHANCED VERSION"""
+        if self.negative_cache.is_miss('chembl_molecule', chembl_id):
+            return None
+        return fetch_once(('chembl', 'molecule', chembl_id),
+                          lambda: self._fetch_compound_with_enriched_data(chembl_id))
+    
+    def _fetch_compound_with_enriched_data(self, chembl_id: str) -> Optional[Dict]:
+        """Fetch and process a single molecule record from ChEMBL"""
         endpoint = f"{self.base_url}/molecule/{chembl_id}"
         params = {
             'format': 'json'
         }
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(endpoint, params=params)
+            if response.status_code == 404:
+                self.logger.info(f"ChEMBL has no compound {chembl_id}")
+                self.negative_cache.add('chembl_molecule', chembl_id)
+                return None
             response.raise_for_status()
             compound_data = response.json()
             
@@ -229,38 +344,46 @@ class ChEMBLConnector:
             # Process the compound data
             processed = self._process_compound_data(compound_data)
             
-            # If we're still missing critical data, try alternative endpoints
-            if not processed.get('molecular_formula') or not processed.get('molecular_weight'):
-                self.logger.info(f"Missing molecular data for {chembl_id}, trying alternative endpoints...")
-                
-                # Try molecule properties endpoint
-                props_data = self._get_molecule_properties(chembl_id)
-                if props_data:
-                    # Merge properties data
-                    for key, value in props_data.items():
-                        if value is not None and not processed.get(key):
-                            processed[key] = value
-                
-                # Try molecule structures endpoint
-                struct_data = self._get_molecule_structures(chembl_id)
-                if struct_data:
-                    # Merge structure data
-                    for key, value in struct_data.items():
-                        if value is not None and not processed.get(key):
-                            processed[key] = value
-            
-            return processed
+            return self._fill_missing_molecule_data(chembl_id, processed)
             
         except Exception as e:
             self.logger.error(f"ChEMBL compound details error for {chembl_id}: {e}")
             return None
     
+    def _fill_missing_molecule_data(self, chembl_id: str, processed: Dict) -> Dict:
+        """Fill missing formula/weight/structure fields from the dedicated endpoints"""
+        if processed.get('molecular_formula') and processed.get('molecular_weight'):
+            return processed
+        
+        self.logger.info(f"Missing molecular data for {chembl_id}, trying alternative endpoints...")
+        
+        # Try molecule properties endpoint
+        props_data = self._get_molecule_properties(chembl_id)
+        if props_data:
+            # Merge properties data
+            for key, value in props_data.items():
+                if value is not None and not processed.get(key):
+                    processed[key] = value
+        
+        # Try molecule structures endpoint
+        struct_data = self._get_molecule_structures(chembl_id)
+        if struct_data:
+            # Merge structure data
+            for key, value in struct_data.items():
+                if value is not None and not processed.get(key):
+                    processed[key] = value
+        
+        return processed
+    
     def _get_molecule_properties(self, chembl_id: str) -> Optional[Dict]:
         """Get molecule properties from dedicated endpoint"""
+        return fetch_once(('chembl', 'properties', chembl_id),
+                          lambda: self._fetch_molecule_properties(chembl_id))
+    
+    def _fetch_molecule_properties(self, chembl_id: str) -> Optional[Dict]:
         endpoint = f"{self.base_url}/molecule/{chembl_id}/properties"
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(endpoint)
             response.raise_for_status()
             data = response.json()
@@ -287,10 +410,13 @@ class ChEMBLConnector:
     
     def _get_molecule_structures(self, chembl_id: str) -> Optional[Dict]:
         """Get molecule structures from dedicated endpoint"""
+        return fetch_once(('chembl', 'structures', chembl_id),
+                          lambda: self._fetch_molecule_structures(chembl_id))
+    
+    def _fetch_molecule_structures(self, chembl_id: str) -> Optional[Dict]:
         endpoint = f"{self.base_url}/molecule/{chembl_id}/structures"
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(endpoint)
             response.raise_for_status()
             data = response.json()
@@ -312,24 +438,154 @@ class ChEMBLConnector:
     
     def get_bioactivities(self, chembl_id: str, limit: int = 100) -> List[Dict]:
         """Get bioactivity data for compound"""
-        endpoint = f"{self.base_url}/activity"
+        return fetch_once(('chembl', 'activities', chembl_id, limit),
+                          lambda: self._fetch_bioactivities(chembl_id, limit))
+    
+    def _fetch_bioactivities(self, chembl_id: str, limit: int) -> List[Dict]:
+        activities = []
+        try:
+            for chunk in self.iter_bioactivities(chembl_id, chunk_size=limit, fields=None):
+                activities.extend(chunk[:limit - len(activities)])
+                if len(activities) >= limit:
+                    break
+        except Exception as e:
+            self.logger.error(f"Bioactivities error for {chembl_id}: {e}")
+            return []
+        
+        self.logger.info(f"Retrieved {len(activities)} bioactivities for {chembl_id}")
+        return activities
+    
+    def iter_bioactivities(self, chembl_id: str, chunk_size: int = 1000,
+                           fields: Optional[List[str]] = BIOACTIVITY_FIELDS) -> Iterator[List[Dict]]:
+        """
+        Stream all bioactivities for a compound in chunks, following page_meta.next
+        
+        Only the given fields are requested (ChEMBL `only=` projection); by default
+        these are the columns DatabaseManager.insert_bioactivities stores. Pass
+        fields=None to get full activity records.
+        
+        A request error mid-stream is logged and re-raised, so callers can tell a
+        truncated stream from a complete one.
+        """
+        endpoint = f"{self.base_url}/activity.json"
         params = {
             'molecule_chembl_id': chembl_id,
-            'limit': limit,
+            'limit': max(1, min(chunk_size, self.max_page_size)),
+            'format': 'json'
+        }
+        if fields:
+            params['only'] = ','.join(fields)
+        
+        total = 0
+        try:
+            for page in self._get_pages(endpoint, params, 'activities'):
+                if not page:
+                    continue
+                total += len(page)
+                yield page
+        except Exception as e:
+            self.logger.error(f"Bioactivity streaming error for {chembl_id} after {total} activities: {e}")
+            raise
+        
+        self.logger.info(f"Streamed {total} bioactivities for {chembl_id}")
+
+    def get_bioactivity_count(self, chembl_id: str) -> Optional[int]:
+        """Get the total number of bioactivities for a compound from page_meta.total_count"""
+        return fetch_once(('chembl', 'activity_count', chembl_id),
+                          lambda: self._fetch_bioactivity_count(chembl_id))
+    
+    def _fetch_bioactivity_count(self, chembl_id: str) -> Optional[int]:
+        endpoint = f"{self.base_url}/activity.json"
+        # One single-column row is enough: only page_meta.total_count is read
+        params = {
+            'molecule_chembl_id': chembl_id,
+            'limit': 1,
+            'only': 'activity_id',
             'format': 'json'
         }
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(endpoint, params=params)
             response.raise_for_status()
             data = response.json()
-            activities = data.get('activities', [])
-            self.logger.info(f"Retrieved {len(activities)} bioactivities for {chembl_id}")
-            return activities
+            total_count = (data.get('page_meta') or {}).get('total_count')
+            return int(total_count) if total_count is not None else len(data.get('activities', []))
         except Exception as e:
-            self.logger.error(f"Bioactivity error for {chembl_id}: {e}")
-            return []
+            self.logger.error(f"Bioactivity count error for {chembl_id}: {e}")
+            return None
+    
+    def get_bioactivity_counts(self, chembl_ids: List[str]) -> Dict[str, int]:
+        """Get bioactivity counts for many compounds, grouped per ChEMBL ID"""
+        unique_ids = list(dict.fromkeys(cid for cid in chembl_ids if cid))
+        counts = {}
+        
+        fetch_context = current_fetch_context()
+        if fetch_context:
+            for chembl_id in unique_ids:
+                found, count = fetch_context.lookup(('chembl', 'activity_count', chembl_id))
+                if found and count is not None:
+                    counts[chembl_id] = count
+        
+        ids_to_count = [chembl_id for chembl_id in unique_ids if chembl_id not in counts]
+        endpoint = f"{self.base_url}/activity.json"
+        
+        for start in range(0, len(ids_to_count), self.batch_size):
+            chunk = ids_to_count[start:start + self.batch_size]
+            
+            try:
+                # Probe: one row is enough to read the chunk's total activity count
+                response = self.session.get(endpoint, params={
+                    'molecule_chembl_id__in': ','.join(chunk),
+                    'limit': 1,
+                    'only': 'molecule_chembl_id',
+                    'format': 'json'
+                })
+                response.raise_for_status()
+                total_count = int((response.json().get('page_meta') or {})['total_count'])
+                if fetch_context:
+                    fetch_context.record_call()
+                
+                chunk_counts = None
+                if total_count == 0 or len(chunk) == 1:
+                    # The chunk total is the count of its only molecule (or every count is 0)
+                    chunk_counts = dict.fromkeys(chunk, total_count)
+                elif total_count <= self.max_page_size:
+                    # Sparse molecules: every activity of the chunk fits in one page,
+                    # so counting molecule IDs in that page gives all counts
+                    response = self.session.get(endpoint, params={
+                        'molecule_chembl_id__in': ','.join(chunk),
+                        'limit': total_count,
+                        'only': 'molecule_chembl_id',
+                        'format': 'json'
+                    })
+                    response.raise_for_status()
+                    activities = response.json().get('activities', [])
+                    if fetch_context:
+                        fetch_context.record_call()
+                    
+                    if len(activities) >= total_count:
+                        chunk_counts = dict.fromkeys(chunk, 0)
+                        for activity in activities:
+                            molecule_id = activity.get('molecule_chembl_id')
+                            if molecule_id in chunk_counts:
+                                chunk_counts[molecule_id] += 1
+                
+                if chunk_counts is not None:
+                    for chembl_id, count in chunk_counts.items():
+                        counts[chembl_id] = count
+                        if fetch_context:
+                            fetch_context.store(('chembl', 'activity_count', chembl_id), count)
+                    continue
+            except Exception as e:
+                self.logger.error(f"Grouped bioactivity count error for {len(chunk)} compounds: {e}")
+            
+            # Dense molecules: one minimal total_count request per compound
+            for chembl_id in chunk:
+                count = self.get_bioactivity_count(chembl_id)
+                if count is not None:
+                    counts[chembl_id] = count
+        
+        return counts
 
 # Test the connector directly
 if __name__ == "__main__":
@@ -1,9 +1,25 @@
 # data_agent.py (COMPLETE FIXED VERSION)
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import contextvars
+import hashlib
+import json
 import logging
+import queue
+import threading
+import time
 from chembl_connector import ChEMBLConnector
-from pubchem_connector import PubChemConnector
+from pubchem_connector import CID_ERROR, CID_MISS, PubChemConnector
 from database_manager import DatabaseManager
+from fetch_context import fetch_scope
+from rate_limiter import get_rate_limiter_stats
+from http_cache import get_response_cache
+from negative_cache import get_negative_cache
+from async_connectors import (AsyncChEMBLConnector, AsyncOllamaClient, AsyncPubChemConnector, close_async_client,
+                              get_async_client)
+from freshness import FIELD_GROUPS, FreshnessPolicy
+from ollama_client import OllamaClient
 import os
 import requests
 
@@ -12,16 +28,99 @@ class DataAgent:
     Enhanced Data Agent with Ollama integration for AI-powered analysis
     """
     
+    # Stored analyses are keyed by a hash of this template and the options below
+    ANALYSIS_PROMPT_TEMPLATE = """
+            Analyze this chemical compound and provide insights:
+            
+            Compound: {pref_name}
+            ChEMBL ID: {chembl_id}
+            Molecular Formula: {molecular_formula}
+            Molecular Weight: {molecular_weight}
+            SMILES: {smiles}
+            Bioactivities Count: {bioactivities_count}
+            
+            Please provide:
+            1. Brief description of the compound
+            2. Potential therapeutic uses
+            3. Key chemical properties
+            4. Any notable characteristics
+            
+            Keep the response concise and factual.
+            """
+    
+    # Batched mode: several compounds per generation, answered as JSON (Ollama "format": "json")
+    BATCH_ANALYSIS_PROMPT_TEMPLATE = """
+            Analyze each of the following chemical compounds and provide insights:
+            {compounds}
+            For each compound provide:
+            1. Brief description of the compound
+            2. Potential therapeutic uses
+            3. Key chemical properties
+            4. Any notable characteristics
+            
+            Keep each analysis concise and factual.
+            Respond with JSON only, exactly one entry per compound, in this form:
+            {{"analyses": [{{"chembl_id": "<ChEMBL ID>", "analysis": "<analysis text>"}}]}}
+            """
+    
+    BATCH_COMPOUND_TEMPLATE = """
+            Compound: {pref_name}
+            ChEMBL ID: {chembl_id}
+            Molecular Formula: {molecular_formula}
+            Molecular Weight: {molecular_weight}
+            SMILES: {smiles}
+            Bioactivities Count: {bioactivities_count}
+            """
+    
+    ANALYSIS_OPTIONS = {
+        "temperature": 0.1,
+        "top_p": 0.9,
+        "max_tokens": 500
+    }
+    
     def __init__(self, db_connection=None):
         self.db = db_connection or DatabaseManager()
         self.chembl_connector = ChEMBLConnector()
         self.pubchem_connector = PubChemConnector()
         self.logger = logging.getLogger(__name__)
         
+        # Compounds enriched in parallel per query (upstream rate limits still apply)
+        self.enrichment_workers = int(os.getenv('ENRICHMENT_WORKERS', '4'))
+        
+        # Analyses run at once in batch analysis; match the Ollama server's OLLAMA_NUM_PARALLEL
+        self.ollama_num_parallel = int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+        
+        # PubChem lookup strategies for one compound run concurrently on this pool,
+        # bounded by a per-compound deadline in seconds. A lower-priority strategy
+        # starts once the higher-priority ones missed or after the hedge delay
+        self.pubchem_resolution_deadline = float(os.getenv('PUBCHEM_RESOLUTION_DEADLINE', '8'))
+        self.pubchem_hedge_delay = float(os.getenv('PUBCHEM_HEDGE_DELAY', '1'))
+        self._pubchem_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('PUBCHEM_RESOLUTION_WORKERS', str(self.enrichment_workers * 4))),
+            thread_name_prefix='pubchem-resolve'
+        )
+        
+        # Async queries of the blocking API run on one long-lived event loop, so its
+        # AsyncHTTPClient connection pool is reused across queries
+        self._async_loop = None
+        self._async_loop_lock = threading.Lock()
+        
+        # Stored compounds younger than these max ages are served without re-enrichment
+        self.freshness_policy = FreshnessPolicy.from_env()
+        
         # Ollama configuration
         self.ollama_host = os.getenv('OLLAMA_HOST', 'http://mediagent-ollama:11434')
         self.ollama_model = os.getenv('OLLAMA_MODEL', 'llama3.2:latest')  # Default model
         self.current_model = None  # Track the actual model being used
+        self.ollama = OllamaClient(self.ollama_host)
+        self.ollama_warmup = os.getenv('OLLAMA_WARMUP', 'true').lower() not in ('0', 'false', 'no')
+        
+        # Model metadata is served from memory and refreshed in the background every TTL seconds
+        self.model_info_ttl = float(os.getenv('OLLAMA_MODEL_INFO_TTL', '300'))
+        self._model_info = None
+        self._model_info_fetched_at = 0.0
+        self._model_info_lock = threading.Lock()
+        self._model_info_stop = threading.Event()
         
         # Set up logging
         if not self.logger.handlers:
@@ -29,6 +128,7 @@ class DataAgent:
             
         # Initialize Ollama connection and detect model
         self._initialize_ollama()
+        self._start_model_info_refresh()
     
     def _initialize_ollama(self):
         """Initialize Ollama connection and detect available models"""
@@ -36,36 +136,109 @@ class DataAgent:
             self.logger.info("Initializing Ollama connection...")
             
             # Check if Ollama is available
-            response = requests.get(f"{self.ollama_host}/api/tags", timeout=5)
-            if response.status_code == 200:
-                models_data = response.json()
-                available_models = [model['name'] for model in models_data.get('models', [])]
+            available_models = self.ollama.list_models()
+            
+            self.logger.info(f"✅ Ollama connected. Available models: {available_models}")
+            
+            # Set the current model
+            if available_models:
+                # Use the specified model if available, otherwise use the first available
+                if self.ollama_model in available_models:
+                    self.current_model = self.ollama_model
+                else:
+                    self.current_model = available_models[0]
+                    self.logger.warning(f"Model {self.ollama_model} not available, using {self.current_model}")
                 
-                self.logger.info(f"✅ Ollama connected. Available models: {available_models}")
+                self.logger.info(f"🤖 Using Ollama model: {self.current_model}")
                 
-                # Set the current model
-                if available_models:
-                    # Use the specified model if available, otherwise use the first available
-                    if self.ollama_model in available_models:
-                        self.current_model = self.ollama_model
-                    else:
-                        self.current_model = available_models[0]
-                        self.logger.warning(f"Model {self.ollama_model} not available, using {self.current_model}")
-                    
-                    self.logger.info(f"🤖 Using Ollama model: {self.current_model}")
-                else:
-                    self.logger.warning("🤖 No models available in Ollama")
-                    self.current_model = None
+                # Load the model now instead of on the first analysis request
+                if self.ollama_warmup:
+                    self.ollama.warmup_in_background(self.current_model)
             else:
-                self.logger.warning(f"🤖 Could not connect to Ollama at {self.ollama_host}")
+                self.logger.warning("🤖 No models available in Ollama")
                 self.current_model = None
                 
+        except requests.RequestException as e:
+            self.logger.warning(f"🤖 Could not connect to Ollama at {self.ollama_host}: {e}")
+            self.current_model = None
         except Exception as e:
             self.logger.error(f"Error initializing Ollama: {e}")
             self.current_model = None
     
     def get_ollama_model_info(self) -> Dict:
-        """Get information about the current Ollama model"""
+        """Get information about the current Ollama model, from memory while it is younger than the TTL"""
+        model_info = self._model_info
+        if (model_info is None or model_info.get('model') != self.current_model
+                or time.monotonic() - self._model_info_fetched_at > self.model_info_ttl):
+            model_info = self.refresh_ollama_model_info()
+        return dict(model_info)
+    
+    def refresh_ollama_model_info(self, force: bool = False) -> Dict:
+        """Fetch the current model's metadata from Ollama (/api/show) and cache it"""
+        with self._model_info_lock:
+            # Another thread may have refreshed while we waited for the lock
+            if (not force and self._model_info is not None and self._model_info.get('model') == self.current_model
+                    and time.monotonic() - self._model_info_fetched_at <= self.model_info_ttl / 2):
+                return self._model_info
+            
+            self._model_info = self._fetch_ollama_model_info()
+            self._model_info_fetched_at = time.monotonic()
+            return self._model_info
+    
+    def _start_model_info_refresh(self):
+        """Keep the model info cache warm from a daemon thread"""
+        if self.model_info_ttl <= 0:
+            return
+        
+        def refresh_loop():
+            while not self._model_info_stop.wait(self.model_info_ttl / 2):
+                try:
+                    # Ollama was unavailable (or had no models) at startup: try to detect a model again
+                    if not self.current_model:
+                        self._initialize_ollama()
+                    self.refresh_ollama_model_info(force=True)
+                except Exception as e:
+                    self.logger.error(f"Error refreshing Ollama model info: {e}")
+        
+        threading.Thread(target=refresh_loop, name='ollama-model-info-refresh', daemon=True).start()
+    
+    def stop_background_tasks(self):
+        """Stop the background model info refresh, the PubChem lookup pools and the async event loop"""
+        self._model_info_stop.set()
+        self._pubchem_executor.shutdown(wait=False, cancel_futures=True)
+        self.pubchem_connector.close()
+        
+        with self._async_loop_lock:
+            loop, self._async_loop = self._async_loop, None
+        if loop:
+            try:
+                asyncio.run_coroutine_threadsafe(close_async_client(), loop).result(timeout=5)
+            except Exception as e:
+                self.logger.error(f"Error closing async HTTP client: {e}")
+            loop.call_soon_threadsafe(loop.stop)
+    
+    def _run_async(self, coro):
+        """
+        Run a coroutine on the agent's long-lived event loop and wait for its result
+        
+        The coroutine runs in a copy of the caller's context, so it joins the
+        caller's fetch context like the worker threads do.
+        """
+        with self._async_loop_lock:
+            if self._async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='data-agent-async', daemon=True).start()
+                self._async_loop = loop
+            loop = self._async_loop
+        
+        context = contextvars.copy_context()
+        
+        async def run_in_context():
+            return await asyncio.create_task(coro, context=context)
+        
+        return asyncio.run_coroutine_threadsafe(run_in_context(), loop).result()
+    
+    def _fetch_ollama_model_info(self) -> Dict:
         try:
             if not self.current_model:
                 return {
@@ -75,31 +248,24 @@ class DataAgent:
                 }
             
             # Get detailed model information
-            response = requests.post(
-                f"{self.ollama_host}/api/show",
-                json={"name": self.current_model},
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                model_info = response.json()
-                return {
-                    'model': self.current_model,
-                    'status': 'available',
-                    'details': {
-                        'name': model_info.get('details', {}).get('family', 'Unknown'),
-                        'size': model_info.get('size', 'Unknown'),
-                        'modified': model_info.get('modified_at', 'Unknown'),
-                        'parameters': model_info.get('details', {}).get('parameter_count', 'Unknown')
-                    }
-                }
-            else:
-                return {
-                    'model': self.current_model,
-                    'status': 'error',
-                    'message': f"Could not get model details: {response.status_code}"
+            model_info = self.ollama.show(self.current_model)
+            return {
+                'model': self.current_model,
+                'status': 'available',
+                'details': {
+                    'name': model_info.get('details', {}).get('family', 'Unknown'),
+                    'size': model_info.get('size', 'Unknown'),
+                    'modified': model_info.get('modified_at', 'Unknown'),
+                    'parameters': model_info.get('details', {}).get('parameter_count', 'Unknown')
                 }
+            }
                 
+        except requests.HTTPError as e:
+            return {
+                'model': self.current_model,
+                'status': 'error',
+                'message': f"Could not get model details: {e.response.status_code}"
+            }
         except Exception as e:
             return {
                 'model': self.current_model,
@@ -107,8 +273,123 @@ class DataAgent:
                 'message': f"Error getting model info: {e}"
             }
     
-    def analyze_compound_with_ai(self, compound_data: Dict) -> Dict:
-        """Analyze compound using Ollama AI model"""
+    def _analysis_prompt_fields(self, compound_data: Dict) -> Dict:
+        return {
+            'pref_name': compound_data.get('pref_name', 'Unknown'),
+            'chembl_id': compound_data.get('chembl_id', 'Unknown'),
+            'molecular_formula': compound_data.get('molecular_formula', 'Unknown'),
+            'molecular_weight': compound_data.get('molecular_weight', 'Unknown'),
+            'smiles': compound_data.get('smiles', 'Unknown'),
+            'bioactivities_count': (compound_data['bioactivities_count']
+                                    if compound_data.get('bioactivities_count') is not None else 'Unknown')
+        }
+    
+    def _build_analysis_prompt(self, compound_data: Dict) -> str:
+        """Build the compound analysis prompt sent to Ollama"""
+        return self.ANALYSIS_PROMPT_TEMPLATE.format(**self._analysis_prompt_fields(compound_data))
+    
+    def _build_batch_analysis_prompt(self, compounds: List[Dict]) -> str:
+        """Build one prompt asking for a JSON analysis of every compound"""
+        blocks = ''.join(self.BATCH_COMPOUND_TEMPLATE.format(**self._analysis_prompt_fields(compound))
+                         for compound in compounds)
+        return self.BATCH_ANALYSIS_PROMPT_TEMPLATE.format(compounds=blocks)
+    
+    def _build_generate_payload(self, prompt: str) -> Dict:
+        """Build the /api/generate request body for an analysis prompt"""
+        return {
+            "model": self.current_model,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": self.ollama.keep_alive,
+            "options": dict(self.ANALYSIS_OPTIONS)
+        }
+    
+    @property
+    def analysis_prompt_hash(self) -> str:
+        """Hash of the prompt template and generation options; changing either invalidates stored analyses"""
+        template = json.dumps([self.ANALYSIS_PROMPT_TEMPLATE, self.ANALYSIS_OPTIONS], sort_keys=True)
+        return hashlib.sha256(template.encode('utf-8')).hexdigest()
+    
+    @property
+    def batch_analysis_prompt_hash(self) -> str:
+        """Prompt hash of analyses made in batched mode, which are stored separately from single ones"""
+        template = json.dumps([self.BATCH_ANALYSIS_PROMPT_TEMPLATE, self.BATCH_COMPOUND_TEMPLATE,
+                               self.ANALYSIS_OPTIONS, 'json'], sort_keys=True)
+        return hashlib.sha256(template.encode('utf-8')).hexdigest()
+    
+    def _analysis_data_hash(self, compound_data: Dict) -> str:
+        """Hash of the compound fields the analysis prompt is built from"""
+        weight = compound_data.get('molecular_weight')
+        try:
+            weight = round(float(weight), 4) if weight is not None else None
+        except (TypeError, ValueError):
+            pass
+        
+        fields = {
+            'pref_name': compound_data.get('pref_name'),
+            'chembl_id': compound_data.get('chembl_id'),
+            'molecular_formula': compound_data.get('molecular_formula'),
+            'molecular_weight': weight,
+            'smiles': compound_data.get('smiles'),
+            'bioactivities_count': int(compound_data.get('bioactivities_count') or 0)
+        }
+        return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def _resolve_compound_id(self, compound_data: Dict) -> Optional[int]:
+        """Database id of a compound, looked up by ChEMBL ID when the record does not carry it"""
+        if compound_data.get('id'):
+            return compound_data['id']
+        if not self.db or not compound_data.get('chembl_id'):
+            return None
+        stored = self.db.get_compound_by_chembl_id(compound_data['chembl_id'])
+        return stored.get('id') if stored else None
+    
+    def _load_stored_analysis(self, compound_data: Dict,
+                              prompt_hash: Optional[str] = None) -> Tuple[Optional[int], Optional[Dict]]:
+        """
+        Find a reusable stored analysis for a compound
+        
+        Analyses are keyed by compound, model and prompt template hash; one made
+        from different compound data (data_hash) is treated as stale.
+        Returns (compound_id, analysis result or None).
+        """
+        compound_id = self._resolve_compound_id(compound_data)
+        if not compound_id or not self.current_model:
+            return compound_id, None
+        
+        stored = self.db.get_analysis(compound_id, self.current_model, prompt_hash or self.analysis_prompt_hash)
+        if not stored:
+            return compound_id, None
+        
+        results = stored['results'] or {}
+        if results.get('data_hash') != self._analysis_data_hash(compound_data):
+            self.logger.info(f"Stored analysis of {compound_data.get('chembl_id')} is stale, compound data changed")
+            return compound_id, None
+        
+        self.logger.info(f"Serving stored analysis of {compound_data.get('chembl_id')} from database")
+        return compound_id, {
+            'success': True,
+            'analysis': results.get('analysis', ''),
+            'model_used': self.current_model,
+            'cached': True,
+            'analyzed_at': stored['created_at'].isoformat() if stored.get('created_at') else None
+        }
+    
+    def _save_analysis(self, compound_id: Optional[int], compound_data: Dict, analysis: str,
+                       prompt_hash: Optional[str] = None):
+        """Persist a freshly generated analysis for reuse"""
+        if not compound_id or not self.db:
+            return
+        self.db.save_analysis(compound_id, self.current_model, prompt_hash or self.analysis_prompt_hash,
+                              self._analysis_data_hash(compound_data), analysis)
+    
+    def analyze_compound_with_ai(self, compound_data: Dict, force_refresh: bool = False) -> Dict:
+        """
+        Analyze compound using Ollama AI model
+        
+        A stored analysis for the same compound data, model and prompt template is
+        returned from the database without calling Ollama, unless force_refresh is set.
+        """
         try:
             if not self.current_model:
                 return {
@@ -117,69 +398,357 @@ class DataAgent:
                     'model_used': None
                 }
             
-            # Create a prompt for compound analysis
-            prompt = f"""
-            Analyze this chemical compound and provide insights:
-            
-            Compound: {compound_data.get('pref_name', 'Unknown')}
-            ChEMBL ID: {compound_data.get('chembl_id', 'Unknown')}
-            Molecular Formula: {compound_data.get('molecular_formula', 'Unknown')}
-            Molecular Weight: {compound_data.get('molecular_weight', 'Unknown')}
-            SMILES: {compound_data.get('smiles', 'Unknown')}
-            Bioactivities Count: {compound_data.get('bioactivities_count', 0)}
-            
-            Please provide:
-            1. Brief description of the compound
-            2. Potential therapeutic uses
-            3. Key chemical properties
-            4. Any notable characteristics
-            
-            Keep the response concise and factual.
-            """
+            compound_id, stored_analysis = self._load_stored_analysis(compound_data) if self.db else (None, None)
+            if stored_analysis and not force_refresh:
+                stored_analysis['model_info'] = self.get_ollama_model_info()
+                return stored_analysis
             
             # Make request to Ollama
-            response = requests.post(
-                f"{self.ollama_host}/api/generate",
-                json={
-                    "model": self.current_model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.1,
-                        "top_p": 0.9,
-                        "max_tokens": 500
-                    }
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
+            result = self.ollama.generate(self._build_generate_payload(self._build_analysis_prompt(compound_data)))
+            analysis = result.get('response', '')
+            self._save_analysis(compound_id, compound_data, analysis)
+            return {
+                'success': True,
+                'analysis': analysis,
+                'model_used': self.current_model,
+                'model_info': self.get_ollama_model_info(),
+                'cached': False
+            }
+                
+        except requests.HTTPError as e:
+            return {
+                'success': False,
+                'error': f"Ollama API error: {e.response.status_code}",
+                'model_used': self.current_model
+            }
+        except Exception as e:
+            self.logger.error(f"Error analyzing compound with AI: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'model_used': self.current_model
+            }
+    
+    def analyze_compounds_batched(self, compounds: List[Dict], batch_size: Optional[int] = None,
+                                  max_workers: Optional[int] = None, force_refresh: bool = False) -> List[Dict]:
+        """
+        Analyze many compounds with a few JSON-formatted generations instead of one per compound
+        
+        Compounds are packed batch_size (OLLAMA_BATCH_SIZE) at a time into one prompt;
+        up to max_workers batches run at once. The JSON answer is validated per
+        compound, and every compound that is missing from it or malformed falls back
+        to analyze_compound_with_ai. Returns one result per compound, in input order.
+        """
+        if not self.current_model:
+            return [{'success': False, 'error': 'No Ollama model available', 'model_used': None} for _ in compounds]
+        
+        batch_size = batch_size or int(os.getenv('OLLAMA_BATCH_SIZE', '5'))
+        workers = max_workers or self.ollama_num_parallel
+        prompt_hash = self.batch_analysis_prompt_hash
+        results: Dict[int, Dict] = {}
+        
+        # Stored analyses first; only the rest is sent to Ollama
+        pending = []
+        for index, compound in enumerate(compounds):
+            compound_id, stored_analysis = (self._load_stored_analysis(compound, prompt_hash)
+                                            if self.db else (None, None))
+            if stored_analysis and not force_refresh:
+                results[index] = dict(stored_analysis, batched=True)
+            elif compound.get('chembl_id'):
+                pending.append((index, compound_id, compound))
+            else:
+                results[index] = self.analyze_compound_with_ai(compound, force_refresh=force_refresh)
+        
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        self.logger.info(f"Analyzing {len(pending)} compounds in {len(batches)} batched generations")
+        
+        fallback = []
+        for batch, (analyses, error) in zip(batches, self._map_in_order(self._generate_batch_analyses, batches, workers)):
+            if error:
+                self.logger.warning(f"Batched analysis failed, falling back to single analyses: {error}")
+            analyses = analyses or {}
+            for index, compound_id, compound in batch:
+                analysis = analyses.get(compound['chembl_id'])
+                if analysis is None:
+                    fallback.append((index, compound))
+                    continue
+                self._save_analysis(compound_id, compound, analysis['analysis'], prompt_hash)
+                results[index] = {
                     'success': True,
-                    'analysis': result.get('response', ''),
+                    'analysis': analysis['analysis'],
                     'model_used': self.current_model,
-                    'model_info': self.get_ollama_model_info()
+                    'cached': False,
+                    'batched': True,
+                    'elapsed_ms': analysis['elapsed_ms']
                 }
+        
+        if fallback:
+            self.logger.info(f"{len(fallback)} compounds missing from batched answers, analyzing them one by one")
+            single = self._map_in_order(lambda item: self.analyze_compound_with_ai(item[1], force_refresh=force_refresh),
+                                        fallback, workers)
+            for (index, _), (analysis, error) in zip(fallback, single):
+                results[index] = analysis or {'success': False, 'error': str(error), 'model_used': self.current_model}
+        
+        return [results[index] for index in range(len(compounds))]
+    
+    def _generate_batch_analyses(self, batch: List[Tuple]) -> Dict[str, Dict]:
+        """Run one JSON-formatted generation for a batch; returns the valid analyses keyed by ChEMBL ID"""
+        started = time.perf_counter()
+        compounds = [compound for _, _, compound in batch]
+        payload = self._build_generate_payload(self._build_batch_analysis_prompt(compounds))
+        payload['format'] = 'json'
+        
+        result = self.ollama.generate(payload, timeout=30 * len(compounds))
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        
+        analyses = self._parse_batch_analyses(result.get('response', ''), [c['chembl_id'] for c in compounds])
+        return {chembl_id: {'analysis': analysis, 'elapsed_ms': elapsed_ms} for chembl_id, analysis in analyses.items()}
+    
+    def _parse_batch_analyses(self, response_text: str, chembl_ids: List[str]) -> Dict[str, str]:
+        """
+        Extract {chembl_id: analysis} from a batched JSON answer
+        
+        Entries for unknown IDs, duplicates and empty or non-text analyses are dropped.
+        """
+        try:
+            data = json.loads(response_text)
+        except (TypeError, ValueError) as e:
+            self.logger.warning(f"Batched analysis is not valid JSON: {e}")
+            return {}
+        
+        items = data.get('analyses') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            self.logger.warning("Batched analysis JSON has no 'analyses' list")
+            return {}
+        
+        expected = {chembl_id.upper(): chembl_id for chembl_id in chembl_ids}
+        analyses = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            chembl_id = expected.get(str(item.get('chembl_id', '')).strip().upper())
+            analysis = item.get('analysis')
+            if isinstance(analysis, (dict, list)):
+                analysis = json.dumps(analysis)
+            if chembl_id and chembl_id not in analyses and isinstance(analysis, str) and analysis.strip():
+                analyses[chembl_id] = analysis.strip()
+        return analyses
+    
+    def _analyze_compounds(self, compounds: List[Dict], max_workers: Optional[int] = None, batched: bool = False):
+        """
+        Attach an AI analysis to every compound, running up to max_workers analyses at once
+        
+        With batched, compounds are analyzed several per generation (see analyze_compounds_batched).
+        """
+        if batched:
+            for compound, analysis in zip(compounds, self.analyze_compounds_batched(compounds, max_workers=max_workers)):
+                compound['ai_analysis'] = analysis
+            return
+        
+        analyses = self._map_in_order(self.analyze_compound_with_ai, compounds, max_workers or self.enrichment_workers)
+        for compound, (analysis, error) in zip(compounds, analyses):
+            compound['ai_analysis'] = analysis or {
+                'success': False,
+                'error': str(error),
+                'model_used': self.current_model
+            }
+    
+    def process_compound_query(self, query: str, limit: int = 10, include_ai_analysis: bool = False,
+                               use_async: bool = False, max_workers: Optional[int] = None,
+                               force_refresh: bool = False, batched_analysis: bool = False) -> Dict:
+        """
+        Enhanced compound query processing with optional AI analysis
+        
+        Hits whose database row is still fresh (see FreshnessPolicy) are served
+        from Postgres; only new or stale hits are enriched from ChEMBL/PubChem,
+        unless force_refresh is set.
+        
+        All upstream calls made for the query share one fetch context, so each
+        ChEMBL/PubChem/Ollama call is made at most once; the savings are
+        reported under 'fetch_stats'. Hits are enriched on max_workers threads
+        (default ENRICHMENT_WORKERS); with use_async, every hit is enriched
+        concurrently on the asyncio connectors instead.
+        
+        With batched_analysis, the threaded path analyzes several hits per Ollama
+        generation (see analyze_compounds_batched).
+        """
+        with fetch_scope(f"query:{query}") as fetch_context:
+            if use_async:
+                result = self._run_async(self.process_compound_query_async(query, limit, include_ai_analysis,
+                                                                           force_refresh))
             else:
-                return {
-                    'success': False,
-                    'error': f"Ollama API error: {response.status_code}",
-                    'model_used': self.current_model
-                }
-                
+                result = self._process_compound_query(query, limit, include_ai_analysis, max_workers,
+                                                      force_refresh, batched_analysis)
+            result['fetch_stats'] = fetch_context.stats()
+            return result
+    
+    async def process_compound_query_async(self, query: str, limit: int = 10,
+                                           include_ai_analysis: bool = False, force_refresh: bool = False) -> Dict:
+        """
+        Non-blocking compound query: all hits are enriched (and analyzed) concurrently,
+        so the query takes about as long as its slowest compound
+        
+        Requests go through the running loop's shared AsyncHTTPClient (see get_async_client).
+        """
+        try:
+            self.logger.info(f"Processing compound query asynchronously: {query}")
+            model_info = await asyncio.to_thread(self.get_ollama_model_info)
+            
+            client = await get_async_client()
+            chembl = AsyncChEMBLConnector(client)
+            pubchem = AsyncPubChemConnector(client)
+            ollama = AsyncOllamaClient(client, self.ollama_host) if include_ai_analysis and self.current_model else None
+            
+            chembl_ids = await chembl.search_compound_ids(query, limit)
+            self.logger.info(f"ChEMBL returned {len(chembl_ids)} compounds")
+            
+            # Serve fresh database records as is, enrich only new or stale ones
+            stored = {} if force_refresh else await asyncio.to_thread(self._load_stored_compounds, chembl_ids)
+            fresh, stale_ids = await asyncio.to_thread(self._partition_by_freshness, chembl_ids, stored)
+            
+            chembl_records = await chembl.get_compounds_batch(stale_ids)
+            to_enrich = [chembl_id for chembl_id in stale_ids if chembl_id in chembl_records]
+            results = await asyncio.gather(*(
+                self._enrich_compound_data_async(chembl_records[chembl_id], chembl, pubchem)
+                for chembl_id in to_enrich
+            ), return_exceptions=True)
+            errors = [{'chembl_id': chembl_id, 'error': str(result)}
+                      for chembl_id, result in zip(to_enrich, results) if isinstance(result, Exception)]
+            enriched_compounds = [result for result in results if result and not isinstance(result, Exception)]
+            
+            # Store in database if available (before analysis, so analyses can be stored against the rows)
+            if self.db and enriched_compounds:
+                await asyncio.to_thread(self._store_compounds, enriched_compounds)
+            
+            if ollama:
+                to_analyze = enriched_compounds + list(fresh.values())
+                analyses = await asyncio.gather(*(
+                    self._analyze_compound_async(compound, ollama, model_info) for compound in to_analyze
+                ))
+                for compound, analysis in zip(to_analyze, analyses):
+                    compound['ai_analysis'] = analysis
+            
+            compounds = self._assemble_query_results(chembl_ids, fresh, enriched_compounds, stored)
+            self.logger.info(f"Successfully processed {len(compounds)} compounds")
+            return {
+                'success': True,
+                'data': {
+                    'compounds': compounds,
+                    'compounds_found': len(compounds),
+                    'query': query,
+                    'ai_analysis_included': include_ai_analysis,
+                    'served_from_database': len(fresh),
+                    'errors': errors
+                },
+                'model_info': model_info
+            }
+            
         except Exception as e:
-            self.logger.error(f"Error analyzing compound with AI: {e}")
+            self.logger.error(f"Error processing compound query asynchronously: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'data': {
+                    'compounds': [],
+                    'compounds_found': 0,
+                    'query': query
+                },
+                'model_info': self.get_ollama_model_info()
+            }
+    
+    async def _analyze_compound_async(self, compound: Dict, ollama: AsyncOllamaClient, model_info: Dict) -> Dict:
+        """
+        Async counterpart of analyze_compound_with_ai
+        """
+        try:
+            compound_id, stored_analysis = (await asyncio.to_thread(self._load_stored_analysis, compound)
+                                            if self.db else (None, None))
+            if stored_analysis:
+                stored_analysis['model_info'] = model_info
+                return stored_analysis
+            
+            result = await ollama.generate(self._build_generate_payload(self._build_analysis_prompt(compound)))
+            analysis = result.get('response', '')
+            await asyncio.to_thread(self._save_analysis, compound_id, compound, analysis)
+            return {
+                'success': True,
+                'analysis': analysis,
+                'model_used': self.current_model,
+                'model_info': model_info,
+                'cached': False
+            }
+        except Exception as e:
+            self.logger.error(f"Error analyzing compound {compound.get('chembl_id')} with AI: {e}")
             return {
                 'success': False,
                 'error': str(e),
                 'model_used': self.current_model
             }
     
-    def process_compound_query(self, query: str, limit: int = 10, include_ai_analysis: bool = False) -> Dict:
+    async def _enrich_compound_data_async(self, compound: Dict, chembl: AsyncChEMBLConnector,
+                                          pubchem: AsyncPubChemConnector) -> Optional[Dict]:
         """
-        Enhanced compound query processing with optional AI analysis
+        Async counterpart of _enrich_compound_data; PubChem lookups and the
+        bioactivity count of a compound run concurrently
+        
+        The steps match the threaded path (ChEMBL record, cross-reference CID,
+        PubChem by CID/name/SMILES/InChI), and the lookups go through the same
+        negative cache and fetch context.
+        """
+        chembl_id = compound.get('chembl_id')
+        if not chembl_id:
+            self.logger.warning("No ChEMBL ID found in compound data")
+            return None
+        
+        try:
+            enriched_compound = compound.copy()
+            detailed_compound = self._get_complete_chembl_data(chembl_id, compound)
+            if detailed_compound:
+                enriched_compound.update(detailed_compound)
+            
+            if not enriched_compound.get('pubchem_cid'):
+                pubchem_cid = await asyncio.to_thread(self._extract_pubchem_cid_from_xrefs, chembl_id)
+                if pubchem_cid:
+                    enriched_compound['pubchem_cid'] = pubchem_cid
+            
+            pubchem_lookup = (self._get_pubchem_data_async(enriched_compound, pubchem)
+                              if self._identify_missing_data(enriched_compound) else asyncio.sleep(0))
+            pubchem_data, bioactivities_count = await asyncio.gather(
+                pubchem_lookup, chembl.get_bioactivity_count(chembl_id)
+            )
+            
+            if pubchem_data:
+                self._merge_pubchem_data(enriched_compound, pubchem_data)
+            enriched_compound['bioactivities_count'] = bioactivities_count
+            return self._validate_and_clean_compound_data(enriched_compound)
+            
+        except Exception as e:
+            self.logger.error(f"Error enriching compound data for {chembl_id}: {e}")
+            raise
+    
+    async def _get_pubchem_data_async(self, compound: Dict, pubchem: AsyncPubChemConnector) -> Optional[Dict]:
+        """
+        Async PubChem lookup by CID, then name, SMILES and InChI
         """
+        if compound.get('pubchem_cid'):
+            pubchem_data = await pubchem.get_compound_properties(compound['pubchem_cid'])
+            if pubchem_data:
+                return pubchem_data
+        if compound.get('pref_name'):
+            pubchem_data = await pubchem.search_by_name(compound['pref_name'])
+            if pubchem_data:
+                return pubchem_data
+        if compound.get('smiles'):
+            pubchem_data = await pubchem.search_by_smiles(compound['smiles'])
+            if pubchem_data:
+                return pubchem_data
+        if compound.get('inchi'):
+            return await pubchem.search_by_inchi(compound['inchi'])
+        return None
+    
+    def _process_compound_query(self, query: str, limit: int, include_ai_analysis: bool,
+                                max_workers: Optional[int] = None, force_refresh: bool = False,
+                                batched_analysis: bool = False) -> Dict:
         try:
             self.logger.info(f"Processing compound query: {query}")
             
@@ -187,35 +756,41 @@ class DataAgent:
             model_info = self.get_ollama_model_info()
             
             # Search ChEMBL for compounds
-            compounds = self.chembl_connector.search_compounds(query, limit)
-            self.logger.info(f"ChEMBL returned {len(compounds)} compounds")
+            chembl_ids = self.chembl_connector.search_compound_ids(query, limit)
+            self.logger.info(f"ChEMBL returned {len(chembl_ids)} compounds")
+            
+            # Serve fresh database records as is, enrich only new or stale ones
+            stored = {} if force_refresh else self._load_stored_compounds(chembl_ids)
+            fresh, stale_ids = self._partition_by_freshness(chembl_ids, stored)
             
-            # Enrich each compound with additional data
+            # Enrich each compound with additional data (and AI analysis if requested)
+            errors = []
             enriched_compounds = []
-            for i, compound in enumerate(compounds):
-                self.logger.info(f"Enriching compound {i+1}/{len(compounds)}: {compound.get('chembl_id')}")
-                enriched = self._enrich_compound_data(compound)
-                
-                if enriched:
-                    # Add AI analysis if requested
-                    if include_ai_analysis and self.current_model:
-                        ai_analysis = self.analyze_compound_with_ai(enriched)
-                        enriched['ai_analysis'] = ai_analysis
-                    
-                    enriched_compounds.append(enriched)
-            
-            # Store in database if available
+            if stale_ids:
+                chembl_records = self.chembl_connector.get_compounds_batch(stale_ids)
+                compounds = [chembl_records[chembl_id] for chembl_id in stale_ids if chembl_id in chembl_records]
+                enriched_compounds = self._enrich_compounds(compounds, chembl_records,
+                                                            max_workers=max_workers, errors=errors)
+            
+            # Store in database if available (before analysis, so analyses can be stored against the rows)
             if self.db and enriched_compounds:
                 self._store_compounds(enriched_compounds)
             
-            self.logger.info(f"Successfully processed {len(enriched_compounds)} compounds")
+            if include_ai_analysis and self.current_model:
+                self._analyze_compounds(enriched_compounds + list(fresh.values()), max_workers,
+                                        batched=batched_analysis)
+            
+            compounds = self._assemble_query_results(chembl_ids, fresh, enriched_compounds, stored)
+            self.logger.info(f"Successfully processed {len(compounds)} compounds")
             return {
                 'success': True,
                 'data': {
-                    'compounds': enriched_compounds,
-                    'compounds_found': len(enriched_compounds),
+                    'compounds': compounds,
+                    'compounds_found': len(compounds),
                     'query': query,
-                    'ai_analysis_included': include_ai_analysis
+                    'ai_analysis_included': include_ai_analysis,
+                    'served_from_database': len(fresh),
+                    'errors': errors
                 },
                 'model_info': model_info  # Include model info in response
             }
@@ -233,6 +808,92 @@ class DataAgent:
                 'model_info': self.get_ollama_model_info()
             }
     
+    def _load_stored_compounds(self, chembl_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Load the stored rows of the given compounds in one database round trip
+        """
+        if not self.db or not chembl_ids:
+            return {}
+        try:
+            return self.db.get_compounds_by_chembl_ids(chembl_ids)
+        except Exception as e:
+            self.logger.error(f"Error loading stored compounds: {e}")
+            return {}
+    
+    def _partition_by_freshness(self, chembl_ids: List[str], stored: Dict[str, Dict]) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        Split compounds into fresh stored records (ready to serve) and IDs that need enrichment
+        
+        Records whose only stale field group is bioactivities get just their counts
+        refreshed (one grouped ChEMBL request) and are served without re-enrichment.
+        """
+        fresh = {}
+        stale_ids = []
+        counts_only = {}
+        for chembl_id in dict.fromkeys(chembl_ids):
+            record = stored.get(chembl_id)
+            if record and self.freshness_policy.is_fresh(record):
+                fresh[chembl_id] = self._clean_stored_compound(record)
+            elif record and not self.freshness_policy.needs_enrichment(record):
+                counts_only[chembl_id] = record
+            else:
+                stale_ids.append(chembl_id)
+        
+        refreshed = self._refresh_bioactivity_counts(counts_only)
+        for chembl_id in dict.fromkeys(chembl_ids):
+            if chembl_id in refreshed:
+                fresh[chembl_id] = self._clean_stored_compound(refreshed[chembl_id])
+            elif chembl_id in counts_only:
+                stale_ids.append(chembl_id)
+        
+        self.logger.info(f"{len(fresh)} compounds fresh in database ({len(refreshed)} with refreshed "
+                         f"bioactivity counts), {len(stale_ids)} to enrich")
+        return fresh, stale_ids
+    
+    def _refresh_bioactivity_counts(self, records: Dict[str, Dict]) -> Dict[str, Dict]:
+        """
+        Refresh only the bioactivity counts of stored records, returning the updated records
+        """
+        if not records:
+            return {}
+        counts = self.chembl_connector.get_bioactivity_counts(list(records))
+        if self.db:
+            self.db.update_bioactivity_counts(counts)
+        
+        refreshed = {}
+        for chembl_id, count in counts.items():
+            refreshed[chembl_id] = dict(records[chembl_id], bioactivities_count=count, bioactivities_age_seconds=0)
+        return refreshed
+    
+    def _clean_stored_compound(self, record: Dict) -> Dict:
+        """
+        Shape a database row like an enriched compound
+        """
+        compound = dict(record)
+        compound.pop('age_seconds', None)
+        for group in FIELD_GROUPS:
+            compound.pop(f'{group}_age_seconds', None)
+        return self._validate_and_clean_compound_data(compound)
+    
+    def _assemble_query_results(self, chembl_ids: List[str], fresh: Dict[str, Dict],
+                                enriched_compounds: List[Dict], stored: Dict[str, Dict]) -> List[Dict]:
+        """
+        Merge fresh and newly enriched compounds back into search order
+        
+        A stale stored record is still served when its refresh failed.
+        """
+        served = dict(fresh)
+        served.update((compound['chembl_id'], compound) for compound in enriched_compounds if compound.get('chembl_id'))
+        
+        compounds = []
+        for chembl_id in dict.fromkeys(chembl_ids):
+            if chembl_id in served:
+                compounds.append(served[chembl_id])
+            elif chembl_id in stored:
+                self.logger.warning(f"Refresh failed for {chembl_id}, serving stored record")
+                compounds.append(self._clean_stored_compound(stored[chembl_id]))
+        return compounds
+    
     def get_system_status(self) -> Dict:
         """Get comprehensive system status including Ollama model info"""
         try:
@@ -253,6 +914,10 @@ class DataAgent:
                     'chembl': chembl_status,
                     'pubchem': pubchem_status
                 },
+                'ollama_metrics': self.ollama.metrics(),
+                'rate_limits': get_rate_limiter_stats(),
+                'http_cache': get_response_cache().stats() if get_response_cache() else 'disabled',
+                'negative_cache': get_negative_cache().stats(),
                 'host_info': {
                     'ollama_host': self.ollama_host,
                     'configured_model': self.ollama_model
@@ -265,9 +930,119 @@ class DataAgent:
                 'error': str(e),
                 'ollama': self.get_ollama_model_info()
             }
-    def _enrich_compound_data(self, compound: Dict) -> Optional[Dict]:
+    def _enrich_compounds(self, compounds: List[Dict], chembl_records: Optional[Dict[str, Dict]] = None,
+                          max_workers: Optional[int] = None, errors: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Enrich a page of compounds, resolving their page-level data in bulk first (see _prepare_enrichment)
+        
+        Compounds are then enriched on up to max_workers threads; the output keeps
+        the input order and per-compound failures are appended to errors instead
+        of aborting the page.
+        """
+        enrich = self._prepare_enrichment(compounds, chembl_records)
+        workers = max_workers or self.enrichment_workers
+        self.logger.info(f"Enriching {len(compounds)} compounds with {workers} workers")
+        
+        enriched_compounds = []
+        for compound, (enriched, error) in zip(compounds, self._map_in_order(enrich, compounds, workers)):
+            if error:
+                self.logger.error(f"Error enriching compound {compound.get('chembl_id')}: {error}")
+                if errors is not None:
+                    errors.append({'chembl_id': compound.get('chembl_id'), 'error': str(error)})
+            elif enriched:
+                enriched_compounds.append(enriched)
+        
+        return enriched_compounds
+    
+    def _prepare_enrichment(self, compounds: List[Dict],
+                            chembl_records: Optional[Dict[str, Dict]] = None) -> Callable[[Dict], Optional[Dict]]:
+        """
+        Fetch what a page of compounds needs in bulk and return the per-compound enrich function
+        
+        ChEMBL records (unless given), bioactivity counts, PubChem CIDs (by InChIKey)
+        and PubChem properties are resolved for the whole page; the returned function
+        enriches one compound of the page with them and raises when that fails.
+        """
+        chembl_ids = [compound.get('chembl_id') for compound in compounds]
+        if chembl_records is None:
+            chembl_records = self.chembl_connector.get_compounds_batch(chembl_ids)
+        bioactivity_counts = self.chembl_connector.get_bioactivity_counts(chembl_ids)
+        
+        pubchem_cids = self._resolve_page_pubchem_cids(compounds, chembl_records)
+        # PubChem properties for every hit with a known CID, in one request per chunk
+        pubchem_records = self.pubchem_connector.get_properties_batch(list(pubchem_cids.values()))
+        
+        def enrich(compound: Dict) -> Optional[Dict]:
+            chembl_id = compound.get('chembl_id')
+            if chembl_id in pubchem_cids and not compound.get('pubchem_cid'):
+                compound = dict(compound, pubchem_cid=pubchem_cids[chembl_id])
+            return self._enrich_compound_data(compound, chembl_records.get(chembl_id),
+                                              bioactivity_counts.get(chembl_id),
+                                              pubchem_records.get(pubchem_cids.get(chembl_id)))
+        
+        return enrich
+    
+    def _resolve_page_pubchem_cids(self, compounds: List[Dict], chembl_records: Dict[str, Dict]) -> Dict[str, str]:
+        """
+        PubChem CID of every compound of a page that has one, keyed by ChEMBL ID
+        
+        CIDs come from the ChEMBL cross-references; compounds without one are
+        resolved by InChIKey in a single bulk request.
+        """
+        pubchem_cids = {}
+        inchi_keys = {}
+        for compound in compounds:
+            chembl_id = compound.get('chembl_id')
+            record = chembl_records.get(chembl_id) or compound
+            if record.get('pubchem_cid'):
+                pubchem_cids[chembl_id] = str(record['pubchem_cid'])
+            elif record.get('inchi_key'):
+                inchi_keys[chembl_id] = record['inchi_key']
+        
+        if inchi_keys:
+            resolved = self.pubchem_connector.resolve_cids(list(inchi_keys.values()), namespace='inchikey')
+            for chembl_id, inchi_key in inchi_keys.items():
+                cid = resolved.get(inchi_key)
+                if cid and cid not in (CID_MISS, CID_ERROR):
+                    pubchem_cids[chembl_id] = cid
+        return pubchem_cids
+    
+    def _map_in_order(self, func: Callable, items: List, max_workers: int) -> List[Tuple]:
+        """
+        Apply func to every item, on a thread pool when max_workers > 1
+        
+        Returns (result, exception) pairs in input order. Each task runs in a copy of
+        the caller's context so the query's fetch context is shared by all workers.
+        """
+        if max_workers <= 1 or len(items) <= 1:
+            results = []
+            for item in items:
+                try:
+                    results.append((func(item), None))
+                except Exception as e:
+                    results.append((None, e))
+            return results
+        
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+            results = []
+            for future in futures:
+                try:
+                    results.append((future.result(), None))
+                except Exception as e:
+                    results.append((None, e))
+            return results
+    
+    def _enrich_compound_data(self, compound: Dict, chembl_record: Optional[Dict] = None,
+                              bioactivities_count: Optional[int] = None,
+                              pubchem_record: Optional[Dict] = None) -> Optional[Dict]:
         """
         Enrich compound data with additional information from multiple sources - COMPLETE FIXED VERSION
+        
+        chembl_record, bioactivities_count and pubchem_record are the already-fetched
+        ChEMBL record, activity count and PubChem properties for this compound, if the
+        caller resolved them in bulk; otherwise they are fetched here. A failure is
+        logged and re-raised, so the un-enriched input is never stored as enriched.
         """
         try:
             chembl_id = compound.get('chembl_id')
@@ -289,7 +1064,7 @@ class DataAgent:
             
             # STEP 1: Get complete ChEMBL data with proper structure parsing
             self.logger.info("Step 1: Fetching complete ChEMBL data...")
-            detailed_compound = self._get_complete_chembl_data(chembl_id)
+            detailed_compound = self._get_complete_chembl_data(chembl_id, chembl_record)
             if detailed_compound:
                 # Merge the detailed data with proper field mapping
                 enriched_compound.update(detailed_compound)
@@ -308,6 +1083,10 @@ class DataAgent:
                     self.logger.info(f"✅ Found PubChem CID from cross-references: {pubchem_cid}")
             
             # STEP 3: Try PubChem enrichment for any missing data
+            if pubchem_record and str(pubchem_record.get('CID')) == str(enriched_compound.get('pubchem_cid')):
+                self.logger.info("Step 3: Using PubChem properties fetched for the whole page")
+                self._merge_pubchem_data(enriched_compound, pubchem_record)
+            
             missing_data = self._identify_missing_data(enriched_compound)
             if missing_data:
                 self.logger.info(f"Step 3: Missing data detected: {missing_data}")
@@ -316,48 +1095,19 @@ class DataAgent:
                 pubchem_data = self._get_pubchem_data_with_fallback(enriched_compound)
                 
                 if pubchem_data:
-                    self.logger.info(f"PubChem data retrieved: {list(pubchem_data.keys())}")
-                    
-                    # Fill missing molecular formula
-                    if not enriched_compound.get('molecular_formula') and pubchem_data.get('MolecularFormula'):
-                        enriched_compound['molecular_formula'] = pubchem_data['MolecularFormula']
-                        self.logger.info(f"✅ Added molecular formula from PubChem: {pubchem_data['MolecularFormula']}")
-                    
-                    # Fill missing molecular weight
-                    if not enriched_compound.get('molecular_weight') and pubchem_data.get('MolecularWeight'):
-                        try:
-                            enriched_compound['molecular_weight'] = float(pubchem_data['MolecularWeight'])
-                            self.logger.info(f"✅ Added molecular weight from PubChem: {pubchem_data['MolecularWeight']}")
-                        except (ValueError, TypeError):
-                            self.logger.warning(f"Could not convert molecular weight: {pubchem_data['MolecularWeight']}")
-                    
-                    # Fill missing PubChem CID
-                    if not enriched_compound.get('pubchem_cid') and pubchem_data.get('CID'):
-                        enriched_compound['pubchem_cid'] = str(pubchem_data['CID'])
-                        self.logger.info(f"✅ Added PubChem CID: {pubchem_data['CID']}")
-                    
-                    # Fill missing SMILES
-                    if not enriched_compound.get('smiles') and pubchem_data.get('CanonicalSMILES'):
-                        enriched_compound['smiles'] = pubchem_data['CanonicalSMILES']
-                        self.logger.info(f"✅ Added SMILES from PubChem: {pubchem_data['CanonicalSMILES']}")
-                    
-                    # Add additional PubChem data
-                    if pubchem_data.get('IUPACName'):
-                        enriched_compound['iupac_name'] = pubchem_data['IUPACName']
-                    if pubchem_data.get('InChI'):
-                        enriched_compound['inchi'] = pubchem_data['InChI']
-                    if pubchem_data.get('InChIKey'):
-                        enriched_compound['inchi_key'] = pubchem_data['InChIKey']
+                    self._merge_pubchem_data(enriched_compound, pubchem_data)
                 else:
                     self.logger.warning(f"Could not retrieve PubChem data for {chembl_id}")
             
-            # STEP 4: Get bioactivities count
+            # STEP 4: Get bioactivities count (page_meta.total_count, no activity download);
+            # None means unknown, so a failed count never replaces the stored one
             try:
-                bioactivities = self.chembl_connector.get_bioactivities(chembl_id, limit=1)
-                enriched_compound['bioactivities_count'] = len(bioactivities) if bioactivities else 0
+                if bioactivities_count is None:
+                    bioactivities_count = self.chembl_connector.get_bioactivity_count(chembl_id)
+                enriched_compound['bioactivities_count'] = bioactivities_count
             except Exception as e:
                 self.logger.error(f"Error getting bioactivities for {chembl_id}: {e}")
-                enriched_compound['bioactivities_count'] = 0
+                enriched_compound['bioactivities_count'] = None
             
             # STEP 5: Final validation and cleanup
             enriched_compound = self._validate_and_clean_compound_data(enriched_compound)
@@ -373,18 +1123,57 @@ class DataAgent:
             return enriched_compound
             
         except Exception as e:
-            self.logger.error(f"Error enriching compound data for {chembl_id}: {e}")
-            return compound
+            self.logger.error(f"Error enriching compound data for {compound.get('chembl_id')}: {e}")
+            raise
+    
+    def _merge_pubchem_data(self, enriched_compound: Dict, pubchem_data: Dict):
+        """
+        Fill missing compound fields from a PubChem property record
+        """
+        self.logger.info(f"PubChem data retrieved: {list(pubchem_data.keys())}")
+        
+        # Fill missing molecular formula
+        if not enriched_compound.get('molecular_formula') and pubchem_data.get('MolecularFormula'):
+            enriched_compound['molecular_formula'] = pubchem_data['MolecularFormula']
+            self.logger.info(f"✅ Added molecular formula from PubChem: {pubchem_data['MolecularFormula']}")
+        
+        # Fill missing molecular weight
+        if not enriched_compound.get('molecular_weight') and pubchem_data.get('MolecularWeight'):
+            try:
+                enriched_compound['molecular_weight'] = float(pubchem_data['MolecularWeight'])
+                self.logger.info(f"✅ Added molecular weight from PubChem: {pubchem_data['MolecularWeight']}")
+            except (ValueError, TypeError):
+                self.logger.warning(f"Could not convert molecular weight: {pubchem_data['MolecularWeight']}")
+        
+        # Fill missing PubChem CID
+        if not enriched_compound.get('pubchem_cid') and pubchem_data.get('CID'):
+            enriched_compound['pubchem_cid'] = str(pubchem_data['CID'])
+            self.logger.info(f"✅ Added PubChem CID: {pubchem_data['CID']}")
+        
+        # Fill missing SMILES
+        if not enriched_compound.get('smiles') and pubchem_data.get('CanonicalSMILES'):
+            enriched_compound['smiles'] = pubchem_data['CanonicalSMILES']
+            self.logger.info(f"✅ Added SMILES from PubChem: {pubchem_data['CanonicalSMILES']}")
+        
+        # Add additional PubChem data; the ChEMBL structure identifiers always win,
+        # since they are what the exact InChIKey search is answered from
+        if pubchem_data.get('IUPACName'):
+            enriched_compound['iupac_name'] = pubchem_data['IUPACName']
+        if not enriched_compound.get('inchi') and pubchem_data.get('InChI'):
+            enriched_compound['inchi'] = pubchem_data['InChI']
+        if not enriched_compound.get('inchi_key') and pubchem_data.get('InChIKey'):
+            enriched_compound['inchi_key'] = pubchem_data['InChIKey']
     
-    def _get_complete_chembl_data(self, chembl_id: str) -> Optional[Dict]:
+    def _get_complete_chembl_data(self, chembl_id: str, compound_data: Optional[Dict] = None) -> Optional[Dict]:
         """
         Get complete ChEMBL data with proper structure parsing - NEW METHOD
         """
         try:
-            self.logger.info(f"Fetching complete ChEMBL data for {chembl_id}")
-            
-            # Get the complete compound data
-            compound_data = self.chembl_connector.get_compound_with_enriched_data(chembl_id)
+            if compound_data is None:
+                self.logger.info(f"Fetching complete ChEMBL data for {chembl_id}")
+                
+                # Get the complete compound data
+                compound_data = self.chembl_connector.get_compound_with_enriched_data(chembl_id)
             
             if not compound_data:
                 self.logger.warning(f"No complete ChEMBL data found for {chembl_id}")
@@ -481,65 +1270,59 @@ class DataAgent:
     def _get_pubchem_data_with_fallback(self, compound: Dict) -> Optional[Dict]:
         """
         Get PubChem data using multiple search strategies with better fallback - ENHANCED METHOD
+        
+        A known CID is looked up on its own first. Otherwise the cheap, exact
+        strategies (name, SMILES, InChI) are hedged and the hit of the
+        highest-priority strategy wins; formula and synonym searches only run when
+        all of them miss. Everything is bounded by PUBCHEM_RESOLUTION_DEADLINE seconds.
         """
         try:
             chembl_id = compound.get('chembl_id')
             self.logger.info(f"Searching PubChem for {chembl_id}")
+            deadline = time.monotonic() + self.pubchem_resolution_deadline
             
-            # Strategy 1: Use existing PubChem CID if available
             pubchem_cid = compound.get('pubchem_cid')
+            pref_name = compound.get('pref_name')
+            smiles = compound.get('smiles')
+            inchi = compound.get('inchi')
+            mol_formula = compound.get('molecular_formula')
+            
+            # Tier 0: a known CID answers directly, nothing else is started alongside it
+            strategy, pubchem_data = None, None
             if pubchem_cid:
-                self.logger.info(f"Strategy 1: Using existing PubChem CID: {pubchem_cid}")
-                pubchem_data = self.pubchem_connector.get_compound_by_cid(pubchem_cid)
-                if pubchem_data:
-                    self.logger.info(f"✅ Found PubChem data by CID: {pubchem_cid}")
-                    return pubchem_data
+                strategy, pubchem_data = self._run_pubchem_strategies(
+                    [(f"CID {pubchem_cid}", lambda: self.pubchem_connector.get_compound_by_cid(pubchem_cid))], deadline)
             
-            # Strategy 2: Search by compound name
-            pref_name = compound.get('pref_name')
+            # Tier 1: exact identifiers, in priority order
+            strategies = []
             if pref_name:
-                self.logger.info(f"Strategy 2: Searching PubChem by name: {pref_name}")
-                pubchem_data = self.pubchem_connector.search_by_name(pref_name)
-                if pubchem_data:
-                    self.logger.info(f"✅ Found PubChem data by name: CID {pubchem_data.get('CID')}")
-                    return pubchem_data
-            
-            # Strategy 3: Search by SMILES
-            smiles = compound.get('smiles')
+                strategies.append((f"name {pref_name}", lambda: self.pubchem_connector.search_by_name(pref_name)))
             if smiles:
-                self.logger.info(f"Strategy 3: Searching PubChem by SMILES: {smiles}")
-                pubchem_data = self.pubchem_connector.search_by_smiles(smiles)
-                if pubchem_data:
-                    self.logger.info(f"✅ Found PubChem data by SMILES: CID {pubchem_data.get('CID')}")
-                    return pubchem_data
-            
-            # Strategy 4: Search by InChI if available
-            inchi = compound.get('inchi')
+                strategies.append((f"SMILES {smiles}", lambda: self.pubchem_connector.search_by_smiles(smiles)))
             if inchi:
-                self.logger.info(f"Strategy 4: Searching PubChem by InChI")
-                pubchem_data = self.pubchem_connector.search_by_inchi(inchi)
-                if pubchem_data:
-                    self.logger.info(f"✅ Found PubChem data by InChI: CID {pubchem_data.get('CID')}")
-                    return pubchem_data
-            
-            # Strategy 5: Search by molecular formula (if we have it)
-            mol_formula = compound.get('molecular_formula')
-            if mol_formula:
-                self.logger.info(f"Strategy 5: Searching PubChem by molecular formula: {mol_formula}")
-                pubchem_data = self.pubchem_connector.search_by_formula(mol_formula)
-                if pubchem_data:
-                    self.logger.info(f"✅ Found PubChem data by formula: CID {pubchem_data.get('CID')}")
-                    return pubchem_data
-            
-            # Strategy 6: Try alternative names or synonyms from ChEMBL
-            synonyms = compound.get('synonyms', [])
-            for synonym in synonyms[:3]:  # Try first 3 synonyms
-                if synonym and synonym != pref_name:
-                    self.logger.info(f"Strategy 6: Searching PubChem by synonym: {synonym}")
-                    pubchem_data = self.pubchem_connector.search_by_name(synonym)
-                    if pubchem_data:
-                        self.logger.info(f"✅ Found PubChem data by synonym: CID {pubchem_data.get('CID')}")
-                        return pubchem_data
+                strategies.append(("InChI", lambda: self.pubchem_connector.search_by_inchi(inchi)))
+            
+            if not pubchem_data and time.monotonic() < deadline:
+                strategy, pubchem_data = self._run_pubchem_strategies(strategies, deadline)
+            
+            # Tier 2: ambiguous or expensive searches, only when every exact identifier missed
+            if not pubchem_data and time.monotonic() < deadline:
+                strategies = []
+                if mol_formula:
+                    # The ListKey search keeps running in the background past the deadline; only
+                    # an unambiguous hit or one matching the ChEMBL InChIKey is accepted
+                    strategies.append((f"formula {mol_formula}", lambda: self.pubchem_connector.search_by_formula(
+                        mol_formula, timeout=max(deadline - time.monotonic(), 0),
+                        inchi_key=compound.get('inchi_key'))))
+                for synonym in compound.get('synonyms', [])[:3]:  # Try first 3 synonyms
+                    if synonym and synonym != pref_name:
+                        strategies.append((f"synonym {synonym}",
+                                           lambda synonym=synonym: self.pubchem_connector.search_by_name(synonym)))
+                strategy, pubchem_data = self._run_pubchem_strategies(strategies, deadline)
+            
+            if pubchem_data:
+                self.logger.info(f"✅ Found PubChem data by {strategy}: CID {pubchem_data.get('CID')}")
+                return pubchem_data
             
             self.logger.warning(f"Could not find PubChem data for {chembl_id} using any strategy")
             return None
@@ -548,6 +1331,71 @@ class DataAgent:
             self.logger.error(f"Error getting PubChem data for {compound.get('chembl_id')}: {e}")
             return None
     
+    def _run_pubchem_strategies(self, strategies: List[Tuple[str, Callable]],
+                                deadline: float) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Run hedged lookup strategies and return (strategy, result) of the best hit
+        
+        strategies are in priority order and start one at a time: the next one is
+        submitted once every started strategy has missed, or when the current one
+        has not answered within PUBCHEM_HEDGE_DELAY seconds. A hit is accepted once
+        every higher-priority strategy has missed, so a fast low-priority hit never
+        beats a slower exact one. Strategies that are no longer needed are
+        cancelled; at the deadline the best hit so far (if any) is returned.
+        """
+        if not strategies:
+            return None, None
+        
+        futures = []
+        next_launch = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                if (len(futures) < len(strategies) and now < deadline
+                        and (now >= next_launch or all(future.done() for future in futures))):
+                    _, lookup = strategies[len(futures)]
+                    futures.append(self._pubchem_executor.submit(contextvars.copy_context().run, lookup))
+                    next_launch = now + self.pubchem_hedge_delay
+                
+                for (name, _), future in zip(strategies, futures):
+                    if not future.done():
+                        break
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.logger.warning(f"PubChem lookup by {name} failed: {e}")
+                        continue
+                    if result:
+                        return name, result
+                else:
+                    # Every started strategy missed: start the next one right away
+                    if len(futures) == len(strategies) or now >= deadline:
+                        return None, None
+                    continue
+                
+                remaining = deadline - time.monotonic()
+                pending = [future for future in futures if not future.done()]
+                if remaining <= 0:
+                    self.logger.warning(f"PubChem resolution deadline reached with {len(pending)} lookups pending")
+                    return self._best_finished_strategy(strategies, futures)
+                if len(futures) < len(strategies) and self._best_finished_strategy(strategies, futures)[1] is None:
+                    remaining = min(remaining, max(next_launch - time.monotonic(), 0))
+                else:
+                    # A lower-priority hit is already in hand: only wait for the ones above it
+                    next_launch = deadline
+                wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        finally:
+            # Lookups already in flight finish in the background; queued ones never start
+            for future in futures:
+                future.cancel()
+    
+    def _best_finished_strategy(self, strategies: List[Tuple[str, Callable]],
+                                futures: List) -> Tuple[Optional[str], Optional[Dict]]:
+        for (name, _), future in zip(strategies, futures):
+            if future.done() and not future.cancelled() and future.exception() is None and future.result():
+                return name, future.result()
+        return None, None
+    
     def _validate_and_clean_compound_data(self, compound: Dict) -> Dict:
         """
         Validate and clean compound data - NEW METHOD
@@ -571,9 +1419,11 @@ class DataAgent:
             if compound.get('pubchem_cid'):
                 compound['pubchem_cid'] = str(compound['pubchem_cid'])
             
-            # Ensure bioactivities_count is an integer
-            if compound.get('bioactivities_count') is None:
-                compound['bioactivities_count'] = 0
+            # Ensure bioactivities_count is an integer, or None when the count is unknown
+            if compound.get('bioactivities_count') is not None:
+                compound['bioactivities_count'] = int(compound['bioactivities_count'])
+            else:
+                compound['bioactivities_count'] = None
             
             return compound
             
@@ -581,85 +1431,65 @@ class DataAgent:
             self.logger.error(f"Error validating compound data: {e}")
             return compound
     
-    def _store_compounds(self, compounds: List[Dict]):
+    def _store_compounds(self, compounds: List[Dict]) -> Dict[str, int]:
         """
-        Store compounds in database with enhanced error handling and proper sync - ENHANCED METHOD
+        Store compounds in database with a single bulk upsert and proper sync - ENHANCED METHOD
+        
+        Returns the database ids of the stored compounds keyed by ChEMBL ID; each
+        stored compound also gets its id set, so analyses can be linked to it.
         """
         try:
-            stored_count = 0
-            for compound in compounds:
-                try:
-                    # Prepare compound data for database
-                    compound_data = {
-                        'chembl_id': compound.get('chembl_id'),
-                        'pubchem_cid': compound.get('pubchem_cid'),
-                        'smiles': compound.get('smiles'),
-                        'molecular_formula': compound.get('molecular_formula'),
-                        'molecular_weight': compound.get('molecular_weight'),
-                        'pref_name': compound.get('pref_name'),
-                        'bioactivities_count': compound.get('bioactivities_count', 0)
-                    }
-                    
-                    # Remove None values but keep empty strings and 0 values
-                    compound_data = {k: v for k, v in compound_data.items() if v is not None}
-                    
-                    # Ensure we have the required fields
-                    if not compound_data.get('chembl_id'):
-                        self.logger.warning(f"Skipping compound without ChEMBL ID")
-                        continue
-                    
-                    # Check if compound already exists
-                    existing_compound = self.db.get_compound_by_chembl_id(compound_data['chembl_id'])
-                    
-                    if existing_compound:
-                        # Update existing compound
-                        self.logger.info(f"Updating existing compound {compound_data['chembl_id']}")
-                        success = self.db.update_compound(compound_data['chembl_id'], compound_data)
-                        if success:
-                            self.logger.info(f"✅ Updated compound {compound_data['chembl_id']}")
-                            stored_count += 1
-                        else:
-                            self.logger.warning(f"❌ Failed to update compound {compound_data['chembl_id']}")
-                    else:
-                        # Insert new compound
-                        self.logger.info(f"Inserting new compound {compound_data['chembl_id']}")
-                        compound_id = self.db.insert_compound(compound_data)
-                        if compound_id:
-                            self.logger.info(f"✅ Stored compound {compound_data['chembl_id']} with ID {compound_id}")
-                            stored_count += 1
-                        else:
-                            self.logger.warning(f"❌ Failed to store compound {compound_data['chembl_id']}")
-                            
-                except Exception as e:
-                    self.logger.error(f"Error storing individual compound {compound.get('chembl_id')}: {e}")
-                    continue
+            storable = [compound for compound in compounds if compound.get('chembl_id')]
+            skipped = len(compounds) - len(storable)
+            if skipped:
+                self.logger.warning(f"Skipping {skipped} compounds without ChEMBL ID")
+            
+            if not storable:
+                return {}
             
-            self.logger.info(f"Successfully stored/updated {stored_count}/{len(compounds)} compounds")
+            compound_ids = self.db.upsert_compounds(storable)
+            for compound in storable:
+                if compound['chembl_id'] in compound_ids:
+                    compound['id'] = compound_ids[compound['chembl_id']]
+            
+            if compound_ids:
+                self.logger.info(f"✅ Successfully stored/updated {len(compound_ids)}/{len(compounds)} compounds")
+            else:
+                self.logger.warning(f"❌ Failed to store {len(storable)} compounds")
             
             # Force database sync if available
             if hasattr(self.db, 'sync'):
                 self.db.sync()
                 self.logger.info("Database sync completed")
+            
+            return compound_ids
                 
         except Exception as e:
             self.logger.error(f"Error storing compounds: {e}")
+            return {}
     
-    def get_compound_by_chembl_id(self, chembl_id: str) -> Optional[Dict]:
+    def get_compound_by_chembl_id(self, chembl_id: str, force_refresh: bool = False) -> Optional[Dict]:
         """
-        Get compound by ChEMBL ID, fetch from API if not in database - ENHANCED METHOD
+        Get compound by ChEMBL ID, fetch from API if not in database or stale - ENHANCED METHOD
         """
+        with fetch_scope(f"compound:{chembl_id}"):
+            return self._get_compound_by_chembl_id(chembl_id, force_refresh)
+    
+    def _get_compound_by_chembl_id(self, chembl_id: str, force_refresh: bool = False) -> Optional[Dict]:
+        stored = None
         try:
             self.logger.info(f"Getting compound {chembl_id}")
             
             # Try database first
-            if self.db:
-                compound = self.db.get_compound_by_chembl_id(chembl_id)
-                if compound:
-                    self.logger.info(f"Found compound {chembl_id} in database")
-                    return compound
-            
-            # If not in database, fetch from APIs
-            self.logger.info(f"Compound {chembl_id} not in database, fetching from APIs...")
+            if self.db and not force_refresh:
+                stored = self.db.get_compound_by_chembl_id(chembl_id)
+                fresh, _ = self._partition_by_freshness([chembl_id], {chembl_id: stored} if stored else {})
+                if chembl_id in fresh:
+                    self.logger.info(f"Found fresh compound {chembl_id} in database")
+                    return fresh[chembl_id]
+            
+            # If not in database (or stale), fetch from APIs
+            self.logger.info(f"Compound {chembl_id} not fresh in database, fetching from APIs...")
             compound = self.chembl_connector.get_compound_with_enriched_data(chembl_id)
             
             if compound:
@@ -673,12 +1503,439 @@ class DataAgent:
                 
                 return enriched
             
+            if stored:
+                self.logger.warning(f"Refresh failed for {chembl_id}, serving stored record")
+                return self._clean_stored_compound(stored)
+            
             self.logger.warning(f"Compound {chembl_id} not found in any source")
             return None
             
         except Exception as e:
             self.logger.error(f"Error getting compound {chembl_id}: {e}")
-            return None
+            return self._clean_stored_compound(stored) if stored else None
+    
+    def get_compounds_by_chembl_ids(self, chembl_ids: List[str], force_refresh: bool = False) -> Dict[str, Optional[Dict]]:
+        """
+        Get many compounds by ChEMBL ID, fetching all missing or stale ones from ChEMBL in bulk
+        """
+        with fetch_scope("compounds-by-id"):
+            return self._get_compounds_by_chembl_ids(chembl_ids, force_refresh)
+    
+    def _get_compounds_by_chembl_ids(self, chembl_ids: List[str], force_refresh: bool = False) -> Dict[str, Optional[Dict]]:
+        unique_ids = list(dict.fromkeys(chembl_ids))
+        stored = {} if force_refresh else self._load_stored_compounds(unique_ids)
+        fresh, missing_ids = self._partition_by_freshness(unique_ids, stored)
+        compounds = {chembl_id: fresh.get(chembl_id) for chembl_id in unique_ids}
+        
+        if missing_ids:
+            self.logger.info(f"{len(missing_ids)} compounds missing or stale in database, fetching from ChEMBL in bulk...")
+            try:
+                chembl_records = self.chembl_connector.get_compounds_batch(missing_ids)
+                fetched = [chembl_records[chembl_id] for chembl_id in missing_ids if chembl_id in chembl_records]
+                enriched_compounds = self._enrich_compounds(fetched, chembl_records)
+                
+                if enriched_compounds and self.db:
+                    self._store_compounds(enriched_compounds)
+                
+                for enriched in enriched_compounds:
+                    compounds[enriched['chembl_id']] = enriched
+            except Exception as e:
+                self.logger.error(f"Error fetching compounds {missing_ids} from ChEMBL: {e}")
+        
+        # Stale records whose refresh failed are still better than nothing
+        for chembl_id in missing_ids:
+            if not compounds.get(chembl_id) and chembl_id in stored:
+                compounds[chembl_id] = self._clean_stored_compound(stored[chembl_id])
+        
+        return compounds
+    
+    def ingest_bioactivities(self, chembl_id: str, chunk_size: int = 1000) -> Dict:
+        """
+        Stream every ChEMBL bioactivity of a stored compound into the database through one bulk COPY
+        """
+        try:
+            if not self.db:
+                return {'success': False, 'error': 'Database not available'}
+            
+            compound = self.get_compound_by_chembl_id(chembl_id)
+            if not compound or not compound.get('id'):
+                return {'success': False, 'error': f'Compound {chembl_id} not found in database'}
+            
+            pages = {'chunks': 0}
+            
+            def stream_activities():
+                for chunk in self.chembl_connector.iter_bioactivities(chembl_id, chunk_size=chunk_size):
+                    pages['chunks'] += 1
+                    yield from chunk
+            
+            # All pages are fetched first, then loaded with one COPY and merged in a
+            # single transaction; if any page fails, nothing is stored
+            result = self.db.bulk_ingest_bioactivities(compound['id'], stream_activities())
+            if result is None:
+                return {
+                    'success': False,
+                    'error': f'Failed to fetch or store bioactivities for {chembl_id}; nothing was ingested',
+                    'chunks': pages['chunks']
+                }
+            
+            self.logger.info(f"Ingested {result['rows_staged']} bioactivities for {chembl_id} "
+                             f"in {pages['chunks']} chunks ({result['inserted']} new, {result['updated']} updated)")
+            return {
+                'success': True,
+                'chembl_id': chembl_id,
+                'bioactivities_ingested': result['rows_staged'],
+                'inserted': result['inserted'],
+                'updated': result['updated'],
+                'chunks': pages['chunks']
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error ingesting bioactivities for {chembl_id}: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def batch_analyze_compounds(self, chembl_ids: List[str], max_workers: Optional[int] = None,
+                                force_refresh: bool = False, batched: bool = False) -> Dict:
+        """
+        Analyze many compounds with AI, running up to OLLAMA_NUM_PARALLEL analyses at once
+        
+        Duplicate IDs are analyzed once. All compounds are resolved in bulk first;
+        each result reports how long its analysis took in elapsed_ms. With batched,
+        several compounds share one generation (see analyze_compounds_batched).
+        """
+        started = time.perf_counter()
+        unique_ids = list(dict.fromkeys(chembl_id for chembl_id in chembl_ids if chembl_id))
+        
+        with fetch_scope("batch-analyze"):
+            # Resolve every compound up front so database misses are fetched in bulk
+            compounds = self.get_compounds_by_chembl_ids(unique_ids)
+            lookup_ms = round((time.perf_counter() - started) * 1000, 1)
+            workers = max_workers or self.ollama_num_parallel
+            
+            if batched:
+                found_ids = [chembl_id for chembl_id in unique_ids if compounds.get(chembl_id)]
+                analyses = dict(zip(found_ids, self.analyze_compounds_batched(
+                    [compounds[chembl_id] for chembl_id in found_ids],
+                    max_workers=workers, force_refresh=force_refresh)))
+                results = [
+                    {
+                        'chembl_id': chembl_id,
+                        'compound': compounds[chembl_id],
+                        'analysis': analyses[chembl_id],
+                        'elapsed_ms': analyses[chembl_id].get('elapsed_ms', 0)
+                    } if chembl_id in analyses else {'chembl_id': chembl_id, 'error': 'Compound not found'}
+                    for chembl_id in unique_ids
+                ]
+                return {
+                    'success': True,
+                    'results': results,
+                    'total_processed': len(results),
+                    'duplicates_removed': len(chembl_ids) - len(unique_ids),
+                    'workers': workers,
+                    'batched': True,
+                    'lookup_ms': lookup_ms,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+                }
+            
+            def analyze(chembl_id: str) -> Dict:
+                item_started = time.perf_counter()
+                compound = compounds.get(chembl_id)
+                if compound:
+                    result = {
+                        'chembl_id': chembl_id,
+                        'compound': compound,
+                        'analysis': self.analyze_compound_with_ai(compound, force_refresh=force_refresh)
+                    }
+                else:
+                    result = {
+                        'chembl_id': chembl_id,
+                        'error': 'Compound not found'
+                    }
+                result['elapsed_ms'] = round((time.perf_counter() - item_started) * 1000, 1)
+                return result
+            
+            self.logger.info(f"Analyzing {len(unique_ids)} compounds with {workers} workers")
+            
+            results = []
+            for chembl_id, (result, error) in zip(unique_ids, self._map_in_order(analyze, unique_ids, workers)):
+                results.append(result or {'chembl_id': chembl_id, 'error': str(error)})
+        
+        return {
+            'success': True,
+            'results': results,
+            'total_processed': len(results),
+            'duplicates_removed': len(chembl_ids) - len(unique_ids),
+            'workers': workers,
+            'lookup_ms': lookup_ms,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+    
+    def stream_compound_analysis(self, compound_data: Dict, force_refresh: bool = False) -> Iterator[Dict]:
+        """
+        Streaming counterpart of analyze_compound_with_ai
+        
+        Yields a 'token' event per chunk Ollama generates, then one 'analysis' event
+        with the full result. A stored analysis is yielded as a single 'analysis' event.
+        """
+        chembl_id = compound_data.get('chembl_id')
+        started = time.perf_counter()
+        
+        def elapsed_ms() -> float:
+            return round((time.perf_counter() - started) * 1000, 1)
+        
+        if not self.current_model:
+            yield {'event': 'analysis', 'data': {
+                'chembl_id': chembl_id,
+                'success': False,
+                'error': 'No Ollama model available',
+                'model_used': None
+            }}
+            return
+        
+        try:
+            compound_id, stored_analysis = self._load_stored_analysis(compound_data) if self.db else (None, None)
+            if stored_analysis and not force_refresh:
+                yield {'event': 'analysis', 'data': dict(stored_analysis, chembl_id=chembl_id, elapsed_ms=elapsed_ms())}
+                return
+            
+            payload = self._build_generate_payload(self._build_analysis_prompt(compound_data))
+            
+            tokens = []
+            for chunk in self.ollama.generate_stream(payload):
+                if chunk.get('response'):
+                    tokens.append(chunk['response'])
+                    yield {'event': 'token', 'data': {'chembl_id': chembl_id, 'token': chunk['response']}}
+            
+            analysis = ''.join(tokens)
+            self._save_analysis(compound_id, compound_data, analysis)
+            yield {'event': 'analysis', 'data': {
+                'chembl_id': chembl_id,
+                'success': True,
+                'analysis': analysis,
+                'model_used': self.current_model,
+                'cached': False,
+                'elapsed_ms': elapsed_ms()
+            }}
+            
+        except Exception as e:
+            self.logger.error(f"Error streaming AI analysis of {chembl_id}: {e}")
+            yield {'event': 'analysis', 'data': {
+                'chembl_id': chembl_id,
+                'success': False,
+                'error': str(e),
+                'model_used': self.current_model,
+                'elapsed_ms': elapsed_ms()
+            }}
+    
+    def stream_compound_query(self, query: str, limit: int = 10, include_ai_analysis: bool = True,
+                              max_workers: Optional[int] = None, force_refresh: bool = False) -> Iterator[Dict]:
+        """
+        Streaming counterpart of process_compound_query
+        
+        Yields a 'search' event with the hits, a 'compound' event as soon as each
+        compound is served from the database or enriched, the analysis 'token' and
+        'analysis' events of every compound (tagged with its chembl_id), and a
+        final 'done' event.
+        """
+        with fetch_scope(f"query:{query}") as fetch_context:
+            try:
+                chembl_ids = self.chembl_connector.search_compound_ids(query, limit)
+                yield {'event': 'search', 'data': {'query': query, 'chembl_ids': chembl_ids}}
+                
+                errors = []
+                compounds = []
+                for event in self._stream_compounds(chembl_ids, force_refresh, max_workers):
+                    if event['event'] == 'compound':
+                        compounds.append(event['data'])
+                    else:
+                        errors.append(event['data'])
+                    yield event
+                
+                if include_ai_analysis:
+                    streams = [lambda compound=served['compound']: self.stream_compound_analysis(compound, force_refresh)
+                               for served in compounds]
+                    yield from self._merge_streams(streams, max_workers or self.ollama_num_parallel)
+                
+                yield {'event': 'done', 'data': {
+                    'query': query,
+                    'compounds_found': len(compounds),
+                    'served_from_database': sum(1 for served in compounds if served['served_from_database']),
+                    'ai_analysis_included': include_ai_analysis,
+                    'errors': errors,
+                    'fetch_stats': fetch_context.stats()
+                }}
+                
+            except Exception as e:
+                self.logger.error(f"Error streaming compound query: {e}")
+                yield {'event': 'error', 'data': {'query': query, 'error': str(e)}}
+    
+    def stream_batch_analysis(self, chembl_ids: List[str], max_workers: Optional[int] = None,
+                              force_refresh: bool = False) -> Iterator[Dict]:
+        """
+        Streaming counterpart of batch_analyze_compounds
+        
+        Yields a 'compound' event per unique ID as soon as it is served from the
+        database or enriched (an 'error' event for IDs that cannot be resolved),
+        then the analysis events of up to OLLAMA_NUM_PARALLEL compounds at a time,
+        and a final 'done' event.
+        """
+        started = time.perf_counter()
+        unique_ids = list(dict.fromkeys(chembl_id for chembl_id in chembl_ids if chembl_id))
+        
+        with fetch_scope("batch-analyze"):
+            try:
+                compounds = {}
+                for event in self._stream_compounds(unique_ids):
+                    if event['event'] == 'compound':
+                        compounds[event['data']['chembl_id']] = event['data']['compound']
+                    yield event
+                for chembl_id in unique_ids:
+                    if chembl_id not in compounds:
+                        yield {'event': 'error', 'data': {'chembl_id': chembl_id, 'error': 'Compound not found'}}
+                
+                streams = [lambda compound=compounds[chembl_id]: self.stream_compound_analysis(compound, force_refresh)
+                           for chembl_id in unique_ids if chembl_id in compounds]
+                yield from self._merge_streams(streams, max_workers or self.ollama_num_parallel)
+                
+                yield {'event': 'done', 'data': {
+                    'total_processed': len(unique_ids),
+                    'duplicates_removed': len(chembl_ids) - len(unique_ids),
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+                }}
+                
+            except Exception as e:
+                self.logger.error(f"Error streaming batch analysis: {e}")
+                yield {'event': 'error', 'data': {'error': str(e)}}
+    
+    def _stream_compounds(self, chembl_ids: List[str], force_refresh: bool = False,
+                          max_workers: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Resolve compounds like process_compound_query, yielding each one as soon as it is ready
+        
+        Yields a 'compound' event per fresh stored record first, then one per compound
+        as its enrichment finishes (same page preparation as _enrich_compounds), and
+        an 'error' event per failed enrichment. A stale stored record is still served
+        when its refresh fails. Newly enriched compounds are stored at the end.
+        """
+        stored = {} if force_refresh else self._load_stored_compounds(chembl_ids)
+        fresh, stale_ids = self._partition_by_freshness(chembl_ids, stored)
+        for chembl_id, compound in fresh.items():
+            yield {'event': 'compound', 'data': {'chembl_id': chembl_id, 'compound': compound,
+                                                 'served_from_database': True}}
+        if not stale_ids:
+            return
+        
+        def serve_stored(chembl_id: str) -> Iterator[Dict]:
+            if chembl_id in stored:
+                self.logger.warning(f"Refresh failed for {chembl_id}, serving stored record")
+                yield {'event': 'compound', 'data': {'chembl_id': chembl_id,
+                                                     'compound': self._clean_stored_compound(stored[chembl_id]),
+                                                     'served_from_database': True}}
+        
+        chembl_records = self.chembl_connector.get_compounds_batch(stale_ids)
+        for chembl_id in stale_ids:
+            if chembl_id not in chembl_records:
+                yield from serve_stored(chembl_id)
+        
+        compounds = [chembl_records[chembl_id] for chembl_id in stale_ids if chembl_id in chembl_records]
+        enrich = self._prepare_enrichment(compounds, chembl_records)
+        
+        def enrich_stream(compound: Dict) -> Iterator[Dict]:
+            chembl_id = compound.get('chembl_id')
+            try:
+                enriched = enrich(compound)
+            except Exception as e:
+                yield {'event': 'error', 'data': {'chembl_id': chembl_id, 'error': str(e)}}
+                enriched = None
+            if enriched:
+                yield {'event': 'compound', 'data': {'chembl_id': chembl_id, 'compound': enriched,
+                                                     'served_from_database': False}}
+            else:
+                yield from serve_stored(chembl_id)
+        
+        enriched_compounds = []
+        streams = [lambda compound=compound: enrich_stream(compound) for compound in compounds]
+        for event in self._merge_streams(streams, max_workers or self.enrichment_workers):
+            if event['event'] == 'compound' and not event['data']['served_from_database']:
+                enriched_compounds.append(event['data']['compound'])
+            yield event
+        
+        # Store before any analysis, so analyses can be stored against the rows
+        if self.db and enriched_compounds:
+            self._store_compounds(enriched_compounds)
+    
+    def _merge_streams(self, streams: List[Callable[[], Iterator[Dict]]], max_workers: int) -> Iterator[Dict]:
+        """
+        Run event generators on up to max_workers threads and yield their events as they arrive
+        
+        A generator that raises ends with an 'error' event. Closing the merged stream
+        (e.g. on client disconnect) stops the workers at their next event.
+        """
+        if not streams:
+            return
+        
+        events = queue.Queue()
+        finished = object()
+        stop = threading.Event()
+        
+        def run(stream: Callable[[], Iterator[Dict]]):
+            try:
+                for event in stream():
+                    if stop.is_set():
+                        break
+                    events.put(event)
+            except Exception as e:
+                events.put({'event': 'error', 'data': {'error': str(e)}})
+            finally:
+                events.put(finished)
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(streams))))
+        try:
+            for stream in streams:
+                executor.submit(contextvars.copy_context().run, run, stream)
+            
+            remaining = len(streams)
+            while remaining:
+                event = events.get()
+                if event is finished:
+                    remaining -= 1
+                else:
+                    yield event
+        finally:
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def search_stored_compounds(self, query: Optional[str] = None, limit: int = 20,
+                                cursor: Optional[str] = None) -> Dict:
+        """
+        Page through stored compounds matching query (all compounds when empty) with keyset cursors
+        
+        Raises ValueError for a malformed cursor.
+        """
+        if not self.db:
+            return {'success': False, 'error': 'Database not available'}
+        
+        page = self.db.search_compounds_page(query, limit=limit, cursor=cursor)
+        if page is None:
+            return {'success': False, 'error': 'Database search failed'}
+        
+        compounds = [self._clean_stored_compound(record) for record in page['compounds']]
+        return {
+            'success': True,
+            'data': {
+                'compounds': compounds,
+                'compounds_found': len(compounds),
+                'query': query or '',
+                'next_cursor': page['next_cursor'],
+                'has_more': page['next_cursor'] is not None
+            }
+        }
+    
+    def iter_stored_compounds(self, query: Optional[str] = None, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Stream stored compounds matching query (all compounds when empty) with flat memory use
+        """
+        for record in self.db.iter_compounds(query, batch_size=batch_size):
+            yield self._clean_stored_compound(record)
     
     def get_enrichment_status(self, chembl_id: str) -> Dict:
         """
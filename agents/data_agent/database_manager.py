@@ -2,11 +2,79 @@
 
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+import base64
+import csv
 import json
 import os
-from typing import Dict, List, Optional
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import logging
 
+from freshness import refreshed_groups
+
+CHEMBL_ID_PATTERN = re.compile(r'^CHEMBL\d+$', re.IGNORECASE)
+INCHI_KEY_PATTERN = re.compile(r'^[A-Z]{14}-[A-Z]{10}-[A-Z]$', re.IGNORECASE)
+
+# Upper bounds for one page of search_compounds_page and one fetch batch of iter_compounds
+MAX_SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '100'))
+MAX_EXPORT_BATCH_SIZE = 5000
+
+# Rows rendered for COPY are kept in memory up to this size, then spooled to disk
+COPY_SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# Idempotent schema changes applied by migrate() at startup, one transaction each
+SCHEMA_MIGRATIONS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE compounds ADD COLUMN IF NOT EXISTS inchi_key VARCHAR(27)",
+    "ALTER TABLE compounds ADD COLUMN IF NOT EXISTS structure_refreshed_at TIMESTAMP",
+    "ALTER TABLE compounds ADD COLUMN IF NOT EXISTS cross_references_refreshed_at TIMESTAMP",
+    "ALTER TABLE compounds ADD COLUMN IF NOT EXISTS bioactivities_refreshed_at TIMESTAMP",
+]
+
+# Age in seconds of the whole row and of each freshness field group, computed by the database
+COMPOUND_AGE_COLUMNS = """
+       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - updated_at)) AS age_seconds,
+       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - structure_refreshed_at)) AS structure_age_seconds,
+       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - cross_references_refreshed_at)) AS cross_references_age_seconds,
+       EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - bioactivities_refreshed_at)) AS bioactivities_age_seconds
+"""
+
+# Indexes behind search_compounds, built with CREATE INDEX CONCURRENTLY so writes are never blocked
+SEARCH_INDEXES = {
+    'idx_compounds_inchi_key': "ON compounds (inchi_key)",
+    'idx_compounds_chembl_trgm': "ON compounds USING gin (chembl_id gin_trgm_ops)",
+    'idx_compounds_pref_name_trgm': "ON compounds USING gin (pref_name gin_trgm_ops)",
+    'idx_compounds_formula_trgm': "ON compounds USING gin (molecular_formula gin_trgm_ops)",
+    'idx_compounds_pref_name_tsv': "ON compounds USING gin (to_tsvector('simple', COALESCE(pref_name, '')))",
+}
+
+# Relevance-ranked compound search; each OR branch can use an index:
+# equality, trigram (ILIKE and %) and tsvector (@@)
+RANKED_SEARCH_SQL = """
+SELECT *,
+       (CASE WHEN chembl_id = %(upper)s OR smiles = %(query)s THEN 2.0 ELSE 0.0 END
+        + ts_rank(to_tsvector('simple', COALESCE(pref_name, '')), plainto_tsquery('simple', %(query)s))
+        + GREATEST(similarity(COALESCE(pref_name, ''), %(query)s),
+                   similarity(COALESCE(molecular_formula, ''), %(query)s),
+                   similarity(chembl_id, %(query)s)))::float8 AS search_rank
+FROM compounds
+WHERE chembl_id = %(upper)s
+   OR smiles = %(query)s
+   OR chembl_id ILIKE %(pattern)s
+   OR molecular_formula ILIKE %(pattern)s
+   OR pref_name ILIKE %(pattern)s
+   OR pref_name %% %(query)s
+   OR to_tsvector('simple', COALESCE(pref_name, '')) @@ plainto_tsquery('simple', %(query)s)
+"""
+
+BIOACTIVITY_COLUMNS = ['target_chembl_id', 'standard_type', 'standard_value', 'standard_units', 'pchembl_value']
+
+
 class DatabaseManager:
     """Database operations for MediAgent with improved error handling"""
     
@@ -35,45 +103,131 @@ class DatabaseManager:
         safe_params = {k: v for k, v in self.connection_params.items() if k != 'password'}
         logging.info(f"Database connection params: {safe_params}")
         
+        # Connection pool settings; DB_POOL_ENABLED=false opens one connection per call as before
+        self.pool_enabled = os.getenv('DB_POOL_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+        self.pool_min = int(os.getenv('DB_POOL_MIN', '1'))
+        self.pool_max = int(os.getenv('DB_POOL_MAX', '10'))
+        # Idle connections are pinged on checkout once they have been idle this long
+        self.pool_check_after = float(os.getenv('DB_POOL_CHECK_AFTER_SECONDS', '30'))
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        self._pool_slots = threading.BoundedSemaphore(self.pool_max)
+        self._last_used: Dict[int, float] = {}
+        self._params_resolved = False
+    
+    def _resolve_connection_params(self) -> Dict:
+        """Find working connection params once, trying the host and credential fallbacks in order"""
+        if self._params_resolved:
+            return self.connection_params
+        
+        candidates = [self.connection_params]
+        # Try localhost if postgres hostname failed
+        if self.connection_params['host'] == 'postgres':
+            candidates.append(dict(self.connection_params, host='localhost'))
+        # Try alternative credentials
+        candidates.append(dict(self.connection_params, user='admin', password='mediagent'))
+        
+        first_error = None
+        for params in candidates:
+            try:
+                conn = psycopg2.connect(**params)
+                conn.close()
+                if params is not self.connection_params:
+                    safe_params = {k: v for k, v in params.items() if k != 'password'}
+                    logging.info(f"Using fallback database connection params: {safe_params}")
+                self.connection_params = params
+                self._params_resolved = True
+                return params
+            except psycopg2.OperationalError as e:
+                logging.error(f"Database connection failed for host {params['host']}: {e}")
+                first_error = first_error or e
+        raise first_error
+    
     def get_connection(self):
-        """Get database connection with better error handling"""
+        """Get a new unpooled database connection; the caller is responsible for closing it"""
         try:
-            conn = psycopg2.connect(**self.connection_params)
-            return conn
+            return psycopg2.connect(**self._resolve_connection_params())
         except psycopg2.OperationalError as e:
             logging.error(f"Database connection failed: {e}")
-            
-            # Try localhost if postgres hostname failed
-            if self.connection_params['host'] == 'postgres':
-                alt_params = self.connection_params.copy()
-                alt_params['host'] = 'localhost'
-                
-                try:
-                    logging.info("Trying localhost instead of postgres hostname...")
-                    conn = psycopg2.connect(**alt_params)
-                    self.connection_params = alt_params  # Update if successful
-                    return conn
-                except psycopg2.OperationalError as e2:
-                    logging.error(f"Localhost connection also failed: {e2}")
-            
-            # Try alternative credentials
-            alt_params = self.connection_params.copy()
-            alt_params['user'] = 'admin'
-            alt_params['password'] = 'mediagent'
-            
-            try:
-                logging.info("Trying alternative credentials...")
-                conn = psycopg2.connect(**alt_params)
-                self.connection_params = alt_params  # Update if successful
+            raise
+    
+    def _get_pool(self) -> psycopg2.pool.ThreadedConnectionPool:
+        """Create the shared connection pool on first use"""
+        with self._pool_lock:
+            if self.pool is None:
+                params = self._resolve_connection_params()
+                self.pool = psycopg2.pool.ThreadedConnectionPool(self.pool_min, self.pool_max, **params)
+                logging.info(f"Database connection pool created (min={self.pool_min}, max={self.pool_max})")
+            return self.pool
+    
+    def _is_healthy(self, conn) -> bool:
+        """Cheap liveness check for a pooled connection before handing it out"""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0.0) < self.pool_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    def _checkout(self):
+        """Take a healthy connection from the pool, replacing broken ones"""
+        pool = self._get_pool()
+        for _ in range(self.pool_max + 1):
+            conn = pool.getconn()
+            if self._is_healthy(conn):
                 return conn
-            except psycopg2.OperationalError as e2:
-                logging.error(f"Alternative credentials also failed: {e2}")
-                raise e
+            logging.warning("Discarding broken pooled database connection")
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("No healthy database connection available in pool")
+    
+    @contextmanager
+    def connection(self) -> Iterator:
+        """
+        Borrow a connection for one transaction: commits on success, rolls back on
+        error and always gives the connection back (to the pool, or closes it).
+        """
+        if not self.pool_enabled:
+            conn = self.get_connection()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+            return
+        
+        # Block instead of failing with PoolError when every connection is in use
+        with self._pool_slots:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+            finally:
+                self._last_used[id(conn)] = time.monotonic()
+                self.pool.putconn(conn, close=bool(conn.closed))
+    
+    def close(self):
+        """Close every pooled connection"""
+        with self._pool_lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+                self._last_used.clear()
+                logging.info("Database connection pool closed")
     
     def test_connection(self):
         """Test database connection and return status"""
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT version()")
                     version = cur.fetchone()[0]
@@ -96,13 +250,13 @@ class DatabaseManager:
             molecular_formula = EXCLUDED.molecular_formula,
             molecular_weight = EXCLUDED.molecular_weight,
             pref_name = EXCLUDED.pref_name,
-            bioactivities_count = EXCLUDED.bioactivities_count,
+            bioactivities_count = COALESCE(EXCLUDED.bioactivities_count, compounds.bioactivities_count),
             updated_at = CURRENT_TIMESTAMP
         RETURNING id;
         """
         
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor() as cur:
                     # Prepare data with defaults for missing fields
                     data = {
@@ -129,6 +283,106 @@ class DatabaseManager:
             logging.error(f"Database insert error for {compound_data.get('chembl_id')}: {e}")
             return None
     
+    def upsert_compounds(self, compounds: List[Dict], page_size: Optional[int] = None) -> Dict[str, int]:
+        """
+        Insert or update a batch of compounds in one statement and transaction, returning ids by ChEMBL ID
+        
+        compounds.smiles is NOT NULL, so compounds without SMILES (biologics, some
+        peptides) are skipped rather than failing the whole batch. page_size defaults
+        to the batch size, i.e. a single round trip.
+        """
+        # ON CONFLICT cannot touch the same row twice in one statement: keep the last copy per ChEMBL ID
+        rows = {}
+        missing_smiles = []
+        for compound in compounds:
+            chembl_id = compound.get('chembl_id')
+            if chembl_id and not compound.get('smiles'):
+                missing_smiles.append(chembl_id)
+            elif chembl_id:
+                groups = refreshed_groups(compound)
+                rows[chembl_id] = (
+                    chembl_id,
+                    compound.get('pubchem_cid'),
+                    compound.get('smiles'),
+                    compound.get('molecular_formula'),
+                    compound.get('molecular_weight'),
+                    compound.get('pref_name'),
+                    compound.get('bioactivities_count'),
+                    compound.get('inchi_key'),
+                    'structure' in groups,
+                    'cross_references' in groups,
+                    'bioactivities' in groups
+                )
+        
+        if missing_smiles:
+            logging.warning(f"Skipping {len(missing_smiles)} compounds without SMILES: {', '.join(missing_smiles)}")
+        
+        if not rows:
+            return {}
+        
+        # Missing (NULL) values never overwrite data that is already stored, and only the
+        # freshness groups that were actually fetched (see refreshed_groups) get a new timestamp
+        query = """
+        INSERT INTO compounds (chembl_id, pubchem_cid, smiles, molecular_formula,
+                             molecular_weight, pref_name, bioactivities_count, inchi_key,
+                             structure_refreshed_at, cross_references_refreshed_at, bioactivities_refreshed_at)
+        VALUES %s
+        ON CONFLICT (chembl_id) DO UPDATE SET
+            pubchem_cid = COALESCE(EXCLUDED.pubchem_cid, compounds.pubchem_cid),
+            smiles = COALESCE(EXCLUDED.smiles, compounds.smiles),
+            molecular_formula = COALESCE(EXCLUDED.molecular_formula, compounds.molecular_formula),
+            molecular_weight = COALESCE(EXCLUDED.molecular_weight, compounds.molecular_weight),
+            pref_name = COALESCE(EXCLUDED.pref_name, compounds.pref_name),
+            bioactivities_count = COALESCE(EXCLUDED.bioactivities_count, compounds.bioactivities_count),
+            inchi_key = COALESCE(EXCLUDED.inchi_key, compounds.inchi_key),
+            structure_refreshed_at = COALESCE(EXCLUDED.structure_refreshed_at, compounds.structure_refreshed_at),
+            cross_references_refreshed_at = COALESCE(EXCLUDED.cross_references_refreshed_at,
+                                                     compounds.cross_references_refreshed_at),
+            bioactivities_refreshed_at = COALESCE(EXCLUDED.bioactivities_refreshed_at, compounds.bioactivities_refreshed_at),
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING chembl_id, id
+        """
+        template = ("(%s, %s, %s, %s, %s, %s, %s, %s, CASE WHEN %s THEN CURRENT_TIMESTAMP END, "
+                    "CASE WHEN %s THEN CURRENT_TIMESTAMP END, CASE WHEN %s THEN CURRENT_TIMESTAMP END)")
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    results = psycopg2.extras.execute_values(
+                        cur, query, list(rows.values()), template=template,
+                        page_size=page_size or len(rows), fetch=True
+                    )
+                    compound_ids = {chembl_id: compound_id for chembl_id, compound_id in results}
+                    logging.info(f"Upserted {len(compound_ids)} compounds")
+                    return compound_ids
+        except Exception as e:
+            logging.error(f"Database bulk upsert error for {len(rows)} compounds: {e}")
+            return {}
+    
+    def update_bioactivity_counts(self, counts: Dict[str, int]) -> int:
+        """Store refreshed bioactivity counts by ChEMBL ID in one statement; returns the number of rows updated"""
+        if not counts:
+            return 0
+        
+        query = """
+        UPDATE compounds SET
+            bioactivities_count = refreshed.bioactivities_count,
+            bioactivities_refreshed_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS refreshed (chembl_id, bioactivities_count)
+        WHERE compounds.chembl_id = refreshed.chembl_id
+        """
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    psycopg2.extras.execute_values(cur, query, list(counts.items()), page_size=len(counts))
+                    logging.info(f"Updated bioactivity counts of {cur.rowcount} compounds")
+                    return cur.rowcount
+        except Exception as e:
+            logging.error(f"Database bioactivity count update error: {e}")
+            return 0
+    
     def update_compound(self, chembl_id: str, compound_data: Dict) -> bool:
         """Update compound in database - MISSING METHOD ADDED"""
         query = """
@@ -144,7 +398,7 @@ class DatabaseManager:
         """
         
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor() as cur:
                     # Prepare data with the chembl_id
                     data = compound_data.copy()
@@ -183,7 +437,7 @@ class DatabaseManager:
     def sync(self):
         """Sync/commit database changes - MISSING METHOD ADDED"""
         try:
-            # For psycopg2, we use context managers which auto-commit
+            # Every connection() block commits its own transaction
             # This method is here for compatibility
             logging.info("Database sync called - using auto-commit via context managers")
             return True
@@ -195,37 +449,87 @@ class DatabaseManager:
         """Insert bioactivity data"""
         if not bioactivities:
             return True
-            
-        query = """
-        INSERT INTO bioactivities (compound_id, target_chembl_id, standard_type, 
-                                 standard_value, standard_units, pchembl_value)
-        VALUES (%(compound_id)s, %(target_chembl_id)s, %(standard_type)s,
-                %(standard_value)s, %(standard_units)s, %(pchembl_value)s)
-        ON CONFLICT (compound_id, target_chembl_id, standard_type) DO UPDATE SET
-            standard_value = EXCLUDED.standard_value,
-            standard_units = EXCLUDED.standard_units,
-            pchembl_value = EXCLUDED.pchembl_value,
-            updated_at = CURRENT_TIMESTAMP
+        return self.bulk_ingest_bioactivities(compound_id, bioactivities) is not None
+    
+    def bulk_ingest_bioactivities(self, compound_id: int, bioactivities: Iterable[Dict]) -> Optional[Dict]:
         """
+        Load bioactivities with COPY into a staging table and merge them into
+        bioactivities with a single INSERT ... ON CONFLICT, in one transaction.
         
-        try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cur:
-                    for activity in bioactivities:
-                        activity['compound_id'] = compound_id
-                        cur.execute(query, activity)
-                    logging.info(f"Inserted {len(bioactivities)} bioactivities for compound {compound_id}")
-            return True
-        except Exception as e:
-            logging.error(f"Bioactivity insert error: {e}")
-            return False
+        bioactivities may be any iterable (e.g. a generator over ChEMBL pages). It is
+        drained into a local CSV spool before a connection is taken, so no pooled
+        connection or transaction waits on the source, and a source error stores
+        nothing. When the same (target_chembl_id, standard_type) appears more than
+        once, the last row wins. Returns the staged, inserted and updated row
+        counts, or None on error.
+        """
+        staging_table = """
+        CREATE TEMP TABLE bioactivities_staging (
+            seq BIGINT,
+            target_chembl_id TEXT,
+            standard_type TEXT,
+            standard_value TEXT,
+            standard_units TEXT,
+            pchembl_value TEXT
+        ) ON COMMIT DROP
+        """
+        
+        copy_sql = f"COPY bioactivities_staging (seq, {', '.join(BIOACTIVITY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+        
+        # xmax is 0 only for rows created by this statement, which tells inserts from updates
+        merge_sql = """
+        WITH merged AS (
+            INSERT INTO bioactivities (compound_id, target_chembl_id, standard_type,
+                                     standard_value, standard_units, pchembl_value)
+            SELECT DISTINCT ON (target_chembl_id, standard_type)
+                   %s, target_chembl_id, standard_type,
+                   standard_value::float, standard_units, pchembl_value::float
+            FROM bioactivities_staging
+            ORDER BY target_chembl_id, standard_type, seq DESC
+            ON CONFLICT (compound_id, target_chembl_id, standard_type) DO UPDATE SET
+                standard_value = EXCLUDED.standard_value,
+                standard_units = EXCLUDED.standard_units,
+                pchembl_value = EXCLUDED.pchembl_value,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged
+        """
+        
+        with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_MAX_MEMORY, mode='w+', newline='') as spool:
+            writer = csv.writer(spool, lineterminator='\n')
+            rows_staged = 0
+            try:
+                for activity in bioactivities:
+                    writer.writerow([rows_staged] + [activity.get(column) for column in BIOACTIVITY_COLUMNS])
+                    rows_staged += 1
+            except Exception as e:
+                logging.error(f"Bioactivity source error for compound {compound_id} after {rows_staged} rows, "
+                              f"nothing ingested: {e}")
+                return None
+            spool.seek(0)
+            
+            try:
+                with self.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(staging_table)
+                        cur.copy_expert(copy_sql, spool)
+                        cur.execute(merge_sql, (compound_id,))
+                        inserted, updated = cur.fetchone()
+                
+                result = {'rows_staged': rows_staged, 'inserted': inserted, 'updated': updated}
+                logging.info(f"Ingested bioactivities for compound {compound_id}: {result}")
+                return result
+            except Exception as e:
+                logging.error(f"Bioactivity bulk ingest error for compound {compound_id}: {e}")
+                return None
     
     def get_compound_by_chembl_id(self, chembl_id: str) -> Optional[Dict]:
-        """Get compound by ChEMBL ID"""
-        query = "SELECT * FROM compounds WHERE chembl_id = %s"
+        """Get compound by ChEMBL ID, with its age in seconds (see COMPOUND_AGE_COLUMNS)"""
+        query = f"SELECT *, {COMPOUND_AGE_COLUMNS} FROM compounds WHERE chembl_id = %s"
         
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                     cur.execute(query, (chembl_id,))
                     result = cur.fetchone()
@@ -240,8 +544,266 @@ class DatabaseManager:
             logging.error(f"Database query error for {chembl_id}: {e}")
             return None
     
+    def get_compounds_by_chembl_ids(self, chembl_ids: List[str]) -> Dict[str, Dict]:
+        """Get many compounds in one query, keyed by ChEMBL ID, with their age in seconds"""
+        if not chembl_ids:
+            return {}
+        
+        query = f"""
+        SELECT *, {COMPOUND_AGE_COLUMNS}
+        FROM compounds
+        WHERE chembl_id = ANY(%s)
+        """
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(query, (list(chembl_ids),))
+                    compounds = {row['chembl_id']: dict(row) for row in cur.fetchall()}
+                    logging.info(f"Found {len(compounds)}/{len(chembl_ids)} compounds in database")
+                    return compounds
+        except Exception as e:
+            logging.error(f"Database bulk query error: {e}")
+            return {}
+    
+    def migrate(self, build_indexes_in_background: bool = True) -> bool:
+        """
+        Apply SCHEMA_MIGRATIONS, then build any missing search indexes
+        
+        Meant to run once at startup, so no user request ever runs DDL. The index
+        build can take a while on a large compounds table; by default it runs on a
+        background thread and does not block writes (CREATE INDEX CONCURRENTLY).
+        Searches work before the indexes exist, just slower; without pg_trgm,
+        search_compounds falls back to plain ILIKE.
+        Returns False if a migration statement failed.
+        """
+        applied = 0
+        for statement in SCHEMA_MIGRATIONS:
+            # One transaction per statement, so e.g. a missing pg_trgm does not roll back the column
+            try:
+                with self.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(statement)
+                applied += 1
+            except psycopg2.OperationalError as e:
+                logging.error(f"Database unavailable for schema migration: {e}")
+                return False
+            except Exception as e:
+                logging.error(f"Error running schema migration '{statement}': {e}")
+        logging.info(f"Schema migrations applied ({applied}/{len(SCHEMA_MIGRATIONS)} statements succeeded)")
+        
+        if build_indexes_in_background:
+            threading.Thread(target=self.ensure_search_indexes, name='search-index-build', daemon=True).start()
+        else:
+            self.ensure_search_indexes()
+        return applied == len(SCHEMA_MIGRATIONS)
+    
+    def ensure_search_indexes(self) -> bool:
+        """
+        Create missing search indexes with CREATE INDEX CONCURRENTLY
+        
+        Runs in autocommit mode on a dedicated connection, since CONCURRENTLY cannot
+        run inside a transaction. An invalid index left by an interrupted build is
+        dropped and rebuilt.
+        """
+        try:
+            conn = self.get_connection()
+        except Exception as e:
+            logging.error(f"Error creating search indexes: {e}")
+            return False
+        
+        created = 0
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for name, definition in SEARCH_INDEXES.items():
+                    try:
+                        cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+                        row = cur.fetchone()
+                        if row and row[0]:
+                            created += 1
+                            continue
+                        if row:
+                            logging.warning(f"Rebuilding invalid index {name}")
+                            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                        
+                        started = time.monotonic()
+                        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}")
+                        created += 1
+                        logging.info(f"Created search index {name} in {time.monotonic() - started:.1f}s")
+                    except psycopg2.Error as e:
+                        logging.error(f"Error creating search index {name}: {e}")
+        finally:
+            conn.close()
+        
+        logging.info(f"Search indexes created/verified ({created}/{len(SEARCH_INDEXES)})")
+        return created == len(SEARCH_INDEXES)
+    
     def search_compounds(self, query: str, limit: int = 20) -> List[Dict]:
-        """Search compounds by various criteria"""
+        """
+        Search compounds by ChEMBL ID, InChIKey, SMILES, name or formula, best matches first
+        
+        Full ChEMBL IDs and InChIKeys are answered by exact index lookups. Everything
+        else goes through the trigram and full-text indexes, ranked by relevance.
+        """
+        query = (query or '').strip()
+        if not query:
+            return []
+        
+        if INCHI_KEY_PATTERN.match(query):
+            return self._search_exact('inchi_key', query.upper(), limit)
+        
+        if CHEMBL_ID_PATTERN.match(query):
+            compounds = self._search_exact('chembl_id', query.upper(), limit)
+            if compounds:
+                return compounds
+        
+        sql = f"{RANKED_SEARCH_SQL} ORDER BY search_rank DESC, id LIMIT %(limit)s"
+        params = dict(self._search_params(query), limit=limit)
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(sql, params)
+                    compounds = [dict(row) for row in cur.fetchall()]
+                    logging.info(f"Found {len(compounds)} compounds matching query: {query}")
+                    return compounds
+        except Exception as e:
+            logging.error(f"Indexed search error, falling back to ILIKE scan: {e}")
+            return self._search_compounds_ilike(query, limit)
+    
+    def search_compounds_page(self, query: Optional[str] = None, limit: int = 20,
+                              cursor: Optional[str] = None) -> Optional[Dict]:
+        """
+        One page of search results (or of all compounds when query is empty) with keyset pagination
+        
+        Pages are ordered by (search_rank DESC, id) and continue strictly after the
+        row encoded in cursor, so deep pages cost the same as the first one. limit
+        is clamped to 1..SEARCH_MAX_PAGE_SIZE.
+        Returns {'compounds': [...], 'next_cursor': str or None}, or None on error.
+        Raises ValueError for a malformed cursor or limit.
+        """
+        query = (query or '').strip()
+        limit = max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE))
+        after_rank, after_id = self.decode_cursor(cursor) if cursor else (None, None)
+        if query and cursor and after_rank is None:
+            raise ValueError("Cursor does not belong to a search query")
+        
+        if query:
+            # Exact identifier matches fit on a single page
+            exact_column = 'inchi_key' if INCHI_KEY_PATTERN.match(query) else None
+            if not exact_column and CHEMBL_ID_PATTERN.match(query):
+                exact_column = 'chembl_id'
+            if exact_column and cursor is None:
+                compounds = self._search_exact(exact_column, query.upper(), limit)
+                if compounds or exact_column == 'inchi_key':
+                    return {'compounds': compounds, 'next_cursor': None}
+            
+            sql = f"SELECT * FROM ({RANKED_SEARCH_SQL}) ranked"
+            if cursor:
+                sql += " WHERE search_rank < %(after_rank)s OR (search_rank = %(after_rank)s AND id > %(after_id)s)"
+            sql += " ORDER BY search_rank DESC, id LIMIT %(limit)s"
+            params = dict(self._search_params(query), after_rank=after_rank, after_id=after_id)
+        else:
+            sql = "SELECT * FROM compounds"
+            if cursor:
+                sql += " WHERE id > %(after_id)s"
+            sql += " ORDER BY id LIMIT %(limit)s"
+            params = {'after_id': after_id}
+        
+        # Fetch one extra row to know whether there is a next page
+        params['limit'] = limit + 1
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(sql, params)
+                    rows = [dict(row) for row in cur.fetchall()]
+        except Exception as e:
+            logging.error(f"Database paginated search error for query '{query}': {e}")
+            return None
+        
+        compounds = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit and compounds:
+            last = compounds[-1]
+            next_cursor = self.encode_cursor(last.get('search_rank'), last['id'])
+        
+        logging.info(f"Found {len(compounds)} compounds on page for query: {query or '*'}")
+        return {'compounds': compounds, 'next_cursor': next_cursor}
+    
+    def iter_compounds(self, query: Optional[str] = None, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        Stream every compound (or every search match, best first) through a named
+        server-side cursor, holding at most batch_size rows (up to MAX_EXPORT_BATCH_SIZE)
+        in memory. A database error is logged and re-raised, so a truncated stream is
+        never mistaken for a complete one.
+        """
+        query = (query or '').strip()
+        if query:
+            sql = f"{RANKED_SEARCH_SQL} ORDER BY search_rank DESC, id"
+            params = self._search_params(query)
+        else:
+            sql = "SELECT * FROM compounds ORDER BY id"
+            params = None
+        
+        streamed = 0
+        try:
+            with self.connection() as conn:
+                with conn.cursor(name='compounds_export', cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.itersize = max(1, min(batch_size, MAX_EXPORT_BATCH_SIZE))
+                    cur.execute(sql, params)
+                    for row in cur:
+                        streamed += 1
+                        yield dict(row)
+        except Exception as e:
+            logging.error(f"Compound streaming error after {streamed} rows: {e}")
+            raise
+        
+        logging.info(f"Streamed {streamed} compounds for query: {query or '*'}")
+    
+    @staticmethod
+    def encode_cursor(rank: Optional[float], compound_id: int) -> str:
+        """Opaque pagination cursor for the row (rank, id)"""
+        return base64.urlsafe_b64encode(json.dumps([rank, compound_id]).encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[Optional[float], int]:
+        """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+        try:
+            rank, compound_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return (float(rank) if rank is not None else None), int(compound_id)
+        except (TypeError, ValueError, UnicodeError) as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
+    
+    def _search_params(self, query: str) -> Dict:
+        return {
+            'query': query,
+            'upper': query.upper(),
+            'pattern': f"%{self._escape_like(query)}%"
+        }
+    
+    @staticmethod
+    def _escape_like(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    
+    def _search_exact(self, column: str, value: str, limit: int) -> List[Dict]:
+        """Exact-match lookup on an indexed column"""
+        sql = f"SELECT * FROM compounds WHERE {column} = %s ORDER BY id LIMIT %s"
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(sql, (value, limit))
+                    compounds = [dict(row) for row in cur.fetchall()]
+                    logging.info(f"Found {len(compounds)} compounds with {column} = {value}")
+                    return compounds
+        except Exception as e:
+            logging.error(f"Database exact search error for {column} = {value}: {e}")
+            return []
+    
+    def _search_compounds_ilike(self, query: str, limit: int = 20) -> List[Dict]:
+        """Unindexed substring search, used when pg_trgm is not available"""
         sql = """
         SELECT * FROM compounds 
         WHERE chembl_id ILIKE %s 
@@ -255,7 +817,7 @@ class DatabaseManager:
         search_term = f"%{query}%"
         
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                     cur.execute(sql, (search_term, search_term, search_term, search_term, limit))
                     results = cur.fetchall()
@@ -266,10 +828,71 @@ class DatabaseManager:
             logging.error(f"Database search error: {e}")
             return []
     
+    def get_analysis(self, compound_id: int, model: str, prompt_hash: str,
+                     analysis_type: str = 'ai_analysis') -> Optional[Dict]:
+        """Get the latest stored analysis of a compound for a model and prompt template"""
+        query = """
+        SELECT id, results, confidence_score, created_at
+        FROM analysis_results
+        WHERE compound_id = %s
+          AND analysis_type = %s
+          AND results->>'model' = %s
+          AND results->>'prompt_hash' = %s
+        ORDER BY created_at DESC
+        LIMIT 1
+        """
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(query, (compound_id, analysis_type, model, prompt_hash))
+                    result = cur.fetchone()
+                    return dict(result) if result else None
+        except Exception as e:
+            logging.error(f"Database analysis lookup error for compound {compound_id}: {e}")
+            return None
+    
+    def save_analysis(self, compound_id: int, model: str, prompt_hash: str, data_hash: str, analysis: str,
+                      analysis_type: str = 'ai_analysis', confidence_score: Optional[float] = None) -> Optional[int]:
+        """Store an analysis, replacing earlier ones for the same compound, model and prompt template"""
+        delete_query = """
+        DELETE FROM analysis_results
+        WHERE compound_id = %s
+          AND analysis_type = %s
+          AND results->>'model' = %s
+          AND results->>'prompt_hash' = %s
+        """
+        
+        insert_query = """
+        INSERT INTO analysis_results (compound_id, analysis_type, results, confidence_score)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id
+        """
+        
+        results = {
+            'model': model,
+            'prompt_hash': prompt_hash,
+            'data_hash': data_hash,
+            'analysis': analysis
+        }
+        
+        try:
+            with self.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(delete_query, (compound_id, analysis_type, model, prompt_hash))
+                    cur.execute(insert_query, (compound_id, analysis_type, psycopg2.extras.Json(results),
+                                               confidence_score))
+                    analysis_id = cur.fetchone()[0]
+                    logging.info(f"Stored {analysis_type} for compound {compound_id} with ID {analysis_id}")
+                    return analysis_id
+        except Exception as e:
+            logging.error(f"Database analysis insert error for compound {compound_id}: {e}")
+            return None
+    
     def get_compound_count(self) -> int:
         """Get total number of compounds in database"""
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT COUNT(*) FROM compounds")
                     count = cur.fetchone()[0]
@@ -291,6 +914,10 @@ class DatabaseManager:
             molecular_weight FLOAT,
             pref_name TEXT,
             bioactivities_count INTEGER DEFAULT 0,
+            inchi_key VARCHAR(27),
+            structure_refreshed_at TIMESTAMP,
+            cross_references_refreshed_at TIMESTAMP,
+            bioactivities_refreshed_at TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
@@ -311,13 +938,31 @@ class DatabaseManager:
         );
         """
         
+        analysis_results_table = """
+        CREATE TABLE IF NOT EXISTS analysis_results (
+            id SERIAL PRIMARY KEY,
+            compound_id INTEGER REFERENCES compounds(id),
+            analysis_type VARCHAR(50),
+            results JSONB,
+            confidence_score DECIMAL(4,3),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+        
+        analysis_lookup_index = """
+        CREATE INDEX IF NOT EXISTS idx_analysis_lookup
+        ON analysis_results (compound_id, analysis_type, (results->>'model'), (results->>'prompt_hash'));
+        """
+        
         try:
-            with self.get_connection() as conn:
+            with self.connection() as conn:
                 with conn.cursor() as cur:
                     cur.execute(compounds_table)
                     cur.execute(bioactivities_table)
+                    cur.execute(analysis_results_table)
+                    cur.execute(analysis_lookup_index)
                     logging.info("Tables created/verified successfully")
-                    return True
+            return self.migrate(build_indexes_in_background=False)
         except Exception as e:
             logging.error(f"Error creating tables: {e}")
             return False
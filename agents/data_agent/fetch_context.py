@@ -0,0 +1,127 @@
+# fetch_context.py
+import contextvars
+import copy
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+_current_context = contextvars.ContextVar('fetch_context', default=None)
+
+
+class FetchContext:
+    """
+    Request-scoped memo for upstream calls.
+
+    One context is opened per query; while it is active, the connectors and
+    DataAgent route their upstream calls through it so identical calls
+    (same endpoint and arguments) only hit the network once per query.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.upstream_calls = 0
+        self.calls_saved = 0
+        self._results: Dict[Hashable, Any] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._token = None
+        self.logger = logging.getLogger(__name__)
+
+    def __enter__(self) -> 'FetchContext':
+        self._token = _current_context.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_context.reset(self._token)
+        self._token = None
+        self.logger.info(f"Fetch context {self.name or ''} closed: {self.stats()}")
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Return (found, value) for a memoized call, counting a saved call on hit"""
+        with self._lock:
+            if key not in self._results:
+                return False, None
+            self.calls_saved += 1
+            return True, copy.deepcopy(self._results[key])
+
+    def store(self, key: Hashable, value: Any):
+        """Memoize a result that was fetched outside fetch(), e.g. as part of a bulk call"""
+        with self._lock:
+            self._results[key] = copy.deepcopy(value)
+
+    def record_call(self, count: int = 1):
+        """Count upstream calls made on behalf of this context outside fetch()"""
+        with self._lock:
+            self.upstream_calls += count
+
+    def fetch(self, key: Hashable, fetcher: Callable[[], Any]) -> Any:
+        """Return the memoized result for key, calling fetcher only on the first request"""
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Concurrent callers for the same key wait for the first fetch instead of duplicating it
+        with key_lock:
+            found, value = self.lookup(key)
+            if found:
+                return value
+
+            value = fetcher()
+            with self._lock:
+                self._results[key] = copy.deepcopy(value)
+                self.upstream_calls += 1
+            return value
+
+    def stats(self) -> Dict:
+        """Summary of how many upstream calls were made and saved"""
+        with self._lock:
+            return {
+                'upstream_calls': self.upstream_calls,
+                'calls_saved': self.calls_saved,
+                'memoized_keys': len(self._results)
+            }
+
+
+def current_fetch_context() -> Optional[FetchContext]:
+    """Get the fetch context of the current query, if any"""
+    return _current_context.get()
+
+
+def fetch_once(key: Hashable, fetcher: Callable[[], Any]) -> Any:
+    """Dedupe fetcher through the active fetch context, or just call it when there is none"""
+    context = _current_context.get()
+    if context is None:
+        return fetcher()
+    return context.fetch(key, fetcher)
+
+
+async def fetch_once_async(key: Hashable, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Async counterpart of fetch_once, sharing the memo of the active fetch context
+    
+    Concurrent coroutines asking for the same key are not merged; each result is
+    memoized once it arrives.
+    """
+    context = _current_context.get()
+    if context is None:
+        return await fetcher()
+    
+    found, value = context.lookup(key)
+    if found:
+        return value
+    value = await fetcher()
+    context.store(key, value)
+    context.record_call()
+    return value
+
+
+@contextmanager
+def fetch_scope(name: Optional[str] = None) -> Iterator[FetchContext]:
+    """Join the active fetch context, or open a new one for the duration of the block"""
+    context = _current_context.get()
+    if context is not None:
+        yield context
+        return
+
+    with FetchContext(name) as context:
+        yield context
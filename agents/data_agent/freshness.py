@@ -0,0 +1,88 @@
+# freshness.py
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+HOUR = 3600
+
+# Compound fields grouped by how quickly their upstream source changes
+FIELD_GROUPS = {
+    'structure': ['pref_name', 'smiles', 'molecular_formula', 'molecular_weight'],
+    'cross_references': ['pubchem_cid'],
+    'bioactivities': ['bioactivities_count'],
+}
+
+# Column recording when each field group was last refreshed from upstream
+REFRESHED_AT_COLUMNS = {group: f'{group}_refreshed_at' for group in FIELD_GROUPS}
+
+# Groups that can be refreshed on their own, without re-enriching the compound
+PARTIAL_REFRESH_GROUPS = ['bioactivities']
+
+# Default max age in hours per field group, overridable with FRESHNESS_<GROUP>_HOURS
+DEFAULT_MAX_AGE_HOURS = {
+    'structure': 24 * 30,
+    'cross_references': 24 * 7,
+    'bioactivities': 24,
+}
+
+
+def refreshed_groups(compound: Dict) -> List[str]:
+    """Field groups an enriched compound carries upstream values for; an empty group (failed lookup) was not refreshed"""
+    return [group for group, fields in FIELD_GROUPS.items()
+            if any(compound.get(field) is not None for field in fields)]
+
+
+class FreshnessPolicy:
+    """
+    Decides whether a stored compound row can be served without re-enriching it.
+
+    Each field group has its own max age, measured against that group's
+    <group>_refreshed_at timestamp (a group never refreshed is stale). A row is
+    fresh only when every group is within its max age and the structure fields
+    needed downstream are present. When only PARTIAL_REFRESH_GROUPS are stale,
+    the row needs just those refreshed, not a full re-enrichment.
+    """
+
+    def __init__(self, max_age_hours: Optional[Dict[str, float]] = None,
+                 required_fields: List[str] = ('smiles', 'molecular_formula')):
+        self.max_age_hours = dict(DEFAULT_MAX_AGE_HOURS)
+        self.max_age_hours.update(max_age_hours or {})
+        self.required_fields = list(required_fields)
+
+    @classmethod
+    def from_env(cls) -> 'FreshnessPolicy':
+        """Build the policy from FRESHNESS_<GROUP>_HOURS environment variables"""
+        max_age_hours = {}
+        for group in FIELD_GROUPS:
+            value = os.getenv(f'FRESHNESS_{group.upper()}_HOURS')
+            if value:
+                max_age_hours[group] = float(value)
+        return cls(max_age_hours)
+
+    def group_age_seconds(self, record: Dict, group: str) -> Optional[float]:
+        """Age of one field group of a stored record, preferring the database-computed <group>_age_seconds"""
+        if record.get(f'{group}_age_seconds') is not None:
+            return float(record[f'{group}_age_seconds'])
+        refreshed_at = record.get(REFRESHED_AT_COLUMNS[group])
+        if isinstance(refreshed_at, datetime):
+            return (datetime.now(refreshed_at.tzinfo) - refreshed_at).total_seconds()
+        return None
+
+    def stale_groups(self, record: Dict) -> List[str]:
+        """Field groups of a stored record that need refreshing"""
+        stale = []
+        for group in FIELD_GROUPS:
+            age = self.group_age_seconds(record, group)
+            if age is None or age > self.max_age_hours[group] * HOUR:
+                stale.append(group)
+        if 'structure' not in stale and any(not record.get(field) for field in self.required_fields):
+            stale.insert(0, 'structure')
+        return stale
+
+    def is_fresh(self, record: Optional[Dict]) -> bool:
+        """True when a stored record can be served as is"""
+        return bool(record) and not self.stale_groups(record)
+
+    def needs_enrichment(self, record: Optional[Dict]) -> bool:
+        """True when a stored record has to be fully re-enriched, not just partially refreshed"""
+        return not record or any(group not in PARTIAL_REFRESH_GROUPS for group in self.stale_groups(record))
@@ -0,0 +1,310 @@
+# http_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from negative_cache import NEGATIVE_CACHE_TTL_SECONDS
+from rate_limiter import RateLimitedAdapter, TokenBucket
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# TTL per endpoint class, first match wins. A TTL of 0 disables caching.
+DEFAULT_TTL_RULES = [
+    (r'/listkey/', 0),                          # PubChem async job polling
+    (r'/chembl/api/data/molecule/search', DAY),
+    (r'/chembl/api/data/activity', DAY),
+    (r'/chembl/api/data/molecule', 7 * DAY),
+    # Identifier lookups answer misses with a 200 too (CID 0, missing InChIKeys),
+    # so they are kept no longer than the negative cache remembers a miss
+    (r'/rest/pug/compound/(smiles|inchikey|inchi|name|formula)/', int(NEGATIVE_CACHE_TTL_SECONDS)),
+    (r'/rest/pug/compound/.*/property/', 7 * DAY),
+    (r'/rest/pug/compound/', 7 * DAY),
+]
+DEFAULT_TTL = DAY
+
+# Headers that describe the raw transfer rather than the (already decoded) body
+HOP_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of upstream HTTP responses.
+
+    Entries are keyed on method + normalized URL (sorted query params) + body,
+    expire after a TTL chosen per endpoint class, are revalidated with
+    ETag/Last-Modified when stale, and are evicted least-recently-used once the
+    cache grows past max_bytes. The total size is kept in the single-row
+    cache_meta table, updated in the same transaction as every write, so a
+    write never has to scan the table.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl_rules=None,
+                 default_ttl: int = DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_rules = [(re.compile(pattern), ttl) for pattern, ttl in (ttl_rules or DEFAULT_TTL_RULES)]
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT,
+                    status INTEGER,
+                    headers TEXT,
+                    body BLOB,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL,
+                    last_access REAL,
+                    size INTEGER
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_meta (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    total_size INTEGER NOT NULL
+                )
+            """)
+            # Caches created before cache_meta existed are measured once
+            self._conn.execute(
+                "INSERT OR IGNORE INTO cache_meta (id, total_size) "
+                "SELECT 1, COALESCE(SUM(size), 0) FROM responses"
+            )
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Lower-case scheme/host and sort query parameters so equivalent URLs share a key"""
+        parts = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+    def make_key(self, method: str, url: str, body=None) -> str:
+        """Cache key for a request"""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha256()
+        digest.update(method.upper().encode('utf-8'))
+        digest.update(self.normalize_url(url).encode('utf-8'))
+        digest.update(body or b'')
+        return digest.hexdigest()
+
+    def ttl_for(self, url: str) -> int:
+        """TTL in seconds for the endpoint class of url"""
+        path = urlsplit(url).path
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Get a cached entry (fresh or stale) and mark it as recently used"""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT status, headers, body, etag, last_modified, expires_at FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if not row:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        status, headers, body, etag, last_modified, expires_at = row
+        return {
+            'status': status,
+            'headers': json.loads(headers),
+            'body': body,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expires_at': expires_at
+        }
+
+    def set(self, key: str, url: str, response: Response, ttl: int):
+        """Store a response for ttl seconds"""
+        self.set_raw(key, url, response.status_code, response.headers, response.content, ttl)
+
+    def set_raw(self, key: str, url: str, status: int, headers, body: Optional[bytes], ttl: int):
+        """Store a response given as status, headers and decoded body (e.g. from aiohttp)"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        headers = {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS}
+        body = body or b''
+        now = time.time()
+        with self._lock, self._conn:
+            previous = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, url, status, headers, body, etag, last_modified, expires_at, last_access, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, status, json.dumps(headers), body, etag, last_modified,
+                 now + ttl, now, len(body))
+            )
+            total = self._add_to_total(len(body) - (previous[0] if previous else 0))
+        if total > self.max_bytes:
+            self._evict()
+
+    def refresh(self, key: str, ttl: int):
+        """Extend a stale entry after the server confirmed it is unchanged (304)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                (now + ttl, now, key)
+            )
+
+    def _add_to_total(self, delta: int) -> int:
+        """Adjust the running total size within the caller's transaction and return it"""
+        if delta:
+            self._conn.execute("UPDATE cache_meta SET total_size = total_size + ? WHERE id = 1", (delta,))
+        return self._conn.execute("SELECT total_size FROM cache_meta WHERE id = 1").fetchone()[0]
+
+    def _evict(self):
+        """Drop least-recently-used entries until the cache is back under 90% of max_bytes"""
+        with self._lock, self._conn:
+            total = self._add_to_total(0)
+            if total <= self.max_bytes:
+                return
+
+            target = int(self.max_bytes * 0.9)
+            evicted = 0
+            for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+                if total <= target:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+            self._conn.execute("UPDATE cache_meta SET total_size = ? WHERE id = 1", (total,))
+        self.logger.info(f"HTTP cache evicted {evicted} least-recently-used entries")
+
+    def record(self, outcome: str):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> Dict:
+        """Cache usage counters"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self._add_to_total(0)
+            return {
+                'path': self.path,
+                'entries': entries,
+                'size_bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated
+            }
+
+
+class CachingAdapter(RateLimitedAdapter):
+    """
+    Transport adapter that answers from the ResponseCache when it can and only
+    goes through the rate limiter for real network requests.
+    """
+
+    def __init__(self, cache: ResponseCache, rate_limiter: TokenBucket,
+                 cacheable_methods: Tuple[str, ...] = ('GET',), **kwargs):
+        super().__init__(rate_limiter, **kwargs)
+        self.cache = cache
+        self.cacheable_methods = cacheable_methods
+
+    def send(self, request, **kwargs):
+        ttl = self.cache.ttl_for(request.url)
+        if request.method not in self.cacheable_methods or not ttl or kwargs.get('stream'):
+            return super().send(request, **kwargs)
+
+        key = self.cache.make_key(request.method, request.url, request.body)
+        entry = self.cache.get(key)
+
+        if entry and entry['expires_at'] > time.time():
+            self.cache.record('hits')
+            return self._build_response(request, entry)
+
+        # Stale entry: ask the server whether it changed instead of downloading it again
+        if entry and (entry['etag'] or entry['last_modified']):
+            request = request.copy()
+            if entry['etag']:
+                request.headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry:
+            self.cache.refresh(key, ttl)
+            self.cache.record('revalidated')
+            return self._build_response(request, entry)
+
+        self.cache.record('misses')
+        if response.status_code == 200:
+            try:
+                self.cache.set(key, request.url, response, ttl)
+            except sqlite3.Error as e:
+                self.cache.logger.error(f"HTTP cache write error for {request.url}: {e}")
+        return response
+
+    def _build_response(self, request, entry: Dict) -> Response:
+        response = Response()
+        response.status_code = entry['status']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return response
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None if it is disabled or unavailable"""
+    global _response_cache
+    if os.getenv('HTTP_CACHE_ENABLED', 'true').lower() in ('0', 'false', 'no'):
+        return None
+
+    with _response_cache_lock:
+        if _response_cache is None:
+            default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.http_cache', 'responses.sqlite')
+            path = os.getenv('HTTP_CACHE_PATH', default_path)
+            max_bytes = int(os.getenv('HTTP_CACHE_MAX_MB', '256')) * 1024 * 1024
+            try:
+                _response_cache = ResponseCache(path, max_bytes=max_bytes)
+            except (sqlite3.Error, OSError) as e:
+                logging.getLogger(__name__).error(f"HTTP cache unavailable at {path}: {e}")
+                return None
+        return _response_cache
+
+
+def make_adapter(rate_limiter: TokenBucket, cacheable_methods: Tuple[str, ...] = ('GET',)) -> RateLimitedAdapter:
+    """Rate-limited transport adapter, with the response cache in front of it when enabled"""
+    cache = get_response_cache()
+    if cache is None:
+        return RateLimitedAdapter(rate_limiter)
+    return CachingAdapter(cache, rate_limiter, cacheable_methods=cacheable_methods)
@@ -0,0 +1,94 @@
+# negative_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable
+
+# How long a miss is remembered; also the upper bound for cached responses of
+# the PubChem lookup endpoints that can answer with a miss (see http_cache.py)
+NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv('NEGATIVE_CACHE_TTL_SECONDS', str(6 * 3600)))
+
+class NegativeCache:
+    """
+    In-memory record of lookups that are known to have no result upstream.
+
+    Entries are keyed on (strategy, input), e.g. ('pubchem_name', 'foo'), and
+    expire after ttl seconds so new upstream records are picked up. The HTTP
+    response cache keeps lookup responses no longer than this, so a cached
+    200 carrying a miss cannot outlive the negative entry. The cache holds at most max_entries,
+    dropping the least recently used, and counts every upstream call it avoided.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.stores = 0
+        self._entries: 'OrderedDict[tuple, float]' = OrderedDict()
+        self._avoided_by_strategy: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def is_miss(self, strategy: str, value: Hashable) -> bool:
+        """True when value is a known miss for strategy; counts the avoided upstream call"""
+        if self.ttl <= 0:
+            return False
+
+        key = (strategy, value)
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._avoided_by_strategy[strategy] = self._avoided_by_strategy.get(strategy, 0) + 1
+            return True
+
+    def add(self, strategy: str, value: Hashable):
+        """Remember that value has no result for strategy"""
+        if self.ttl <= 0:
+            return
+
+        key = (strategy, value)
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, strategy: str, value: Hashable):
+        """Forget a miss, e.g. after the value was found by another route"""
+        with self._lock:
+            self._entries.pop((strategy, value), None)
+
+    def stats(self) -> Dict:
+        """Size and the number of upstream calls avoided, overall and per strategy"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'stored_misses': self.stores,
+                'calls_avoided': self.hits,
+                'calls_avoided_by_strategy': dict(self._avoided_by_strategy)
+            }
+
+
+_negative_cache = None
+_negative_cache_lock = threading.Lock()
+
+
+def get_negative_cache() -> NegativeCache:
+    """Get the process-wide negative cache (NEGATIVE_CACHE_TTL_SECONDS=0 disables it)"""
+    global _negative_cache
+    with _negative_cache_lock:
+        if _negative_cache is None:
+            _negative_cache = NegativeCache(
+                ttl=NEGATIVE_CACHE_TTL_SECONDS,
+                max_entries=int(os.getenv('NEGATIVE_CACHE_MAX_ENTRIES', '10000'))
+            )
+        return _negative_cache
@@ -0,0 +1,166 @@
+# ollama_client.py
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+NANOSECONDS_PER_MS = 1_000_000
+
+# A generation whose load_duration exceeds this had to (re)load the model into memory
+COLD_LOAD_THRESHOLD_MS = 500
+
+
+class OllamaClient:
+    """
+    Ollama HTTP client with a pooled keep-alive session.
+
+    Every generation asks Ollama to keep the model loaded for keep_alive
+    (OLLAMA_KEEP_ALIVE), warmup() loads the model ahead of the first real
+    request, and per-call latency and model load times are recorded in metrics().
+    """
+
+    def __init__(self, host: str, keep_alive: Optional[str] = None, pool_size: Optional[int] = None,
+                 timeout: float = 30):
+        self.host = host.rstrip('/')
+        self.keep_alive = keep_alive or os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+        # One connection per concurrent generation, plus room for status calls
+        pool_size = pool_size or int(os.getenv('OLLAMA_NUM_PARALLEL', '4')) + 2
+        self.session = requests.Session()
+        self.session.mount(self.host, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self._lock = threading.Lock()
+        self._metrics = {
+            'requests': 0,
+            'errors': 0,
+            'total_latency_ms': 0.0,
+            'last_latency_ms': None,
+            'last_time_to_first_token_ms': None,
+            'cold_loads': 0,
+            'last_load_ms': None,
+            'total_load_ms': 0.0,
+            'warmup': None
+        }
+
+    def list_models(self) -> List[str]:
+        """Names of the models available on the server (/api/tags)"""
+        response = self.session.get(f"{self.host}/api/tags", timeout=5)
+        response.raise_for_status()
+        return [model['name'] for model in response.json().get('models', [])]
+
+    def show(self, model: str) -> Dict:
+        """Model metadata (/api/show)"""
+        response = self.session.post(f"{self.host}/api/show", json={"name": model}, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    def generate(self, payload: Dict, timeout: Optional[float] = None) -> Dict:
+        """Run a non-streaming /api/generate request and return Ollama's response body"""
+        payload = dict(payload, stream=False)
+        payload.setdefault('keep_alive', self.keep_alive)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.post(f"{self.host}/api/generate", json=payload, timeout=timeout or self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        except Exception:
+            self._record_error()
+            raise
+
+        self._record_generation(result, time.perf_counter() - started)
+        return result
+
+    def generate_stream(self, payload: Dict, timeout: Optional[float] = None) -> Iterator[Dict]:
+        """Run a streaming /api/generate request, yielding each chunk as Ollama produces it"""
+        payload = dict(payload, stream=True)
+        payload.setdefault('keep_alive', self.keep_alive)
+
+        started = time.perf_counter()
+        first_token_at = None
+        try:
+            with self.session.post(f"{self.host}/api/generate", json=payload, stream=True,
+                                   timeout=timeout or self.timeout) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(chunk['error'])
+                    if first_token_at is None and chunk.get('response'):
+                        first_token_at = time.perf_counter()
+                    yield chunk
+                    if chunk.get('done'):
+                        self._record_generation(chunk, time.perf_counter() - started,
+                                                first_token_at - started if first_token_at else None)
+                        return
+        except Exception:
+            self._record_error()
+            raise
+
+    def warmup(self, model: str) -> Dict:
+        """Load model into memory with an empty prompt, so the first real request does not pay for it"""
+        started = time.perf_counter()
+        try:
+            result = self.generate({"model": model, "prompt": ""}, timeout=max(self.timeout, 120))
+        except Exception as e:
+            self.logger.warning(f"Ollama warmup of {model} failed: {e}")
+            return {'model': model, 'success': False, 'error': str(e)}
+
+        warmup = {
+            'model': model,
+            'success': True,
+            'load_ms': round(result.get('load_duration', 0) / NANOSECONDS_PER_MS, 1),
+            'latency_ms': round((time.perf_counter() - started) * 1000, 1),
+            'at': time.time()
+        }
+        with self._lock:
+            self._metrics['warmup'] = warmup
+        self.logger.info(f"Ollama model {model} warmed up in {warmup['latency_ms']} ms (load {warmup['load_ms']} ms)")
+        return warmup
+
+    def warmup_in_background(self, model: str) -> threading.Thread:
+        """Run warmup() on a daemon thread so startup is not blocked by the model load"""
+        thread = threading.Thread(target=self.warmup, args=(model,), name='ollama-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def _record_generation(self, result: Dict, latency: float, time_to_first_token: Optional[float] = None):
+        load_ms = result.get('load_duration', 0) / NANOSECONDS_PER_MS
+        latency_ms = latency * 1000
+        with self._lock:
+            self._metrics['requests'] += 1
+            self._metrics['total_latency_ms'] += latency_ms
+            self._metrics['last_latency_ms'] = round(latency_ms, 1)
+            if time_to_first_token is not None:
+                self._metrics['last_time_to_first_token_ms'] = round(time_to_first_token * 1000, 1)
+            if load_ms > COLD_LOAD_THRESHOLD_MS:
+                self._metrics['cold_loads'] += 1
+                self._metrics['last_load_ms'] = round(load_ms, 1)
+                self._metrics['total_load_ms'] += load_ms
+        if load_ms > COLD_LOAD_THRESHOLD_MS:
+            self.logger.warning(f"Ollama had to load the model for this request ({load_ms:.0f} ms)")
+
+    def _record_error(self):
+        with self._lock:
+            self._metrics['requests'] += 1
+            self._metrics['errors'] += 1
+
+    def metrics(self) -> Dict:
+        """Request counts, latency and model load statistics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        successful = metrics['requests'] - metrics['errors']
+        metrics['avg_latency_ms'] = round(metrics['total_latency_ms'] / successful, 1) if successful else None
+        metrics['total_latency_ms'] = round(metrics['total_latency_ms'], 1)
+        metrics['total_load_ms'] = round(metrics['total_load_ms'], 1)
+        metrics['keep_alive'] = self.keep_alive
+        return metrics
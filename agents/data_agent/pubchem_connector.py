@@ -1,14 +1,30 @@
 # pubchem_connector.py (ENHANCED VERSION)
 import requests
-import time
 import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Dict, List, Optional
+from urllib.parse import quote
+from rate_limiter import get_rate_limiter
+from http_cache import make_adapter
+from fetch_context import current_fetch_context, fetch_once
+from negative_cache import get_negative_cache
+
+# Markers returned by resolve_cids for identifiers that have no CID
+CID_MISS = 'not_found'  # PubChem has no compound for the identifier
+CID_ERROR = 'error'     # The lookup failed; the identifier may still exist
+
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
 
 class PubChemConnector:
     """
     PubChem API connector for molecular data enrichment - ENHANCED VERSION
     """
     
+    PROPERTIES = ['MolecularFormula', 'MolecularWeight', 'CanonicalSMILES', 'IUPACName', 'InChI', 'InChIKey']
+    
     def __init__(self, base_url: str = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"):
         self.base_url = base_url
         self.session = requests.Session()
@@ -16,7 +32,24 @@ class PubChemConnector:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
-        self.delay = 0.2  # PubChem has rate limits
+        # Repeat requests are answered from the on-disk response cache; the rest
+        # wait on a token bucket shared by every client of this host
+        self.rate_limiter = get_rate_limiter(base_url)
+        self.session.mount(base_url, make_adapter(self.rate_limiter, cacheable_methods=('GET', 'POST')))
+        self.property_batch_size = 100  # CIDs per property POST (stays well under PUG REST request limits)
+        # Names, SMILES and InChIKeys PubChem recently had no match for
+        self.negative_cache = get_negative_cache()
+        
+        # Formula searches are asynchronous on PubChem's side (ListKey); they are
+        # polled on this pool, and concurrent searches for one formula share a future
+        self.listkey_deadline = float(os.getenv('PUBCHEM_LISTKEY_DEADLINE', '60'))
+        self.listkey_initial_delay = 0.5
+        self.listkey_max_delay = 8.0
+        self._listkey_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PUBCHEM_LISTKEY_WORKERS', '2')),
+                                                    thread_name_prefix='pubchem-listkey')
+        self._formula_searches: Dict[str, Future] = {}
+        self._formula_searches_lock = threading.Lock()
+        self._closed = threading.Event()
         self.logger = logging.getLogger(__name__)
         
     def search_by_name(self, compound_name: str) -> Optional[Dict]:
@@ -51,60 +84,238 @@ class PubChemConnector:
             self.logger.error(f"PubChem SMILES search error: {e}")
             return None
     
-    def _get_cid_from_name(self, compound_name: str) -> Optional[str]:
-        """Get CID from compound name"""
-        url = f"{self.base_url}/compound/name/{compound_name}/cids/JSON"
+    def get_compound_by_cid(self, cid: str) -> Optional[Dict]:
+        """Get compound properties for a known CID"""
+        try:
+            return self._get_compound_properties(str(cid))
+        except Exception as e:
+            self.logger.error(f"PubChem CID lookup error for {cid}: {e}")
+            return None
+    
+    def search_by_inchi(self, inchi: str) -> Optional[Dict]:
+        """Search compound by InChI and return properties"""
+        try:
+            cid = self._get_cid_from_inchi(inchi)
+            if not cid:
+                self.logger.warning(f"Could not find CID for InChI: {inchi}")
+                return None
+            
+            return self._get_compound_properties(cid)
+            
+        except Exception as e:
+            self.logger.error(f"PubChem InChI search error: {e}")
+            return None
+    
+    def search_by_formula(self, formula: str, timeout: Optional[float] = None,
+                          inchi_key: Optional[str] = None) -> Optional[Dict]:
+        """
+        Search compound by molecular formula and return properties of the matching compound
+        
+        A formula is shared by every isomer, so a hit is only accepted when it is
+        certain: with inchi_key, the candidate whose InChIKey equals it (among the
+        first property_batch_size CIDs); without, only a formula with a single CID.
         
+        The search itself runs in the background (see search_by_formula_async); this
+        waits at most timeout seconds for it and returns None when it is not done yet,
+        leaving the search running so a later call can pick up the result.
+        """
         try:
-            time.sleep(self.delay)
+            cids = self.search_by_formula_async(formula).result(timeout=timeout)
+        except FutureTimeoutError:
+            self.logger.info(f"PubChem formula search for {formula} still running after {timeout}s")
+            return None
+        except Exception as e:
+            self.logger.error(f"PubChem formula search error for {formula}: {e}")
+            return None
+        
+        if not cids:
+            self.logger.warning(f"Could not find CID for formula: {formula}")
+            return None
+        
+        if not inchi_key:
+            if len(cids) > 1:
+                self.logger.info(f"Formula {formula} matches {len(cids)} PubChem compounds, ignoring ambiguous hit")
+                return None
+            return self._get_compound_properties(cids[0])
+        
+        candidates = self.get_properties_batch(cids[:self.property_batch_size])
+        for cid in cids[:self.property_batch_size]:
+            compound_data = candidates.get(cid)
+            if compound_data and (compound_data.get('InChIKey') or '').upper() == inchi_key.upper():
+                return compound_data
+        self.logger.info(f"No PubChem compound with formula {formula} has InChIKey {inchi_key}")
+        return None
+    
+    def search_by_formula_async(self, formula: str) -> Future:
+        """Start (or join) a background formula search; the future resolves to the list of CIDs or None"""
+        with self._formula_searches_lock:
+            future = self._formula_searches.get(formula)
+            if future is not None:
+                return future
+            
+            if self.negative_cache.is_miss('pubchem_formula', formula):
+                future = Future()
+                future.set_result(None)
+                return future
+            
+            future = self._listkey_executor.submit(self._search_formula_cids, formula)
+            self._formula_searches[formula] = future
+        
+        future.add_done_callback(lambda _: self._forget_formula_search(formula))
+        return future
+    
+    def _forget_formula_search(self, formula: str):
+        with self._formula_searches_lock:
+            self._formula_searches.pop(formula, None)
+    
+    def _search_formula_cids(self, formula: str) -> Optional[List[str]]:
+        """Submit a formula search and poll its ListKey until PubChem returns the CIDs"""
+        url = f"{self.base_url}/compound/formula/{quote(formula, safe='')}/cids/JSON"
+        response = self.session.get(url)
+        if response.status_code == 404:
+            self.negative_cache.add('pubchem_formula', formula)
+            return None
+        response.raise_for_status()
+        data = response.json()
+        
+        list_key = data.get('Waiting', {}).get('ListKey')
+        if list_key:
+            data = self._poll_list_key(list_key, f"{self.base_url}/compound/listkey/{list_key}/cids/JSON")
+        
+        cids = [str(cid) for cid in data.get('IdentifierList', {}).get('CID', []) if cid]
+        if cids:
+            return cids
+        self.negative_cache.add('pubchem_formula', formula)
+        return None
+    
+    def _poll_list_key(self, list_key: str, url: str) -> Dict:
+        """
+        Poll an asynchronous PubChem result with exponential backoff
+        
+        Raises TimeoutError once listkey_deadline seconds have passed without a result.
+        """
+        deadline = time.monotonic() + self.listkey_deadline
+        delay = self.listkey_initial_delay
+        
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"PubChem ListKey {list_key} not ready after {self.listkey_deadline}s")
+            if self._closed.wait(min(delay, remaining)):
+                raise RuntimeError("PubChem connector closed")
+            delay = min(delay * 2, self.listkey_max_delay)
+            
             response = self.session.get(url)
+            if response.status_code == 404:
+                return {}
+            response.raise_for_status()
+            data = response.json()
+            if 'Waiting' not in data:
+                return data
+            self.logger.debug(f"PubChem ListKey {list_key} still running, next poll in {delay}s")
+    
+    def close(self):
+        """Stop polling background formula searches"""
+        self._closed.set()
+        self._listkey_executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _get_cid_from_inchi(self, inchi: str) -> Optional[str]:
+        """Get CID from InChI"""
+        if self.negative_cache.is_miss('pubchem_inchi', inchi):
+            return None
+        return fetch_once(('pubchem', 'inchi', inchi), lambda: self._fetch_cid_from_inchi(inchi))
+    
+    def _fetch_cid_from_inchi(self, inchi: str) -> Optional[str]:
+        url = f"{self.base_url}/compound/inchi/cids/JSON"
+        
+        try:
+            # InChI strings contain '/', so they have to go in the body
+            response = self.session.post(url, data={'inchi': inchi}, headers=FORM_HEADERS)
+            if response.status_code == 404:
+                self.negative_cache.add('pubchem_inchi', inchi)
+                return None
             response.raise_for_status()
             data = response.json()
             
-            cids = data.get('IdentifierList', {}).get('CID', [])
+            cids = [cid for cid in data.get('IdentifierList', {}).get('CID', []) if cid]
             if cids:
-                return str(cids[0])  # Return first CID
+                return str(cids[0])
+            self.negative_cache.add('pubchem_inchi', inchi)
             return None
             
         except Exception as e:
-            self.logger.error(f"Error getting CID from name {compound_name}: {e}")
+            self.logger.error(f"Error getting CID from InChI: {e}")
             return None
     
-    def _get_cid_from_smiles(self, smiles: str) -> Optional[str]:
-        """Get CID from SMILES"""
-        url = f"{self.base_url}/compound/smiles/{smiles}/cids/JSON"
+    def _get_cid_from_name(self, compound_name: str) -> Optional[str]:
+        """Get CID from compound name"""
+        if self.negative_cache.is_miss('pubchem_name', compound_name):
+            return None
+        return fetch_once(('pubchem', 'name', compound_name), lambda: self._fetch_cid_from_name(compound_name))
+    
+    def _fetch_cid_from_name(self, compound_name: str) -> Optional[str]:
+        url = f"{self.base_url}/compound/name/{compound_name}/cids/JSON"
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(url)
+            if response.status_code == 404:
+                self.logger.info(f"PubChem has no compound named {compound_name}")
+                self.negative_cache.add('pubchem_name', compound_name)
+                return None
             response.raise_for_status()
             data = response.json()
             
             cids = data.get('IdentifierList', {}).get('CID', [])
             if cids:
                 return str(cids[0])  # Return first CID
+            self.negative_cache.add('pubchem_name', compound_name)
             return None
             
+        except Exception as e:
+            self.logger.error(f"Error getting CID from name {compound_name}: {e}")
+            return None
+    
+    def _get_cid_from_smiles(self, smiles: str) -> Optional[str]:
+        """Get CID from SMILES"""
+        if self.negative_cache.is_miss('pubchem_smiles', smiles):
+            return None
+        return fetch_once(('pubchem', 'smiles', smiles), lambda: self._fetch_cid_from_smiles(smiles))
+    
+    def _fetch_cid_from_smiles(self, smiles: str) -> Optional[str]:
+        try:
+            return self._lookup_cid_by_smiles(smiles)
         except Exception as e:
             self.logger.error(f"Error getting CID from SMILES: {e}")
             return None
     
+    def _lookup_cid_by_smiles(self, smiles: str) -> Optional[str]:
+        """CID for a SMILES, None when PubChem has no match; raises on request errors"""
+        url = f"{self.base_url}/compound/smiles/cids/JSON"
+        
+        # SMILES go in the body: '/', '#' and '+' are not safe in the URL path
+        response = self.session.post(url, data={'smiles': smiles}, headers=FORM_HEADERS)
+        if response.status_code == 404:
+            self.negative_cache.add('pubchem_smiles', smiles)
+            return None
+        response.raise_for_status()
+        data = response.json()
+        
+        # PubChem reports a valid but unknown structure as CID 0
+        cids = [cid for cid in data.get('IdentifierList', {}).get('CID', []) if cid]
+        if cids:
+            return str(cids[0])  # Return first CID
+        self.negative_cache.add('pubchem_smiles', smiles)
+        return None
+    
     def _get_compound_properties(self, cid: str) -> Optional[Dict]:
         """Get compound properties by CID"""
-        properties = [
-            'MolecularFormula',
-            'MolecularWeight',
-            'CanonicalSMILES',
-            'IUPACName',
-            'InChI',
-            'InChIKey'
-        ]
-        
-        properties_str = ','.join(properties)
+        return fetch_once(('pubchem', 'properties', str(cid)), lambda: self._fetch_compound_properties(cid))
+    
+    def _fetch_compound_properties(self, cid: str) -> Optional[Dict]:
+        properties_str = ','.join(self.PROPERTIES)
         url = f"{self.base_url}/compound/cid/{cid}/property/{properties_str}/JSON"
         
         try:
-            time.sleep(self.delay)
             response = self.session.get(url)
             response.raise_for_status()
             data = response.json()
@@ -121,6 +332,122 @@ class PubChemConnector:
         except Exception as e:
             self.logger.error(f"Error getting properties for CID {cid}: {e}")
             return None
+    
+    def get_properties_batch(self, cids: List[str]) -> Dict[str, Dict]:
+        """Get compound properties for many CIDs with one POST per chunk, keyed by CID"""
+        unique_cids = list(dict.fromkeys(str(cid) for cid in cids if cid))
+        if not unique_cids:
+            return {}
+        
+        # Serve CIDs already resolved earlier in this query from the fetch context
+        properties = {}
+        fetch_context = current_fetch_context()
+        if fetch_context:
+            for cid in unique_cids:
+                found, compound_data = fetch_context.lookup(('pubchem', 'properties', cid))
+                if found and compound_data:
+                    properties[cid] = compound_data
+        
+        cids_to_fetch = [cid for cid in unique_cids if cid not in properties]
+        url = f"{self.base_url}/compound/cid/property/{','.join(self.PROPERTIES)}/JSON"
+        
+        for start in range(0, len(cids_to_fetch), self.property_batch_size):
+            chunk = cids_to_fetch[start:start + self.property_batch_size]
+            try:
+                # CIDs go in the form body, so the URL stays short however large the chunk
+                response = self.session.post(url, data={'cid': ','.join(chunk)}, headers=FORM_HEADERS)
+                response.raise_for_status()
+                data = response.json()
+                if fetch_context:
+                    fetch_context.record_call()
+                
+                for compound_data in data.get('PropertyTable', {}).get('Properties', []):
+                    cid = str(compound_data.get('CID', ''))
+                    if cid in chunk:
+                        compound_data['CID'] = cid
+                        properties[cid] = compound_data
+                        if fetch_context:
+                            fetch_context.store(('pubchem', 'properties', cid), compound_data)
+            except Exception as e:
+                self.logger.error(f"PubChem batch property error for {len(chunk)} CIDs: {e}")
+        
+        self.logger.info(f"PubChem batch properties resolved {len(properties)}/{len(unique_cids)} CIDs")
+        return {cid: properties[cid] for cid in unique_cids if cid in properties}
+    
+    def resolve_cids(self, identifiers: List[str], namespace: str = 'inchikey') -> Dict[str, str]:
+        """
+        Map InChIKeys or SMILES to PubChem CIDs
+        
+        InChIKeys are resolved property_batch_size at a time in one POST; PubChem
+        takes a single SMILES per request, so SMILES are POSTed one by one. Every
+        input is in the result: its CID, CID_MISS when PubChem has no match, or
+        CID_ERROR when the lookup failed.
+        """
+        if namespace not in ('inchikey', 'smiles'):
+            raise ValueError(f"Unsupported identifier namespace: {namespace}")
+        
+        unique_ids = list(dict.fromkeys(identifier for identifier in identifiers if identifier))
+        if not unique_ids:
+            return {}
+        
+        if namespace == 'smiles':
+            resolved = {}
+            for smiles in unique_ids:
+                if self.negative_cache.is_miss('pubchem_smiles', smiles):
+                    resolved[smiles] = CID_MISS
+                    continue
+                try:
+                    cid = fetch_once(('pubchem', 'smiles', smiles), lambda: self._lookup_cid_by_smiles(smiles))
+                    resolved[smiles] = cid or CID_MISS
+                except Exception as e:
+                    self.logger.error(f"Error resolving SMILES {smiles} to a CID: {e}")
+                    resolved[smiles] = CID_ERROR
+            return resolved
+        
+        resolved = {inchi_key: CID_MISS for inchi_key in unique_ids
+                    if self.negative_cache.is_miss('pubchem_inchikey', inchi_key)}
+        fetch_context = current_fetch_context()
+        if fetch_context:
+            for inchi_key in unique_ids:
+                if inchi_key in resolved:
+                    continue
+                found, cid = fetch_context.lookup(('pubchem', 'inchikey', inchi_key))
+                if found:
+                    resolved[inchi_key] = cid
+        
+        keys_to_fetch = [inchi_key for inchi_key in unique_ids if inchi_key not in resolved]
+        url = f"{self.base_url}/compound/inchikey/property/InChIKey/JSON"
+        
+        for start in range(0, len(keys_to_fetch), self.property_batch_size):
+            chunk = keys_to_fetch[start:start + self.property_batch_size]
+            try:
+                response = self.session.post(url, data={'inchikey': ','.join(chunk)}, headers=FORM_HEADERS)
+                if fetch_context:
+                    fetch_context.record_call()
+                if response.status_code == 404:
+                    # PubChem answers 404 when none of the keys match
+                    chunk_cids = {}
+                else:
+                    response.raise_for_status()
+                    chunk_cids = {}
+                    for record in response.json().get('PropertyTable', {}).get('Properties', []):
+                        # An InChIKey can match several CIDs; keep the first (lowest) one
+                        chunk_cids.setdefault(record.get('InChIKey'), str(record.get('CID')))
+                
+                for inchi_key in chunk:
+                    resolved[inchi_key] = chunk_cids.get(inchi_key, CID_MISS)
+                    if resolved[inchi_key] == CID_MISS:
+                        self.negative_cache.add('pubchem_inchikey', inchi_key)
+                    if fetch_context:
+                        fetch_context.store(('pubchem', 'inchikey', inchi_key), resolved[inchi_key])
+            except Exception as e:
+                self.logger.error(f"PubChem InChIKey resolution error for {len(chunk)} keys: {e}")
+                for inchi_key in chunk:
+                    resolved[inchi_key] = CID_ERROR
+        
+        found = sum(1 for cid in resolved.values() if cid not in (CID_MISS, CID_ERROR))
+        self.logger.info(f"PubChem resolved {found}/{len(unique_ids)} InChIKeys to CIDs")
+        return {inchi_key: resolved[inchi_key] for inchi_key in unique_ids}
 
 # Test the connector directly
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+# rate_limiter.py
+import asyncio
+import logging
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+# Requests per second and burst size per upstream host.
+# PubChem allows 5 requests/s; EBI does not publish a hard limit for ChEMBL.
+HOST_LIMITS = {
+    'pubchem.ncbi.nlm.nih.gov': (5.0, 5),
+    'www.ebi.ac.uk': (10.0, 20),
+}
+DEFAULT_LIMIT = (5.0, 5)
+
+# PubChem reports load as e.g. "Request Count status: Green (0%), Request Time status: Yellow (60%), ..."
+THROTTLING_STATUS = re.compile(r'status:\s*(Green|Yellow|Red|Black)', re.IGNORECASE)
+THROTTLING_RATE_FACTORS = {'green': 1.0, 'yellow': 0.5, 'red': 0.25, 'black': 0.0}
+
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for one upstream host.
+
+    Safe to share between threads and asyncio tasks: a caller reserves a token
+    under a short lock and then sleeps (or awaits) outside of it. The rate
+    backs off on throttling signals and recovers gradually on success.
+    """
+
+    def __init__(self, rate: float, capacity: int, name: str = ''):
+        self.name = name
+        self.max_rate = rate
+        self.min_rate = rate / 20
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self.throttled_responses = 0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def _reserve(self) -> float:
+        """Take a token and return how long the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+
+            # Tokens may go negative: later callers queue behind earlier reservations
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait without blocking the event loop until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        """Halve the rate and pause the host, e.g. after HTTP 429/503"""
+        with self._lock:
+            self.throttled_responses += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+            self.tokens = min(self.tokens, 0.0)
+        self.logger.warning(f"Throttled by {self.name}: rate lowered to {self.rate:.2f}/s, pausing {pause:.1f}s")
+
+    def reward(self):
+        """Recover the rate step by step after successful responses"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def limit_to(self, factor: float):
+        """Cap the current rate to a fraction of the maximum rate"""
+        with self._lock:
+            self.rate = max(self.min_rate, min(self.rate, self.max_rate * factor))
+
+    def update_from_response(self, status_code: int, headers: Mapping[str, str]):
+        """Adapt the rate to the throttling signals of a response"""
+        if status_code in THROTTLED_STATUS_CODES:
+            self.penalize(_parse_retry_after(headers.get('Retry-After')))
+            return
+
+        throttling = headers.get('X-Throttling-Control')
+        if throttling:
+            statuses = [status.lower() for status in THROTTLING_STATUS.findall(throttling)]
+            factor = min((THROTTLING_RATE_FACTORS[status] for status in statuses), default=1.0)
+            if factor == 0.0:
+                # "Black": the host is refusing requests, back off hard
+                self.penalize(retry_after=10.0)
+                return
+            if factor < 1.0:
+                self.limit_to(factor)
+                return
+
+        self.reward()
+
+    def stats(self) -> Dict:
+        """Current limiter state"""
+        with self._lock:
+            return {
+                'host': self.name,
+                'rate': round(self.rate, 3),
+                'max_rate': self.max_rate,
+                'capacity': self.capacity,
+                'throttled_responses': self.throttled_responses
+            }
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters: Dict[str, TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url: str) -> TokenBucket:
+    """Get the limiter shared by every client talking to the host of url"""
+    host = urlsplit(url).netloc or url
+    with _limiters_lock:
+        if host not in _limiters:
+            rate, capacity = HOST_LIMITS.get(host, DEFAULT_LIMIT)
+            _limiters[host] = TokenBucket(rate, capacity, name=host)
+        return _limiters[host]
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict]:
+    """State of every limiter created so far"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Transport adapter that waits for the host's token bucket before every send
+    and retries throttled (429/503) responses after backing off.
+    """
+
+    def __init__(self, rate_limiter: TokenBucket, throttle_retries: int = 3, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        self.throttle_retries = throttle_retries
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.throttle_retries + 1):
+            self.rate_limiter.acquire()
+            response = super().send(request, **kwargs)
+            self.rate_limiter.update_from_response(response.status_code, response.headers)
+
+            if response.status_code not in THROTTLED_STATUS_CODES or attempt == self.throttle_retries:
+                return response
+            response.close()
+        return response
@@ -1,3 +1,6 @@
+-- Trigram indexes for substring and fuzzy compound search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Remove the CREATE DATABASE and \c commands since the database is already created
 -- The container automatically connects to the mediagent database
 
@@ -9,6 +12,13 @@ CREATE TABLE compounds (
     smiles TEXT NOT NULL,
     molecular_formula VARCHAR(100),
     molecular_weight DECIMAL(10,4),
+    pref_name TEXT,
+    bioactivities_count INTEGER DEFAULT 0,
+    inchi_key VARCHAR(27),
+    -- When each freshness group (see freshness.py) was last refreshed from upstream
+    structure_refreshed_at TIMESTAMP,
+    cross_references_refreshed_at TIMESTAMP,
+    bioactivities_refreshed_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -22,7 +32,9 @@ CREATE TABLE bioactivities (
     standard_value DECIMAL(15,6),
     standard_units VARCHAR(20),
     pchembl_value DECIMAL(4,2),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(compound_id, target_chembl_id, standard_type)
 );
 
 -- Analysis results table
@@ -39,4 +51,10 @@ CREATE TABLE analysis_results (
 CREATE INDEX idx_compounds_chembl ON compounds(chembl_id);
 CREATE INDEX idx_compounds_smiles ON compounds USING hash(smiles);
 CREATE INDEX idx_bioactivities_compound ON bioactivities(compound_id);
-CREATE INDEX idx_analysis_compound ON analysis_results(compound_id);
\ No newline at end of file
+CREATE INDEX idx_analysis_compound ON analysis_results(compound_id);
+CREATE INDEX idx_analysis_lookup ON analysis_results (compound_id, analysis_type, (results->>'model'), (results->>'prompt_hash'));
+CREATE INDEX idx_compounds_inchi_key ON compounds(inchi_key);
+CREATE INDEX idx_compounds_chembl_trgm ON compounds USING gin (chembl_id gin_trgm_ops);
+CREATE INDEX idx_compounds_pref_name_trgm ON compounds USING gin (pref_name gin_trgm_ops);
+CREATE INDEX idx_compounds_formula_trgm ON compounds USING gin (molecular_formula gin_trgm_ops);
+CREATE INDEX idx_compounds_pref_name_tsv ON compounds USING gin (to_tsvector('simple', COALESCE(pref_name, '')));